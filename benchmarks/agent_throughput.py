@@ -0,0 +1,39 @@
+"""Measures how many ssh-agent messages chiffd answers per second on a single
+connection. Run with `python benchmarks/agent_throughput.py`."""
+
+import socket
+import threading
+import time
+
+import click
+
+from chiff.constants import SSHMessageType
+from chiff.socket import FrameReader, handle_connection
+from chiff.utils import length_and_data
+
+
+@click.command()
+@click.option("-n", "--messages", default=100000, show_default=True)
+@click.option("-b", "--batch", default=64, show_default=True)
+def main(messages, batch):
+    server_end, client_end = socket.socketpair()
+    thread = threading.Thread(target=handle_connection, args=(server_end, None))
+    thread.start()
+    reader = FrameReader(client_end)
+    request = length_and_data(SSHMessageType.SSH_AGENTC_EXTENSION.raw) * batch
+    start = time.perf_counter()
+    for _ in range(messages // batch):
+        client_end.sendall(request)
+        for _ in range(batch):
+            reader.read()
+    elapsed = time.perf_counter() - start
+    client_end.shutdown(socket.SHUT_WR)
+    thread.join()
+    server_end.close()
+    client_end.close()
+    total = messages // batch * batch
+    click.echo(f"{total} messages in {elapsed:.3f}s: {total / elapsed:,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
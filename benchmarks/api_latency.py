@@ -0,0 +1,75 @@
+"""Measures the latency of the API calls made by a single `chiff get` against a
+local stub server, with and without the shared connection pool. Run with
+`python benchmarks/api_latency.py`."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import statistics
+import threading
+import time
+
+import click
+import requests
+
+from chiff import api, crypto
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def respond(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = b'{"messages": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_command(keypair, url):
+    """The API calls of `chiff get`, without the decryption."""
+    api.get_session_data(keypair, "dev")
+    api.get_from_sqs(keypair, url, 0)
+    api.send_to_sns(keypair, "message", "arn", "dev")
+    api.get_from_sqs(keypair, url, 0)
+    api.delete_batch_from_volatile_queue(keypair, ["receipt-handle"], "dev")
+
+
+def measure(keypair, url, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        get_command(keypair, url)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+@click.command()
+@click.option("-n", "--runs", default=200, show_default=True)
+def main(runs):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api.API_URL = f"http://127.0.0.1:{server.server_port}"
+    keypair = crypto.create_signing_keypair(crypto.generate_seed(32))
+    url = f"{api.API_URL}/dev/sessions/queue/volatile"
+
+    pooled = measure(keypair, url, runs)
+    get_client = api.get_client
+    # Without pooling, every call opens a new connection.
+    api.get_client = lambda: requests
+    unpooled = measure(keypair, url, runs)
+    api.get_client = get_client
+    server.shutdown()
+    click.echo(f"New connection per call: {unpooled:.2f} ms per command")
+    click.echo(f"Shared connection pool:  {pooled:.2f} ms per command")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Measures how fast the accounts of a session are decrypted, one by one and in
+parallel. Run with `python benchmarks/decrypt_throughput.py`."""
+
+import json
+import time
+
+import click
+
+from chiff import crypto
+
+ACCOUNT = {
+    "id": "account_id",
+    "username": "test-username",
+    "sites": [{"id": "site_id", "url": "https://example.com", "name": "Example"}],
+    "askToLogin": True,
+    "askToChange": False,
+}
+
+
+def measure(decrypt, messages, key, runs):
+    """The best time in seconds of `runs` runs."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        decrypt(messages, key)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@click.command()
+@click.option("-n", "--runs", default=5, show_default=True)
+@click.option("-w", "--workers", default=crypto.DECRYPT_WORKERS, show_default=True)
+def main(runs, workers):
+    key = crypto.generate_seed(32)
+    plaintext = json.dumps(ACCOUNT).encode("utf-8")
+    variants = {
+        "decrypt": lambda messages, key: [crypto.decrypt(m, key) for m in messages],
+        "decrypt_many (1 thread)": lambda messages, key: crypto.decrypt_many(
+            messages, key, workers=1
+        ),
+        f"decrypt_many ({workers} threads)": lambda messages, key: crypto.decrypt_many(
+            messages, key, workers=workers
+        ),
+    }
+    for count in [10, 100, 1000, 10000, 50000]:
+        messages = [crypto.encrypt(plaintext, key) for _ in range(count)]
+        click.echo(f"{count} accounts:")
+        for name, decrypt in variants.items():
+            seconds = measure(decrypt, messages, key, runs)
+            click.echo(f"  {name:28} {seconds * 1000:9.2f}ms {count / seconds:12.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
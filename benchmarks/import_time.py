@@ -0,0 +1,63 @@
+"""Measures the startup time of the chiff CLI and chiffd, and fails if it exceeds
+the budget. Run with `python benchmarks/import_time.py`."""
+
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+ENTRY_POINTS = {
+    "chiff": "from chiff.main import main",
+    "chiffd": "from chiff.socket import main",
+}
+
+
+def startup_time(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True)
+    return time.perf_counter() - start
+
+
+def slowest_imports(code, count):
+    """The modules with the highest cumulative import time, in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, module = line.split("|")
+        imports.append((int(cumulative), module.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+@click.command()
+@click.option("-n", "--runs", default=10, show_default=True)
+@click.option(
+    "-b",
+    "--budget",
+    default=0.5,
+    show_default=True,
+    help="The maximum median startup time in seconds.",
+)
+@click.option("-t", "--top", default=5, show_default=True)
+def main(runs, budget, top):
+    baseline = statistics.median(startup_time("pass") for _ in range(runs))
+    click.echo(f"python: {baseline * 1000:.0f}ms")
+    over_budget = False
+    for name, code in ENTRY_POINTS.items():
+        median = statistics.median(startup_time(code) for _ in range(runs))
+        over_budget |= median > budget
+        click.echo(f"{name}: {median * 1000:.0f}ms (budget {budget * 1000:.0f}ms)")
+        for cumulative, module in slowest_imports(code, top):
+            click.echo(f"  {cumulative / 1000:8.1f}ms {module}")
+    if over_budget:
+        raise click.ClickException("Startup time is over budget.")
+
+
+if __name__ == "__main__":
+    main()
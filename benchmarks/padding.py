@@ -0,0 +1,53 @@
+"""Measures pad and unpad for payloads from 200 B to 10 MB, compared to the
+previous byte-by-byte implementation. Run with `python benchmarks/padding.py`."""
+
+from math import ceil
+import timeit
+
+import click
+
+from chiff import crypto
+
+SIZES = [200, 2000, 20_000, 200_000, 1_000_000, 10_000_000]
+
+
+def old_pad(src):
+    src_len = len(src)
+    block_number = ceil((src_len + 1) / crypto.PADDING_BLOCK_SIZE)
+    pad_size = block_number * crypto.PADDING_BLOCK_SIZE - src_len
+    return src + b"\x80" + bytes([0] * (pad_size - 1))
+
+
+def old_unpad(encoded_bytes):
+    for idx, byte in enumerate(reversed(encoded_bytes)):
+        pad_size = 0
+        if bytes([byte]) == b"\x80":
+            pad_size = idx + 1
+            break
+    return encoded_bytes[:-pad_size]
+
+
+def best(function, repeat):
+    number = 10
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+@click.command()
+@click.option("-r", "--repeat", default=5, show_default=True)
+def main(repeat):
+    for size in SIZES:
+        # The worst case for padding: a full block of it.
+        message = b"a" * (size - size % crypto.PADDING_BLOCK_SIZE)
+        padded = crypto.pad(message)
+        click.echo(f"{size} bytes:")
+        for name, function in {
+            "pad (old)": lambda: old_pad(message),
+            "pad": lambda: crypto.pad(message),
+            "unpad (old)": lambda: old_unpad(padded),
+            "unpad": lambda: crypto.unpad(padded),
+        }.items():
+            click.echo(f"  {name:12} {best(function, repeat) * 1e6:10.2f}µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Measures how many passwords per second are audited against a PPD, with NumPy
+and in pure Python. Run with `python benchmarks/password_audit.py`."""
+
+import secrets
+import time
+
+import click
+
+from chiff import password_audit
+from chiff.password_validator import MAXIMAL_CHARACTER_SET
+from password_generation import PPDS
+
+
+@click.command()
+@click.option("-c", "--count", default=100_000, show_default=True)
+def main(count):
+    passwords = [
+        "".join(secrets.choice(MAXIMAL_CHARACTER_SET) for _ in range(4 + i % 30))
+        for i in range(count)
+    ]
+    variants = {"python": False}
+    if password_audit.numpy is None:
+        click.echo("NumPy is not installed, install chiff[audit] to compare.")
+    else:
+        variants["numpy"] = True
+    for name, ppd in PPDS.items():
+        click.echo(f"{name}:")
+        for variant, vectorize in variants.items():
+            start = time.perf_counter()
+            password_audit.audit(passwords, ppd, vectorize)
+            seconds = time.perf_counter() - start
+            click.echo(f"  {variant:8} {count / seconds:10.0f} passwords/s")
+
+
+if __name__ == "__main__":
+    main()
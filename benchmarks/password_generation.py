@@ -0,0 +1,112 @@
+"""Measures how many passwords per second are generated for PPDs of increasing
+strictness, compared to generating random passwords until one is valid. Run with
+`python benchmarks/password_generation.py`."""
+
+import time
+
+import click
+
+from chiff.password_generator import PasswordGenerator, RandomSource
+from chiff.password_validator import PasswordValidator
+
+CHARACTER_SETS = [
+    {"characters": "abcdefghijklmnopqrstuvwxyz", "name": "LowerLetters"},
+    {"characters": "ABCDEFGHIJKLMNOPQRSTUVWXYZ", "name": "UpperLetters"},
+    {"characters": "0123456789", "name": "Numbers"},
+    {"characters": ")(*&^%$#@!{}[]:;\"'?/,.<>`~|", "name": "Specials"},
+]
+PPDS = {
+    "none": None,
+    "lengths": {
+        "characterSets": CHARACTER_SETS,
+        "properties": {"minLength": 8, "maxLength": 16},
+    },
+    "strict": {
+        "characterSets": CHARACTER_SETS,
+        "properties": {
+            "maxConsecutive": 2,
+            "minLength": 8,
+            "maxLength": 12,
+            "characterSettings": {
+                "characterSetSettings": [
+                    {"minOccurs": 1, "maxOccurs": 2, "name": "Specials"},
+                    {"minOccurs": 2, "maxOccurs": None, "name": "UpperLetters"},
+                ],
+                "positionRestrictions": [
+                    {
+                        "positions": "0",
+                        "minOccurs": 1,
+                        "maxOccurs": 1,
+                        "characterSet": "UpperLetters",
+                    }
+                ],
+                "requirementGroups": [
+                    {
+                        "minRules": 2,
+                        "requirementRules": [
+                            {
+                                "positions": "-1,-2",
+                                "minOccurs": 2,
+                                "maxOccurs": 2,
+                                "characterSet": "Numbers",
+                            },
+                            {
+                                "minOccurs": 3,
+                                "maxOccurs": None,
+                                "characterSet": "LowerLetters",
+                            },
+                        ],
+                    }
+                ],
+            },
+        },
+    },
+}
+
+
+def generate_and_reject(ppd, count, max_attempts):
+    """Generate random passwords until one is valid. Returns the number of attempts,
+    or `None` if it took more than `max_attempts` for a single password."""
+    generator = PasswordGenerator(ppd)
+    validator = PasswordValidator(ppd)
+    random = RandomSource()
+    length = generator.default_length()
+    attempts = 0
+    for _ in range(count):
+        for _ in range(max_attempts):
+            attempts += 1
+            password = "".join(
+                random.choice(generator.characters) for _ in range(length)
+            )
+            if validator.validate(password):
+                break
+        else:
+            return None
+    return attempts
+
+
+@click.command()
+@click.option("-c", "--count", default=10_000, show_default=True)
+@click.option("--max-attempts", default=100_000, show_default=True)
+def main(count, max_attempts):
+    for name, ppd in PPDS.items():
+        generator = PasswordGenerator(ppd)
+        start = time.perf_counter()
+        for _ in range(count):
+            generator.generate()
+        seconds = time.perf_counter() - start
+        click.echo(f"{name}: {count / seconds:.0f} passwords/s")
+        start = time.perf_counter()
+        attempts = generate_and_reject(ppd, count // 10, max_attempts)
+        seconds = time.perf_counter() - start
+        if attempts is None:
+            click.echo(f"  generate and reject: gave up after {max_attempts} attempts")
+        else:
+            click.echo(
+                f"  generate and reject: {count // 10 / seconds:.0f} passwords/s, "
+                f"{attempts / (count // 10):.1f} attempts per password"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measures how many passwords per second are validated against a PPD. Run with
+`python benchmarks/password_validation.py`."""
+
+import secrets
+import time
+
+import click
+
+from chiff.password_validator import MAXIMAL_CHARACTER_SET, PasswordValidator
+
+PPD = {
+    "characterSets": [
+        {"characters": "abcdefghijklmnopqrstuvwxyz", "name": "LowerLetters"},
+        {"characters": "ABCDEFGHIJKLMNOPQRSTUVWXYZ", "name": "UpperLetters"},
+        {"characters": "0123456789", "name": "Numbers"},
+        {"characters": ")(*&^%$#@!{}[]:;\"'?/,.<>`~|", "name": "Specials"},
+    ],
+    "properties": {
+        "maxConsecutive": 3,
+        "minLength": 8,
+        "maxLength": 32,
+        "characterSettings": {
+            "characterSetSettings": [
+                {"minOccurs": 1, "maxOccurs": None, "name": "UpperLetters"}
+            ],
+            "positionRestrictions": [
+                {
+                    "positions": "0",
+                    "minOccurs": 0,
+                    "maxOccurs": 0,
+                    "characterSet": "Specials",
+                }
+            ],
+            "requirementGroups": [
+                {
+                    "minRules": 2,
+                    "requirementRules": [
+                        {"minOccurs": 1, "maxOccurs": None, "characterSet": "Numbers"},
+                        {
+                            "minOccurs": 1,
+                            "maxOccurs": None,
+                            "characterSet": "Specials",
+                        },
+                        {
+                            "positions": "-1",
+                            "minOccurs": 1,
+                            "maxOccurs": None,
+                            "characterSet": "LowerLetters",
+                        },
+                    ],
+                }
+            ],
+        },
+    },
+}
+
+
+def candidates(count, characters):
+    return [
+        "".join(secrets.choice(characters) for _ in range(8 + i % 25))
+        for i in range(count)
+    ]
+
+
+@click.command()
+@click.option("-c", "--count", default=100_000, show_default=True)
+@click.option(
+    "--characters",
+    default=MAXIMAL_CHARACTER_SET.replace(" ", "").replace("\\", "").replace("+", ""),
+    help="The characters of the candidates.",
+)
+def main(count, characters):
+    passwords = candidates(count, characters)
+    start = time.perf_counter()
+    validator = PasswordValidator(PPD)
+    valid = sum(validator.validate(password) for password in passwords)
+    seconds = time.perf_counter() - start
+    click.echo(
+        f"{count} candidates in {seconds * 1000:.0f}ms ({count / seconds:.0f}/s), "
+        f"{valid} valid"
+    )
+
+
+if __name__ == "__main__":
+    main()
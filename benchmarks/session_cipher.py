@@ -0,0 +1,35 @@
+"""Measures the cost per message of encrypting and decrypting with a prepared
+SessionCipher, compared to preparing the key for every message. Run with
+`python benchmarks/session_cipher.py`."""
+
+import json
+import timeit
+
+import click
+
+from chiff import crypto
+
+REQUEST = {"r": 1, "b": 42, "z": 1600000000000, "s": "site_id", "a": "account_id"}
+
+
+@click.command()
+@click.option("-n", "--number", default=20000, show_default=True)
+@click.option("-r", "--repeat", default=5, show_default=True)
+def main(number, repeat):
+    key = crypto.generate_seed(32)
+    cipher = crypto.SessionCipher(key)
+    message = json.dumps(REQUEST).encode("utf-8")
+    ciphertext = cipher.encrypt(message)
+    variants = {
+        "crypto.encrypt": lambda: crypto.encrypt(message, key),
+        "SessionCipher.encrypt": lambda: cipher.encrypt(message),
+        "crypto.decrypt": lambda: crypto.decrypt(ciphertext, key),
+        "SessionCipher.decrypt": lambda: cipher.decrypt(ciphertext),
+    }
+    for name, function in variants.items():
+        seconds = min(timeit.repeat(function, number=number, repeat=repeat))
+        click.echo(f"{name:24} {seconds / number * 1e6:8.2f}µs per message")
+
+
+if __name__ == "__main__":
+    main()
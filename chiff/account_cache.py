@@ -0,0 +1,138 @@
+from chiff import crypto
+from chiff.constants import ACCOUNT_CACHE_NAME, APP_NAME, SECRET_ACCOUNT_FIELDS
+from chiff.utils import write_atomically
+from pathlib import Path
+import click
+import json
+import logging
+import os
+import threading
+
+ACCOUNT_CACHE_FORMAT_VERSION = 1
+
+
+class AccountCache:
+    """Keeps the decrypted accounts of a session on disk, encrypted with the session
+    key, so only accounts that changed have to be decrypted again. Secret fields,
+    like passwords, are never stored. The ETag of the session data is stored as
+    well, so unchanged session data doesn't have to be downloaded. The cache can be
+    shared by threads."""
+
+    def __init__(self, cipher, session_id):
+        self.cipher = cipher
+        self.session_id = session_id
+        self.lock = threading.Lock()
+        self.etag = None
+        self.entries = {}
+        self.stat_key = None
+        self.modified = False
+
+    @property
+    def path(self):
+        return Path(click.get_app_dir(APP_NAME), ACCOUNT_CACHE_NAME)
+
+    def load(self):
+        """Load the cache file, if it changed since it was last loaded or saved.
+        Returns the ETag of the session data the cache was synced with."""
+        with self.lock:
+            self.__load()
+            return self.etag
+
+    def __load(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.__clear()
+            return
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stat_key == self.stat_key:
+            return
+        self.__clear()
+        try:
+            with open(self.path, "rb") as f:
+                data = json.loads(self.cipher.decrypt(f.read().decode("utf-8")))
+        except Exception as err:
+            logging.warning(f"Ignoring unreadable account cache: {err}")
+            return
+        if (
+            data["format"] != ACCOUNT_CACHE_FORMAT_VERSION
+            or data["sessionId"] != self.session_id
+        ):
+            return
+        self.etag = data["etag"]
+        self.entries = data["accounts"]
+        self.stat_key = stat_key
+
+    def sync(self, accounts):
+        """Get the decrypted accounts for the encrypted accounts of the session data.
+        Only accounts that aren't in the cache with the same ciphertext are
+        decrypted."""
+        with self.lock:
+            return self.__sync(accounts)
+
+    def __sync(self, accounts):
+        entries = {}
+        changed = []
+        for id, ciphertext in accounts.items():
+            digest = crypto.generic_hash_string(ciphertext)
+            entry = self.entries.get(id)
+            if not entry or entry["digest"] != digest:
+                entry = {"digest": digest, "object": None}
+                changed.append(id)
+            entries[id] = entry
+        plaintexts = self.cipher.decrypt_many([accounts[id] for id in changed])
+        for id, plaintext in zip(changed, plaintexts):
+            object = json.loads(plaintext)
+            object.setdefault("id", id)
+            for field in SECRET_ACCOUNT_FIELDS:
+                object.pop(field, None)
+            entries[id]["object"] = object
+        logging.debug(f"Decrypted {len(changed)} of {len(accounts)} accounts.")
+        self.modified = bool(changed) or len(entries) != len(self.entries)
+        self.entries = entries
+        return self.__objects()
+
+    def objects(self):
+        """The decrypted accounts in the cache."""
+        with self.lock:
+            return self.__objects()
+
+    def __objects(self):
+        return {id: entry["object"] for id, entry in self.entries.items()}
+
+    def save(self, etag):
+        """Write the cache file, with the ETag of the session data it was synced
+        with. Nothing is written if neither changed."""
+        with self.lock:
+            self.__save(etag)
+
+    def __save(self, etag):
+        if self.stat_key and not self.modified and etag == self.etag:
+            return
+        self.etag = etag
+        data = {
+            "format": ACCOUNT_CACHE_FORMAT_VERSION,
+            "sessionId": self.session_id,
+            "etag": etag,
+            "accounts": self.entries,
+        }
+        write_atomically(
+            self.path,
+            self.cipher.encrypt(json.dumps(data).encode("utf-8")).encode("utf-8"),
+        )
+        stat = os.stat(self.path)
+        self.stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.modified = False
+
+    def remove(self):
+        """Remove the cache file."""
+        with self.lock:
+            self.__clear()
+            if self.path.exists():
+                os.remove(self.path)
+
+    def __clear(self):
+        self.etag = None
+        self.entries = {}
+        self.stat_key = None
+        self.modified = False
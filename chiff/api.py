@@ -1,18 +1,62 @@
+import threading
 import time
 
 import json
 import requests
+from requests.adapters import HTTPAdapter
 
 from chiff import crypto
 
 API_URL = "https://api.chiff.dev"
 ENV = "v1"
+POOL_SIZE = 10
+# Long polls on the queues take up to 20 seconds.
+TIMEOUT = (10, 30)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class Client(requests.Session):
+    """A HTTP client that keeps a pool of connections to the API alive between
+    requests and applies a default timeout."""
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def get_client():
+    """Get the HTTP client that is shared by all API calls."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = Client()
+    return _client
+
+
+def configure(pool_size=POOL_SIZE, timeout=TIMEOUT):
+    """Replace the shared HTTP client with one with a different pool size or
+    timeout."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = Client(pool_size, timeout)
 
 
 def create_pairing_queue(keypair):
     pub_key, headers, params = sign_request({"httpMethod": "POST"}, keypair)
     url = f"{API_URL}/{ENV}/sessions/{pub_key}/pairing"
-    response = requests.post(url, params=params, headers=headers)
+    response = get_client().post(url, params=params, headers=headers)
     if response:
         return response.json()
     else:
@@ -22,7 +66,7 @@ def create_pairing_queue(keypair):
 def delete_pairing_queue(keypair):
     pub_key, headers, params = sign_request({"httpMethod": "DELETE"}, keypair)
     url = f"{API_URL}/{ENV}/sessions/{pub_key}/pairing"
-    response = requests.delete(url, params=params, headers=headers)
+    response = get_client().delete(url, params=params, headers=headers)
     if response:
         return response.json()
     else:
@@ -32,18 +76,40 @@ def delete_pairing_queue(keypair):
 def delete_queues(keypair, env):
     pub_key, headers, params = sign_request({"httpMethod": "DELETE"}, keypair)
     url = f"{API_URL}/{get_endpoint(env)}/sessions/{pub_key}"
-    response = requests.delete(url, params=params, headers=headers)
+    response = get_client().delete(url, params=params, headers=headers)
     if response:
         return response.json()
     else:
         raise Exception(f"Error {response.status_code}: {response.text}")
 
 
-def get_session_data(keypair, env):
+def get_session_data(keypair, env, etag=None):
+    """Get the session data. If an ETag is provided and the data hasn't changed,
+    returns `None`. Otherwise, the ETag of the data, if any, is added as `etag`."""
     pub_key, headers, params = sign_request({"httpMethod": "GET"}, keypair)
+    if etag:
+        headers["If-None-Match"] = etag
     url = f"{API_URL}/{get_endpoint(env)}/sessions/{pub_key}"
-    response = requests.get(url, params=params, headers=headers)
-    if response:
+    response = get_client().get(url, params=params, headers=headers)
+    if response.status_code == 304:
+        return None
+    elif response:
+        session_data = response.json()
+        if "ETag" in response.headers:
+            session_data["etag"] = response.headers["ETag"]
+        return session_data
+    else:
+        raise Exception(f"Error {response.status_code}: {response.text}")
+
+
+def get_ppd(site_id, env):
+    """Get the password policy (PPD) of a site. Returns `None` if the site doesn't
+    have one."""
+    url = f"{API_URL}/{get_endpoint(env)}/ppd/{site_id}"
+    response = get_client().get(url)
+    if response.status_code == 404:
+        return None
+    elif response:
         return response.json()
     else:
         raise Exception(f"Error {response.status_code}: {response.text}")
@@ -53,7 +119,7 @@ def get_from_sqs(keypair, url, wait_time):
     pub_key, headers, params = sign_request(
         {"httpMethod": "GET", "waitTime": wait_time}, keypair
     )
-    response = requests.get(url, params=params, headers=headers)
+    response = get_client().get(url, params=params, headers=headers)
     if response:
         return response.json()
     else:
@@ -65,7 +131,7 @@ def send_to_sns(keypair, message, arn, env):
         {"httpMethod": "PUT", "data": message, "arn": arn}, keypair
     )
     url = f"{API_URL}/{get_endpoint(env)}/sessions/{pub_key}/push"
-    response = requests.put(url, params=params, headers=headers)
+    response = get_client().put(url, params=params, headers=headers)
     if response:
         return response.json()
     else:
@@ -77,7 +143,7 @@ def delete_from_volatile_queue(keypair, receipt_handle, env):
         {"httpMethod": "DELETE", "receiptHandle": receipt_handle}, keypair
     )
     url = f"{API_URL}/{get_endpoint(env)}/sessions/{pub_key}/volatile"
-    response = requests.delete(url, params=params, headers=headers)
+    response = get_client().delete(url, params=params, headers=headers)
     if response:
         return response.json()
     else:
@@ -93,7 +159,7 @@ def send_bulk_accounts(data, keypair, env):
     }
     pub_key = pub_key.decode().rstrip("=")
     url = f"{API_URL}/{get_endpoint(env)}/sessions/{pub_key}/accounts/import"
-    response = requests.put(url, json=message, headers=headers)
+    response = get_client().put(url, json=message, headers=headers)
     if response:
         return response.json()
     else:
@@ -0,0 +1,63 @@
+from chiff import api
+from chiff.constants import IMPORT_WORKERS
+from chiff.utils import get_site_ids_batch
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import logging
+
+
+def chunked(iterable, size):
+    """Split an iterable in lists of at most `size` items, without reading it all."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def add_site_ids(chunks, executor=None):
+    """Add the siteID of their url to every account in the chunks of accounts."""
+    for chunk in chunks:
+        site_ids = get_site_ids_batch([account["l"] for account in chunk], executor)
+        for account, (site_id, _) in zip(chunk, site_ids):
+            account["s"] = site_id
+        yield chunk
+
+
+def audit_accounts(accounts, env, workers=IMPORT_WORKERS):
+    """Check the passwords of the accounts against the PPD of their site. The PPDs
+    are fetched with at most `workers` requests in parallel. Returns the accounts
+    with a password that doesn't satisfy the PPD, with the reasons, and the accounts
+    that couldn't be checked because the PPD of their site couldn't be fetched."""
+    from chiff.password_audit import audit
+
+    sites = {}
+    site_ids = get_site_ids_batch([account["l"] for account in accounts])
+    for account, (site_id, _) in zip(accounts, site_ids):
+        sites.setdefault(site_id, []).append(account)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        ppds = executor.map(lambda site_id: fetch_ppd(site_id, env), sites)
+        ppds = dict(zip(sites, ppds))
+    failures = []
+    unchecked = []
+    for site_id, site_accounts in sites.items():
+        ppd, error = ppds[site_id]
+        if error:
+            unchecked += site_accounts
+        if ppd is None:
+            continue
+        passwords = [account["p"] or "" for account in site_accounts]
+        for account, reasons in zip(site_accounts, audit(passwords, ppd)):
+            if reasons:
+                failures.append((account, reasons))
+    return failures, unchecked
+
+
+def fetch_ppd(site_id, env):
+    """The PPD of a site, or `None` if it has none, and whether fetching it failed.
+    A failure only skips the accounts of that site, instead of the whole audit."""
+    try:
+        return api.get_ppd(site_id, env), False
+    except Exception as err:
+        logging.warning(f"Could not fetch the PPD of site {site_id}: {err}")
+        return None, True
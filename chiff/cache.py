@@ -0,0 +1,164 @@
+from chiff.constants import (
+    APP_NAME,
+    IDENTITIES_STAMP,
+    IDENTITY_CACHE_TTL,
+    PAIRING_CHECK_INTERVAL,
+)
+from chiff.session import Session
+from pathlib import Path
+import click
+import logging
+import os
+import threading
+import time
+
+# Seconds to wait before watching the session again after polling failed.
+WATCH_RETRY_INTERVAL = 5
+# Identities are refreshed for an unknown key at most once in this many seconds.
+MISS_REFRESH_INTERVAL = 5
+
+
+def invalidate_identities():
+    """Notify running daemons that the SSH identities of the session have changed."""
+    Path(click.get_app_dir(APP_NAME), IDENTITIES_STAMP).touch()
+
+
+class IdentityCache:
+    """Keeps the session and its SSH identities in memory, so identity requests don't
+    have to fetch and decrypt the session data. Identities older than `ttl` seconds
+    are still served, while they are refreshed in the background. The cache is
+    invalidated when the session file changes or disappears, or when
+    `invalidate_identities` is called.
+
+    With `watch`, a background thread waits for the app to end the session, so
+    loading the session doesn't have to check it. Otherwise, it is checked at most
+    every `PAIRING_CHECK_INTERVAL` seconds."""
+
+    def __init__(self, ttl=IDENTITY_CACHE_TTL, watch=False):
+        self.ttl = ttl
+        self.watch = watch
+        self.lock = threading.Lock()
+        self.session = None
+        self.identities = []
+        self.token = None
+        self.updated = None
+        self.refresh_thread = None
+        self.watch_thread = None
+        self.watched_id = None
+
+    def get(self):
+        """Get the session and its SSH identities. Returns `None` and an empty list if
+        there is no active session."""
+        token = self.__token()
+        with self.lock:
+            if token is None:
+                self.__clear()
+                return None, []
+            if self.updated is not None and token == self.token:
+                if time.monotonic() - self.updated > self.ttl:
+                    self.__refresh_in_background()
+                return self.session, self.identities
+        return self.refresh()
+
+    def find(self, pubkey, key_type):
+        """Get the session and the SSH identity matching the public key. The
+        identities are refreshed once if the key can't be found, since it may have
+        been created after the last refresh, unless they were refreshed in the last
+        `MISS_REFRESH_INTERVAL` seconds. Keys of other agents are never found, so
+        they don't make every request fetch the session data."""
+        session = self.get()[0]
+        identity = session and session.get_ssh_identity(pubkey, key_type)
+        with self.lock:
+            recent = (
+                self.updated is not None
+                and time.monotonic() - self.updated < MISS_REFRESH_INTERVAL
+            )
+        if session and not identity and not recent:
+            session = self.refresh()[0]
+            identity = session and session.get_ssh_identity(pubkey, key_type)
+        return session, identity
+
+    def refresh(self):
+        """Load the session and fetch its SSH identities."""
+        session = Session.get(None if self.watch else PAIRING_CHECK_INTERVAL)
+        identities = session.get_ssh_identities() if session else []
+        logging.info(f"Cached {len(identities)} identities.")
+        # Fetching the session data may update the session file.
+        token = self.__token()
+        with self.lock:
+            if session:
+                self.session = session
+                self.identities = identities
+                self.token = token
+                self.updated = time.monotonic()
+                if self.watch:
+                    self.__watch(session)
+            else:
+                self.__clear()
+        return session, identities
+
+    def invalidate(self):
+        """Make sure the next request refreshes the identities."""
+        with self.lock:
+            self.__clear()
+
+    def __refresh_in_background(self):
+        if self.refresh_thread and self.refresh_thread.is_alive():
+            return
+
+        def refresh():
+            try:
+                self.refresh()
+            except Exception as err:
+                logging.error(f"Refreshing identities failed: {err}")
+
+        self.refresh_thread = threading.Thread(target=refresh, daemon=True)
+        self.refresh_thread.start()
+
+    def __watch(self, session):
+        """Start watching the session, unless it is already watched."""
+        alive = self.watch_thread and self.watch_thread.is_alive()
+        if alive and self.watched_id == session.id:
+            return
+        self.watched_id = session.id
+        self.watch_thread = threading.Thread(
+            target=self.__watch_session, args=(session,), daemon=True
+        )
+        self.watch_thread.start()
+
+    def __watch_session(self, session):
+        """Wait for messages from the app until it ends the session, or the session
+        is no longer cached."""
+        logging.info(f"Watching session {session.id}.")
+        while True:
+            with self.lock:
+                if self.session is None or self.session.id != session.id:
+                    return
+            try:
+                if not session.pairing_status(True):
+                    logging.info("Session ended by the app.")
+                    self.invalidate()
+                    return
+            except Exception as err:
+                logging.error(f"Watching session failed: {err}")
+                time.sleep(WATCH_RETRY_INTERVAL)
+
+    def __clear(self):
+        self.session = None
+        self.identities = []
+        self.token = None
+        self.updated = None
+
+    @staticmethod
+    def __token():
+        """Identifies the current session file and the last invalidation."""
+        app_dir = click.get_app_dir(APP_NAME)
+        try:
+            session_stat = os.stat(Path(app_dir, "session"))
+        except FileNotFoundError:
+            return None
+        try:
+            stamp = os.stat(Path(app_dir, IDENTITIES_STAMP)).st_mtime_ns
+        except FileNotFoundError:
+            stamp = None
+        return app_dir, session_stat.st_ino, session_stat.st_mtime_ns, stamp
@@ -2,6 +2,32 @@ from enum import Enum
 
 APP_NAME = "Chiff"
 SOCKET_NAME = "chiff-socket.ssh"
+CONTROL_SOCKET_NAME = "chiff-control.sock"
+DEFAULT_BACKLOG = 16
+DEFAULT_MAX_CLIENTS = 8
+FRAME_BUFFER_SIZE = 4096
+MAX_AGENT_MESSAGE_SIZE = 256 * 1024
+MAX_CONTROL_MESSAGE_SIZE = 16 * 1024 * 1024
+IDENTITY_CACHE_TTL = 60
+IDENTITIES_STAMP = "identities"
+PAIRING_CHECK_INTERVAL = 60
+PAIRING_STAMP = "pairing-checked"
+SESSION_FORMAT_VERSION = 1
+ACCOUNT_CACHE_NAME = "accounts"
+# Account fields that are never written to the account cache.
+SECRET_ACCOUNT_FIELDS = ("password", "notes", "tokenSecret", "tokenURL")
+SIGN_REQUEST_TIMEOUT = 180
+# Seconds the CLI waits for chiffd to answer a command on the control socket.
+CONTROL_TIMEOUT = 30
+# Seconds a request through chiffd waits for the phone if no timeout is given.
+REMOTE_REQUEST_TIMEOUT = 600
+# The maximum number of messages SQS deletes in one batch.
+IMPORT_CHUNK_SIZE = 500
+IMPORT_WORKERS = 4
+SITE_ID_CACHE_SIZE = 4096
+TLD_FETCH_TIMEOUT = 10
+# Use the public suffix list bundled with tldextract instead of fetching it.
+TLD_SNAPSHOT_ENV = "CHIFF_TLD_SNAPSHOT"
 
 systemd_service = """\
 [Unit]
@@ -1,4 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
+import os
 
 import nacl.encoding
 import nacl.secret
@@ -9,6 +11,9 @@ import nacl.public
 
 SEED_SIZE = 16
 PADDING_BLOCK_SIZE = 200
+DECRYPT_WORKERS = min(4, os.cpu_count() or 1)
+# Below this number of messages, starting threads costs more than it saves.
+PARALLEL_DECRYPT_THRESHOLD = 512
 
 
 def generate_seed(size=SEED_SIZE):
@@ -30,21 +35,56 @@ def verify(message64, pub_key: nacl.signing.VerifyKey):
     )
 
 
+class SessionCipher:
+    """Encrypts and decrypts messages with a symmetric key. The key is prepared once,
+    so use a single cipher for all messages with the same key."""
+
+    def __init__(self, key):
+        self.box = nacl.secret.SecretBox(key)
+
+    def encrypt(self, message):
+        return (
+            self.box.encrypt(pad(message), encoder=nacl.encoding.URLSafeBase64Encoder)
+            .decode("utf-8")
+            .rstrip("=")
+        )
+
+    def decrypt(self, message):
+        return unpad(
+            self.box.decrypt(
+                add_padding(message), encoder=nacl.encoding.URLSafeBase64Encoder
+            )
+        )
+
+    def encrypt_many(self, messages):
+        return [self.encrypt(message) for message in messages]
+
+    def decrypt_many(self, messages, workers=DECRYPT_WORKERS):
+        """Decrypt a list of messages. Large lists are split over `workers` threads,
+        since libsodium releases the GIL."""
+        messages = list(messages)
+        if workers <= 1 or len(messages) < PARALLEL_DECRYPT_THRESHOLD:
+            return [self.decrypt(message) for message in messages]
+        size = ceil(len(messages) / workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunks = executor.map(
+                lambda chunk: [self.decrypt(message) for message in chunk],
+                [messages[i : i + size] for i in range(0, len(messages), size)],
+            )
+            return [plaintext for chunk in chunks for plaintext in chunk]
+
+
 def encrypt(message, key):
-    box = nacl.secret.SecretBox(key)
-    return (
-        box.encrypt(pad(message), encoder=nacl.encoding.URLSafeBase64Encoder)
-        .decode("utf-8")
-        .rstrip("=")
-    )
+    return SessionCipher(key).encrypt(message)
 
 
 def decrypt(message, key):
-    return unpad(
-        nacl.secret.SecretBox(key).decrypt(
-            add_padding(message), encoder=nacl.encoding.URLSafeBase64Encoder
-        )
-    )
+    return SessionCipher(key).decrypt(message)
+
+
+def decrypt_many(messages, key, workers=DECRYPT_WORKERS):
+    """Decrypt a list of messages that are encrypted with the same key."""
+    return SessionCipher(key).decrypt_many(messages, workers)
 
 
 def decrypt_anonymous(message, key: nacl.public.PrivateKey):
@@ -63,6 +103,10 @@ def generate_shared_key(pub_key_64, priv_key):
     return nacl.public.Box(priv_key, pub_key).shared_key()
 
 
+def load_private_key(data):
+    return nacl.public.PrivateKey(data)
+
+
 def generate_keypair():
     priv_key = nacl.public.PrivateKey.generate()
     return (
@@ -105,16 +149,17 @@ def from_base64(str):
 
 
 def pad(src):
-    src_len = len(src)
-    block_number = ceil((src_len + 1) / PADDING_BLOCK_SIZE)
-    pad_size = block_number * PADDING_BLOCK_SIZE - src_len
-    return src + b"\x80" + bytes([0] * (pad_size - 1))
+    """Pad to a multiple of the block size with 0x80 followed by zero bytes."""
+    pad_size = PADDING_BLOCK_SIZE - len(src) % PADDING_BLOCK_SIZE
+    return b"".join((src, b"\x80", bytes(pad_size - 1)))
 
 
 def unpad(encoded_bytes):
-    for idx, byte in enumerate(reversed(encoded_bytes)):
-        pad_size = 0
-        if bytes([byte]) == b"\x80":
-            pad_size = idx + 1
-            break
-    return encoded_bytes[:-pad_size]
+    """Remove the padding added by `pad`. Raises a `ValueError` if the padding is
+    invalid."""
+    idx = encoded_bytes.rfind(b"\x80")
+    if idx < 0:
+        raise ValueError("Invalid padding: no padding marker.")
+    if encoded_bytes.count(0, idx + 1) != len(encoded_bytes) - idx - 1:
+        raise ValueError("Invalid padding: non-zero bytes after the padding marker.")
+    return encoded_bytes[:idx]
@@ -1,20 +1,18 @@
+from chiff.cache import invalidate_identities
+from chiff.remote import RemoteSession
 from chiff.setup import chiff_init
 from chiff.ssh_key import Key, KeyType
 from chiff.utils import check_response
 from chiff.crypto import from_base64
 from chiff.utils import get_site_ids
+from contextlib import ExitStack
 import click
 import json
-import csv
-
-from pykeepass import PyKeePass
-from pykeepass.exceptions import CredentialsError
 
 
 from chiff import crypto
-from chiff.constants import MessageType
+from chiff.constants import IMPORT_CHUNK_SIZE, IMPORT_WORKERS, MessageType
 
-from tabulate import tabulate
 from chiff.session import Session
 from pathlib import Path
 from chiff.constants import APP_NAME
@@ -34,7 +32,7 @@ def main():
 def pair():
     """Pair with a new device."""
     Path(click.get_app_dir(APP_NAME)).mkdir(parents=True, exist_ok=True)
-    session = Session.get()
+    session = Session.get(0)
     if session:
         if click.confirm(
             "A session already exists. Do you want to end the current session?"
@@ -53,7 +51,7 @@ def pair():
 @main.command()
 def unpair():
     """Unpair from a currently paired device."""
-    session = Session.get()
+    session = Session.get(0)
     if session:
         if click.confirm("Are you sure you want to end the current session?"):
             session.end()
@@ -85,7 +83,7 @@ def get(id, notes, format_json, skip):
     """Get data from a currently paired device. Only returns the password by default,
     but you can retrieve the notes by setting the -n flag or
     all data with the -j flag as JSON."""
-    session, accounts = get_session(skip)
+    session, accounts = get_session(skip, remote=True)
     request = {"a": id, "r": MessageType.GET_DETAILS.value}
     if not skip:
         request["n"] = accounts[id]["sites"][0]["name"]
@@ -127,17 +125,37 @@ def get(id, notes, format_json, skip):
 @click.option(
     "-p",
     "--password",
-    prompt="Enter a the password",
-    hide_input=True,
-    required=True,
-    confirmation_prompt=True,
-    help="The password of the account you want to add. Will be prompted"
+    help="The password of the account you want to add. Will be prompted "
     "for if not provided",
 )
+@click.option(
+    "-g",
+    "--generate",
+    is_flag=True,
+    help="Generate the password instead of providing it.",
+)
+@click.option(
+    "--ppd",
+    type=click.Path(exists=True, dir_okay=False, allow_dash=True),
+    help="A JSON file with the password policy (PPD) the generated password must "
+    "satisfy.",
+)
 @click.option("-n", "--notes", help="The notes of the account you want to add")
-def add(username, url, name, password, notes):
+def add(username, url, name, password, generate, ppd, notes):
     """Add a new account with the provided data."""
-    session = get_session(True)[0]
+    if password and generate:
+        raise click.UsageError("Provide either --password or --generate, not both.")
+    if generate:
+        from chiff.password_generator import PasswordGenerator
+
+        password = generate_password(PasswordGenerator(load_ppd(ppd)))
+    elif ppd:
+        raise click.UsageError("--ppd can only be used with --generate.")
+    elif not password:
+        password = click.prompt(
+            "Enter a the password", hide_input=True, confirmation_prompt=True
+        )
+    session = get_session(True, remote=True)[0]
     site_id = get_site_ids(url)[0]
     request = {
         "s": site_id,
@@ -202,7 +220,9 @@ def update(id, username, url, name, password, notes):
 @main.command(short_help="Shows the status of the current session.")
 def status():
     """Shows the status of the current session and an overview of all accounts."""
-    session = Session.get()
+    from tabulate import tabulate
+
+    session = load_session()
     if session:
         click.echo(f"There is an active session with id {session.id}.\n")
         accounts, identities = session.get_session_data()
@@ -244,7 +264,7 @@ def status():
     help="Return account in JSON format that Alfred understands",
 )
 def accounts(alfred):
-    session = Session.get()
+    session = load_session()
     accounts, _ = session.get_session_data()
     if alfred:
         accounts = list(
@@ -294,21 +314,119 @@ def accounts(alfred):
     is_flag=True,
     help="Whether the first row should be skipped. Only relevant when format is CSV.",
 )
-def import_accounts(format, path, skip):
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=IMPORT_WORKERS,
+    show_default=True,
+    help="The number of password policies that are fetched in parallel with "
+    "--audit.",
+)
+@click.option(
+    "-P",
+    "--processes",
+    type=click.IntRange(min=1),
+    help="Compute the site ids of the accounts in this many processes. Only useful "
+    "for very large imports with many different sites.",
+)
+@click.option(
+    "-a",
+    "--audit",
+    is_flag=True,
+    help="Check the passwords against the password policy of their site before "
+    "importing.",
+)
+def import_accounts(format, path, skip, jobs, processes, audit):
     """Import accounts from csv, json or kdbx (KeePass) file."""
+    from chiff.bulk_import import add_site_ids, chunked
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import chain
+
     click.echo("Starting account import...")
     session = get_session(False)[0]
-    new_accounts = []
-    if format == "csv":
-        new_accounts.extend(parse_csv(path, skip))
-    elif format == "json":
-        new_accounts.extend(parse_json(path))
-    elif format == "kdbx":
-        new_accounts.extend(parse_kdbx(path))
-    click.echo(f"Sending {len(new_accounts)} accounts to phone...")
-    response = session.send_bulk_accounts(new_accounts)
+    new_accounts = parse_accounts(format, path, skip)
+    if audit:
+        new_accounts = list(new_accounts)
+        audit_import(new_accounts, session.env, jobs)
+    with ExitStack() as stack:
+        executor = None
+        if processes and processes > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(processes))
+        chunks = add_site_ids(chunked(new_accounts, IMPORT_CHUNK_SIZE), executor)
+        accounts = list(chain.from_iterable(chunks))
+    click.echo(f"Sending {len(accounts)} accounts to phone...")
+    response = session.send_bulk_accounts(accounts)
     if check_response(response, click.echo):
-        click.echo(f"{len(new_accounts)} accounts successfully imported!")
+        click.echo(f"{len(accounts)} accounts successfully imported!")
+
+
+def audit_import(accounts, env, jobs):
+    """List the accounts with a password that doesn't satisfy the password policy of
+    their site, and ask whether to import them anyway."""
+    from chiff.bulk_import import audit_accounts
+
+    failures, unchecked = audit_accounts(accounts, env, jobs)
+    for account, reasons in failures:
+        click.echo(f"{account['n']} ({account['u']}): {', '.join(reasons)}")
+    if unchecked:
+        click.echo(
+            f"Could not fetch the password policy of the site of {len(unchecked)} "
+            "accounts, their passwords weren't checked: "
+            + ", ".join(f"{account['n']} ({account['u']})" for account in unchecked)
+        )
+    if failures:
+        click.confirm(
+            f"{len(failures)} of {len(accounts)} passwords don't satisfy the "
+            "password policy of their site. Import anyway?",
+            abort=True,
+        )
+    elif not unchecked:
+        click.echo("All passwords satisfy the password policy of their site.")
+
+
+@main.command(short_help="Generate passwords.")
+@click.option(
+    "--ppd",
+    type=click.Path(exists=True, dir_okay=False, allow_dash=True),
+    help="A JSON file with the password policy (PPD) the passwords must satisfy.",
+)
+@click.option(
+    "-l",
+    "--length",
+    type=click.IntRange(min=1),
+    help="The length of the passwords. Defaults to 22 characters, within the bounds "
+    "of the PPD.",
+)
+@click.option(
+    "-c",
+    "--count",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="The number of passwords to generate.",
+)
+def generate(ppd, length, count):
+    """Generate random passwords, without a session. With a PPD, the passwords satisfy
+    the password policy of that site."""
+    from chiff.password_generator import PasswordGenerator
+
+    generator = PasswordGenerator(load_ppd(ppd))
+    try:
+        for _ in range(count):
+            click.echo(generate_password(generator, length))
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--length")
+
+
+def generate_password(generator, length=None):
+    """Generate a password, and report a PPD that can't be satisfied to the user."""
+    from chiff.password_generator import PasswordGenerationError
+
+    try:
+        return generator.generate(length)
+    except PasswordGenerationError as err:
+        raise click.ClickException(str(err))
 
 
 @main.command(name="ssh-keygen", short_help="Generate a new SSH key on your phone.")
@@ -343,6 +461,7 @@ def create_ssh_key(name, algorithm):
         request["g"] = [-8]  # Cose identifier for EdDSA
     response = session.send_request(request)
     if check_response(response, click.echo):
+        invalidate_identities()
         click.echo("SSH key created:")
         identity = Key(response["a"], from_base64(response["pk"]), key_type, name)
         click.echo(str(identity))
@@ -351,8 +470,18 @@ def create_ssh_key(name, algorithm):
 main.add_command(chiff_init, "init")
 
 
+def parse_accounts(format, path, skip):
+    if format == "csv":
+        return parse_csv(path, skip)
+    elif format == "json":
+        return parse_json(path)
+    elif format == "kdbx":
+        return parse_kdbx(path)
+
+
 def parse_csv(path, skip):
-    new_accounts = []
+    import csv
+
     with click.open_file(path, mode="r") as file:
         accounts = csv.DictReader(
             file, fieldnames=["site_name", "url", "username", "password", "notes"]
@@ -360,40 +489,31 @@ def parse_csv(path, skip):
         if skip:
             next(accounts, None)
         for account in accounts:
-            site_id = get_site_ids(account["url"])[0]
-            new_accounts.append(
-                {
-                    "u": account["username"],
-                    "p": account["password"],
-                    "n": account["site_name"],
-                    "s": site_id,
-                    "l": account["url"],
-                    "y": account["notes"],
-                }
-            )
-    return new_accounts
+            yield {
+                "u": account["username"],
+                "p": account["password"],
+                "n": account["site_name"],
+                "l": account["url"],
+                "y": account["notes"],
+            }
 
 
 def parse_json(path):
-    new_accounts = []
     with click.open_file(path, mode="r") as file:
         for account in json.load(file):
-            site_id = get_site_ids(account["url"])[0]
-            new_accounts.append(
-                {
-                    "u": account["username"],
-                    "p": account["password"],
-                    "n": account["title"],
-                    "s": site_id,
-                    "l": account["url"],
-                    "y": account["notes"],
-                }
-            )
-    return new_accounts
+            yield {
+                "u": account["username"],
+                "p": account["password"],
+                "n": account["title"],
+                "l": account["url"],
+                "y": account["notes"],
+            }
 
 
 def parse_kdbx(path):
-    new_accounts = []
+    from pykeepass import PyKeePass
+    from pykeepass.exceptions import CredentialsError
+
     password = click.prompt(
         "Please provide your .kdbx database password",
         default="",
@@ -403,25 +523,34 @@ def parse_kdbx(path):
     try:
         with PyKeePass(path, password=password) as kp:
             for account in kp.entries:
-                site_id = get_site_ids(account.url)[0]
-                new_accounts.append(
-                    {
-                        "u": account.username,
-                        "p": account.password,
-                        "n": account.title,
-                        "s": site_id,
-                        "l": account.url,
-                        "y": account.notes,
-                    }
-                )
-        return new_accounts
+                yield {
+                    "u": account.username,
+                    "p": account.password,
+                    "n": account.title,
+                    "l": account.url,
+                    "y": account.notes,
+                }
     except CredentialsError:
         print("The keepass password appears to be incorrect. Exiting")
         exit(1)
 
 
-def get_session(skip):
-    session = Session.get()
+def load_ppd(path):
+    """Read a PPD from a JSON file. Returns `None` if there is no file."""
+    if not path:
+        return None
+    with click.open_file(path, mode="r") as file:
+        return json.load(file)
+
+
+def load_session():
+    """Get the session of chiffd if it is running, so its session, connections and
+    caches are reused. Otherwise, load the session from disk."""
+    return RemoteSession.connect() or Session.get()
+
+
+def get_session(skip, remote=False):
+    session = load_session() if remote else Session.get()
     if not session:
         if click.confirm(
             "There does not seem to be an active session. Do you want to pair now?"
@@ -0,0 +1,236 @@
+from chiff.password_validator import (
+    ORDERED_CODE_POINTS,
+    compile_ppd,
+    scan_runs,
+    valid_character_sets,
+    valid_characters,
+    valid_positions,
+    valid_requirement_groups,
+)
+from collections import Counter
+from typing import NamedTuple
+
+try:
+    import numpy
+except ImportError:  # Install chiff[audit] to audit with NumPy.
+    numpy = None
+
+TOO_SHORT = "too short"
+TOO_LONG = "too long"
+INVALID_CHARACTERS = "contains characters that are not allowed"
+REPEATED_CHARACTERS = "too many repeated characters"
+ORDERED_CHARACTERS = "too many ordered characters, like abc"
+CHARACTER_SETS = "character set requirements not met"
+POSITIONS = "position restrictions not met"
+REQUIREMENT_GROUPS = "requirement groups not met"
+# Passwords are encoded in chunks of similar length, so a single long password
+# doesn't make the array of the whole batch wide.
+AUDIT_CHUNK_SIZE = 4096
+# Below this number of passwords, NumPy costs more than it saves.
+VECTORIZE_THRESHOLD = 64
+
+
+def audit(passwords, ppd, vectorize=None):
+    """Check a batch of passwords against a PPD. Returns the reasons each password
+    is invalid, as a list of lists in the order of `passwords`. A password is valid
+    if its list is empty. Uses NumPy if it is installed, unless `vectorize` is
+    `False`."""
+    passwords = list(passwords)
+    policy = compile_ppd(ppd)
+    if vectorize is None:
+        vectorize = len(passwords) >= VECTORIZE_THRESHOLD
+    if not vectorize or numpy is None:
+        return [audit_password(policy, password) for password in passwords]
+    reasons = [None] * len(passwords)
+    order = sorted(range(len(passwords)), key=lambda i: len(passwords[i]))
+    for start in range(0, len(order), AUDIT_CHUNK_SIZE):
+        indices = order[start : start + AUDIT_CHUNK_SIZE]
+        chunk = audit_batch(policy, [passwords[i] for i in indices])
+        for i, password_reasons in zip(indices, chunk):
+            reasons[i] = password_reasons
+    return reasons
+
+
+def audit_password(policy, password):
+    """The reasons a single password doesn't satisfy a compiled PPD."""
+    reasons = []
+    if len(password) < policy.min_length:
+        reasons.append(TOO_SHORT)
+    if len(password) > policy.max_length:
+        reasons.append(TOO_LONG)
+    counts = Counter(password)
+    if not valid_characters(policy, counts):
+        reasons.append(INVALID_CHARACTERS)
+    if policy.max_consecutive:
+        reasons += run_reasons(policy, password)
+    if not valid_character_sets(policy, counts):
+        reasons.append(CHARACTER_SETS)
+    if not valid_positions(policy, password):
+        reasons.append(POSITIONS)
+    if not valid_requirement_groups(policy, password, counts):
+        reasons.append(REQUIREMENT_GROUPS)
+    return reasons
+
+
+def run_reasons(policy, password):
+    """The reasons the runs of repeated or ordered characters are too long."""
+    repeated, ordered = scan_runs(password)
+    reasons = []
+    if repeated > policy.max_consecutive:
+        reasons.append(REPEATED_CHARACTERS)
+    if ordered > policy.max_consecutive:
+        reasons.append(ORDERED_CHARACTERS)
+    return reasons
+
+
+def encode(passwords):
+    """Encode passwords as an array of code points with one row per password,
+    padded with zeros, and an array with their lengths."""
+    lengths = numpy.fromiter(
+        map(len, passwords), dtype=numpy.int64, count=len(passwords)
+    )
+    width = max(int(lengths.max(initial=0)), 1)
+    codes = (
+        numpy.array(passwords, dtype=f"<U{width}")
+        .view(numpy.uint32)
+        .reshape(len(passwords), width)
+    )
+    return codes, lengths
+
+
+class Batch(NamedTuple):
+    """Passwords encoded by `encode_batch`."""
+
+    codes: object
+    lengths: object
+    # Whether every column of `codes` is within the password.
+    in_password: object
+    # The size of lookup tables, so every code point is in them.
+    size: int
+
+
+def encode_batch(policy, passwords):
+    """Encode passwords with `encode`, for the checks of `audit_batch`."""
+    codes, lengths = encode(passwords)
+    in_password = numpy.arange(codes.shape[1]) < lengths[:, None]
+    size = max(
+        int(codes.max(initial=0)),
+        max(map(ord, policy.characters), default=0),
+        max(ORDERED_CODE_POINTS),
+    )
+    return Batch(codes, lengths, in_password, size + 1)
+
+
+def audit_batch(policy, passwords):
+    """Like `audit_password`, but for all passwords at once with NumPy."""
+    batch = encode_batch(policy, passwords)
+    invalid_characters = (
+        batch.in_password & ~table(batch, policy.characters)[batch.codes]
+    )
+    failures = [
+        (TOO_SHORT, batch.lengths < policy.min_length),
+        (TOO_LONG, batch.lengths > policy.max_length),
+        (INVALID_CHARACTERS, invalid_characters.any(axis=1)),
+        *batch_run_failures(policy, batch),
+        (CHARACTER_SETS, ~valid_batch_character_sets(policy, batch)),
+        (POSITIONS, ~valid_batch_positions(policy, batch)),
+        (REQUIREMENT_GROUPS, ~valid_batch_requirement_groups(policy, batch)),
+    ]
+    reasons = [[] for _ in passwords]
+    for reason, failed in failures:
+        for i in numpy.flatnonzero(failed):
+            reasons[i].append(reason)
+    return reasons
+
+
+def table(batch, characters):
+    """A lookup table with the characters that are in `characters`."""
+    lookup = numpy.zeros(batch.size, dtype=bool)
+    lookup[[ord(char) for char in characters]] = True
+    return lookup
+
+
+def count(batch, characters, positions=None):
+    """The number of occurrences of `characters` in every password, at `positions`
+    if given. Positions beyond the end of a password don't count."""
+    lookup = table(batch, characters)
+    if positions is None:
+        return (lookup[batch.codes] & batch.in_password).sum(axis=1)
+    codes, lengths = batch.codes, batch.lengths
+    occurrences = numpy.zeros(len(lengths), dtype=numpy.int64)
+    rows = numpy.arange(len(lengths))
+    for position in positions:
+        index = position if position >= 0 else lengths + position
+        index = numpy.broadcast_to(index, lengths.shape)
+        valid = (index >= 0) & (index < lengths)
+        occurrences += (
+            valid & lookup[codes[rows, numpy.clip(index, 0, codes.shape[1] - 1)]]
+        )
+    return occurrences
+
+
+def within_bounds(occurrences, min_occurs, max_occurs):
+    valid = numpy.ones(len(occurrences), dtype=bool)
+    if min_occurs is not None:
+        valid &= occurrences >= min_occurs
+    if max_occurs is not None:
+        valid &= occurrences <= max_occurs
+    return valid
+
+
+def batch_run_failures(policy, batch):
+    """Like `run_reasons`, for every password of the batch."""
+    if not policy.max_consecutive:
+        return []
+    codes = batch.codes
+    pairs = batch.in_password[:, 1:]
+    repeated = pairs & (codes[:, 1:] == codes[:, :-1])
+    ordered = (
+        pairs
+        & (codes[:, 1:] == codes[:, :-1] + 1)
+        & table(batch, map(chr, ORDERED_CODE_POINTS))[codes[:, 1:]]
+    )
+    # A run of n characters is n - 1 matching pairs.
+    return [
+        (REPEATED_CHARACTERS, longest_runs(repeated) >= policy.max_consecutive),
+        (ORDERED_CHARACTERS, longest_runs(ordered) >= policy.max_consecutive),
+    ]
+
+
+def valid_batch_character_sets(policy, batch):
+    valid = numpy.ones(len(batch.lengths), dtype=bool)
+    for characters, min_occurs, max_occurs in policy.character_set_rules:
+        valid &= within_bounds(count(batch, characters), min_occurs, max_occurs)
+    return valid
+
+
+def valid_batch_positions(policy, batch):
+    valid = numpy.ones(len(batch.lengths), dtype=bool)
+    for positions, characters, min_occurs, max_occurs in policy.position_rules:
+        occurrences = count(batch, characters, positions)
+        valid &= within_bounds(occurrences, min_occurs, max_occurs)
+    return valid
+
+
+def valid_batch_requirement_groups(policy, batch):
+    valid = numpy.ones(len(batch.lengths), dtype=bool)
+    for min_rules, rules in policy.requirement_groups:
+        valid_rules = numpy.zeros(len(batch.lengths), dtype=numpy.int64)
+        for positions, characters, min_occurs, max_occurs in rules:
+            if characters is None:
+                occurrences = numpy.zeros(len(batch.lengths), dtype=numpy.int64)
+            else:
+                occurrences = count(batch, characters, positions)
+            valid_rules += within_bounds(occurrences, min_occurs, max_occurs)
+        valid &= valid_rules >= min_rules
+    return valid
+
+
+def longest_runs(matches):
+    """The length of the longest run of `True` in every row."""
+    if matches.shape[1] == 0:
+        return numpy.zeros(matches.shape[0], dtype=numpy.int64)
+    totals = numpy.cumsum(matches, axis=1)
+    # The total at the last mismatch before each column.
+    resets = numpy.maximum.accumulate(numpy.where(matches, 0, totals), axis=1)
+    return (totals - resets).max(axis=1)
@@ -0,0 +1,236 @@
+from chiff import crypto
+from chiff.password_validator import (
+    FALLBACK_PASSWORD_LENGTH,
+    ORDERED_CODE_POINTS,
+    PasswordValidator,
+)
+
+MAX_GENERATION_ATTEMPTS = 100
+RANDOM_BUFFER_SIZE = 256
+
+
+class PasswordGenerationError(Exception):
+    """No password could be generated that satisfies the PPD."""
+
+
+class RandomSource:
+    """Uniformly distributed random numbers from the CSPRNG of libsodium. Random bytes
+    are fetched in batches and numbers are drawn by rejection sampling, so there is
+    no modulo bias."""
+
+    def __init__(self):
+        self.buffer = b""
+        self.offset = 0
+
+    def below(self, n):
+        """A random integer in [0, n)."""
+        if n <= 0:
+            raise ValueError("n must be positive.")
+        size = max(1, ((n - 1).bit_length() + 7) // 8)
+        limit = (1 << (8 * size)) // n * n
+        while True:
+            if self.offset + size > len(self.buffer):
+                self.buffer = crypto.generate_seed(RANDOM_BUFFER_SIZE)
+                self.offset = 0
+            value = int.from_bytes(self.buffer[self.offset : self.offset + size], "big")
+            self.offset += size
+            if value < limit:
+                return value % n
+
+    def choice(self, sequence):
+        return sequence[self.below(len(sequence))]
+
+    def sample(self, sequence, k):
+        """`k` distinct elements of the sequence, in random order."""
+        pool = list(sequence)
+        for i in range(k):
+            j = i + self.below(len(pool) - i)
+            pool[i], pool[j] = pool[j], pool[i]
+        return pool[:k]
+
+
+class PasswordGenerator:
+    """Generates passwords that satisfy a PPD. The rules of the PPD are used to pick
+    the characters, so passwords are valid by construction, rather than generated at
+    random until one happens to be valid. Every password is still validated before
+    it is returned."""
+
+    def __init__(self, ppd, random=None):
+        self.validator = PasswordValidator(ppd)
+        self.policy = self.validator.policy
+        self.characters = tuple(sorted(self.policy.characters))
+        self.random = random or RandomSource()
+
+    def default_length(self):
+        return min(
+            max(FALLBACK_PASSWORD_LENGTH, self.policy.min_length),
+            self.policy.max_length,
+        )
+
+    def generate(self, length=None):
+        """Generate a password of `length` characters, or of the fallback length
+        within the bounds of the PPD. Raises `ValueError` if the length is out of
+        bounds, and `PasswordGenerationError` if the PPD can't be satisfied."""
+        if self.policy.min_length > self.policy.max_length:
+            raise PasswordGenerationError(
+                "The minimum length of the PPD exceeds its maximum length."
+            )
+        if length is None:
+            length = self.default_length()
+        if not self.policy.min_length <= length <= self.policy.max_length:
+            raise ValueError(
+                f"The length must be between {self.policy.min_length} and "
+                f"{self.policy.max_length} characters."
+            )
+        for _ in range(MAX_GENERATION_ATTEMPTS):
+            password = self.__attempt(length)
+            if password is not None and self.validator.validate(password):
+                return password
+        raise PasswordGenerationError("Could not generate a password for this PPD.")
+
+    def __constraints(self, length):
+        """The rules as (positions, characters, minOccurs, maxOccurs). Positions are
+        the indexes in the password the rule applies to, or `None` for all. For each
+        requirement group, the required number of rules is picked at random."""
+        policy = self.policy
+        constraints = [
+            (None, characters, min_occurs or 0, max_occurs)
+            for characters, min_occurs, max_occurs in policy.character_set_rules
+        ]
+        constraints += [
+            (positions, characters, min_occurs or 0, max_occurs)
+            for positions, characters, min_occurs, max_occurs in policy.position_rules
+        ]
+        for min_rules, rules in policy.requirement_groups:
+            for rule in self.random.sample(rules, min(min_rules, len(rules))):
+                positions, characters, min_occurs, max_occurs = rule
+                if characters is None:
+                    continue
+                constraints.append((positions, characters, min_occurs, max_occurs))
+        return [
+            (
+                (
+                    None
+                    if positions is None
+                    else frozenset(
+                        position % length
+                        for position in positions
+                        if -length <= position < length
+                    )
+                ),
+                characters,
+                min_occurs,
+                max_occurs,
+            )
+            for positions, characters, min_occurs, max_occurs in constraints
+        ]
+
+    def __attempt(self, length):
+        """Try to build a valid password. Returns `None` if the choices made for the
+        constraints turned out to be incompatible."""
+        constraints = self.__constraints(length)
+        reserved = self.__reserve(constraints, length)
+        if reserved is None:
+            return None
+        allowed, pinned, counts = reserved
+        password = []
+        runs = (0, 0, -1)
+        for position in range(length):
+            excluded = self.__excluded(constraints, counts, pinned[position], position)
+            excluded.update(self.__run_breakers(*runs))
+            options = self.__options(allowed[position], excluded)
+            if not options:
+                return None
+            char = self.random.choice(options)
+            password.append(char)
+            for index, (positions, characters, _, _) in enumerate(constraints):
+                if (
+                    char in characters
+                    and index not in pinned[position]
+                    and (positions is None or position in positions)
+                ):
+                    counts[index] += 1
+            runs = next_runs(runs, ord(char))
+        return "".join(password)
+
+    def __reserve(self, constraints, length):
+        """Reserve positions for the minimum number of occurrences of each rule.
+        Positions that can only get a character of the rule already count towards
+        it, so rules on the same characters share them. Returns the characters
+        allowed at every position, the rules every position is reserved for and the
+        number of occurrences of every rule, or `None` if there aren't enough
+        positions or a rule would exceed its maximum."""
+        allowed = [self.policy.characters] * length
+        pinned = [()] * length
+        counts = [0] * len(constraints)
+        for index, (positions, characters, min_occurs, max_occurs) in enumerate(
+            constraints
+        ):
+            scope = range(length) if positions is None else positions
+            covered = [
+                position for position in scope if allowed[position] <= characters
+            ]
+            if max_occurs is not None and len(covered) > max_occurs:
+                return None
+            candidates = [
+                position
+                for position in scope
+                if allowed[position] & characters
+                and not allowed[position] <= characters
+            ]
+            needed = max(0, min_occurs - len(covered))
+            if len(candidates) < needed:
+                return None
+            for position in covered:
+                pinned[position] += (index,)
+            for position in self.random.sample(candidates, needed):
+                allowed[position] = allowed[position] & characters
+                pinned[position] += (index,)
+            counts[index] = len(covered) + needed
+        return allowed, pinned, counts
+
+    @staticmethod
+    def __excluded(constraints, counts, pinned, position):
+        """The characters of the rules that already reached their maximum number of
+        occurrences at this position."""
+        excluded = set()
+        for index, (positions, characters, _, max_occurs) in enumerate(constraints):
+            if (
+                max_occurs is not None
+                and counts[index] >= max_occurs
+                and index not in pinned
+                and (positions is None or position in positions)
+            ):
+                excluded.update(characters)
+        return excluded
+
+    def __run_breakers(self, repeated, ordered, last_value):
+        """The characters that would make a run longer than `maxConsecutive`."""
+        max_consecutive = self.policy.max_consecutive
+        if not max_consecutive:
+            return ()
+        breakers = []
+        if repeated >= max_consecutive:
+            breakers.append(chr(last_value))
+        if ordered >= max_consecutive and last_value + 1 in ORDERED_CODE_POINTS:
+            breakers.append(chr(last_value + 1))
+        return breakers
+
+    def __options(self, allowed, excluded):
+        if not excluded and allowed is self.policy.characters:
+            return self.characters
+        return [
+            char for char in self.characters if char in allowed and char not in excluded
+        ]
+
+
+def next_runs(runs, value):
+    """The lengths of the repeated and ordered runs, and the last code point, after
+    adding the code point `value`."""
+    repeated, ordered, last_value = runs
+    repeated = repeated + 1 if value == last_value else 1
+    if value == last_value + 1 and value in ORDERED_CODE_POINTS:
+        ordered += 1
+    else:
+        ordered = 1
+    return repeated, ordered, value
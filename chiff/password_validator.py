@@ -1,4 +1,5 @@
-import re
+from collections import Counter
+from typing import NamedTuple
 
 FALLBACK_PASSWORD_LENGTH = 22
 MIN_PASSWORD_LENGTH_BOUND = 8
@@ -8,314 +9,229 @@ MAXIMAL_CHARACTER_SET = (
     " !\"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\]^_"
     "`abcdefghijklmnopqrstuvwxyz{|}~"
 )
+# Only these characters count towards an ordered sequence, like "abc" or "123".
+ORDERED_CODE_POINTS = frozenset(map(ord, OPTIMAL_CHARACTER_SET))
+# ORDERED_LOOKUP[value] is 1 if the code point counts towards an ordered sequence.
+ORDERED_LOOKUP = bytes(
+    value in ORDERED_CODE_POINTS for value in range(max(ORDERED_CODE_POINTS) + 1)
+)
+
+
+class PasswordPolicy(NamedTuple):
+    """A PPD compiled by `compile_ppd`. Character sets are frozensets, positions are
+    parsed and `max_consecutive` is 0 if there is no limit."""
+
+    min_length: int
+    max_length: int
+    characters: frozenset
+    max_consecutive: int
+    # (characters, minOccurs, maxOccurs)
+    character_set_rules: tuple
+    # (positions, characters, minOccurs, maxOccurs)
+    position_rules: tuple
+    # (minRules, ((positions or None, characters or None, minOccurs, maxOccurs), ...))
+    requirement_groups: tuple
+
+
+def compile_ppd(ppd):
+    """Compile a PPD into a `PasswordPolicy`, so it is only interpreted once instead
+    of for every password."""
+    ppd = ppd or {}
+    properties = ppd.get("properties") or {}
+    character_settings = properties.get("characterSettings") or {}
+    character_sets = {}
+    if "characterSets" in ppd:
+        characters = set()
+        for character_set in ppd["characterSets"]:
+            if character_set.get("characters") is not None:
+                characters.update(character_set["characters"])
+                character_sets[character_set["name"]] = frozenset(
+                    character_set["characters"]
+                )
+            else:
+                character_sets.pop(character_set["name"], None)
+        characters = frozenset(characters)
+    else:
+        characters = frozenset(OPTIMAL_CHARACTER_SET)
+
+    max_length = properties.get("maxLength")
+    min_length = properties.get("minLength")
+    max_consecutive = properties.get("maxConsecutive") or 0
+    if max_consecutive < 0:
+        max_consecutive = 0
+    character_set_rules = tuple(
+        (
+            character_sets[setting["name"]],
+            setting.get("minOccurs"),
+            setting.get("maxOccurs"),
+        )
+        for setting in character_settings.get("characterSetSettings") or ()
+        if setting["name"] in character_sets
+    )
+    position_rules = tuple(
+        (
+            parse_positions(restriction["positions"]),
+            character_sets[restriction["characterSet"]],
+            restriction.get("minOccurs"),
+            restriction.get("maxOccurs"),
+        )
+        for restriction in character_settings.get("positionRestrictions") or ()
+        if restriction.get("characterSet") in character_sets
+    )
+    requirement_groups = tuple(
+        (
+            group.get("minRules"),
+            tuple(
+                (
+                    (
+                        parse_positions(rule["positions"])
+                        if rule.get("positions") is not None
+                        else None
+                    ),
+                    character_sets.get(rule.get("characterSet")),
+                    rule.get("minOccurs") or 0,
+                    rule.get("maxOccurs"),
+                )
+                for rule in group.get("requirementRules")
+            ),
+        )
+        for group in character_settings.get("requirementGroups") or ()
+    )
+    return PasswordPolicy(
+        min_length if min_length is not None else MIN_PASSWORD_LENGTH_BOUND,
+        max_length if max_length is not None else MAX_PASSWORD_LENGTH_BOUND,
+        characters,
+        max_consecutive,
+        character_set_rules,
+        position_rules,
+        requirement_groups,
+    )
+
+
+def parse_positions(positions):
+    return tuple(int(position) for position in positions.split(","))
 
 
 class PasswordValidator:
     def __init__(self, ppd):
         self.ppd = ppd
-        self.character_set_dictionary = {}
-        self.characters = ""
-        if self.ppd is not None and "characterSets" in self.ppd:
-            for character_set in self.ppd["characterSets"]:
-                if character_set.get("characters") is not None:
-                    self.characters += character_set["characters"]
-                self.character_set_dictionary[character_set["name"]] = character_set[
-                    "characters"
-                ]
-        else:
-            self.characters = OPTIMAL_CHARACTER_SET
+        self.policy = compile_ppd(ppd)
 
     def validate(self, password):
-        # Checks if password is less than or equal to maximum length.
-        # Relevant for custom passwords.
-        if not self.validate_max_length(password):
+        policy = self.policy
+        # Checks if the length is within bounds. Relevant for custom passwords.
+        if not valid_length(policy, password):
             return False
+        counts = Counter(password)
+        return (
+            valid_characters(policy, counts)
+            and valid_runs(policy, password)
+            and valid_character_sets(policy, counts)
+            and valid_positions(policy, password)
+            and valid_requirement_groups(policy, password, counts)
+        )
 
-        # Checks is password is less than or equal to minimum length.
-        # Relevant for custom passwords.
-        if not self.validate_min_length(password):
-            return False
 
-        # Checks if password doesn't contain unallowed characters
-        if not self.validate_characters(password):
-            return False
+def within(occurrences, min_occurs, max_occurs):
+    """Whether a number of occurrences is within bounds that may be `None`."""
+    return (min_occurs is None or occurrences >= min_occurs) and (
+        max_occurs is None or occurrences <= max_occurs
+    )
 
-        # Max consecutive characters. This tests if n characteres are the same
-        if not self.validate_consecutive_characters(password):
-            return False
 
-        # Max consecutive characters.
-        # This tests if n characters are an ordered sequence.
-        if not self.validate_consecutive_ordered_characters(password):
-            return False
+def valid_length(policy, password):
+    return policy.min_length <= len(password) <= policy.max_length
 
-        # Characterset restrictions
-        if not self.validate_character_set(password):
-            return False
 
-        # Position restrictions
-        if not self.validate_position_restrictions(password):
-            return False
+def valid_characters(policy, counts):
+    """Whether the password doesn't contain characters that aren't allowed."""
+    return policy.characters.issuperset(counts)
 
-        # Requirement groups
-        if not self.validate_requirement_groups(password):
-            return False
 
-        return True
+def valid_runs(policy, password):
+    """Max consecutive characters. This tests if n characters are the same, or if n
+    characters are an ordered sequence."""
+    return not policy.max_consecutive or (
+        max(scan_runs(password)) <= policy.max_consecutive
+    )
 
-    def validate_max_length(self, password):
-        if (
-            self.ppd is not None
-            and self.ppd.get("properties") is not None
-            and self.ppd.get("properties").get("maxLength") is not None
-        ):
-            max_length = self.ppd.get("properties").get("maxLength")
-        else:
-            max_length = MAX_PASSWORD_LENGTH_BOUND
 
-        return len(password) <= max_length
+def valid_character_sets(policy, counts):
+    return all(
+        within(count_occurrences(counts, characters), min_occurs, max_occurs)
+        for characters, min_occurs, max_occurs in policy.character_set_rules
+    )
 
-    def validate_min_length(self, password):
-        if (
-            self.ppd is not None
-            and self.ppd.get("properties") is not None
-            and self.ppd.get("properties").get("minLength") is not None
-        ):
-            min_length = self.ppd.get("properties").get("minLength")
-        else:
-            min_length = MIN_PASSWORD_LENGTH_BOUND
-
-        return len(password) >= min_length
-
-    def validate_characters(self, password):
-        for char in password:
-            if char not in self.characters:
-                return False
-
-        return True
-
-    def validate_consecutive_characters(self, password):
-        if (
-            self.ppd is not None
-            and self.ppd.get("properties") is not None
-            and self.ppd.get("properties").get("maxConsecutive") is not None
-        ):
-            if self.ppd.get("properties").get("maxConsecutive") > 0:
-                return self.check_consecutive_characters(
-                    password,
-                    self.characters,
-                    self.ppd.get("properties").get("maxConsecutive"),
-                )
-            else:
-                return True
-        else:
-            return True
-
-    def validate_consecutive_ordered_characters(self, password):
-        if (
-            self.ppd is not None
-            and self.ppd.get("properties") is not None
-            and self.ppd.get("properties").get("maxConsecutive") is not None
-        ):
-            if self.ppd.get("properties").get("maxConsecutive") > 0:
-                return self.check_consecutive_characters_order(
-                    password, self.ppd.get("properties").get("maxConsecutive")
-                )
-            else:
-                return True
-        else:
-            return True
-
-    def validate_character_set(self, password):
-        if (
-            self.ppd is not None
-            and self.ppd.get("properties") is not None
-            and self.ppd.get("properties").get("characterSettings") is not None
-            and self.ppd.get("properties")
-            .get("characterSettings")
-            .get("characterSetSettings")
-            is not None
-        ):
-            return self.check_character_set_settings(
-                password,
-                self.ppd.get("properties")
-                .get("characterSettings")
-                .get("characterSetSettings"),
-            )
-        else:
-            return True
-
-    def validate_position_restrictions(self, password):
-        if (
-            self.ppd is not None
-            and self.ppd.get("properties") is not None
-            and self.ppd.get("properties").get("characterSettings") is not None
-            and self.ppd.get("properties")
-            .get("characterSettings")
-            .get("positionRestrictions")
-            is not None
-        ):
-            return self.check_position_restrictions(
-                password,
-                self.ppd.get("properties")
-                .get("characterSettings")
-                .get("positionRestrictions"),
-            )
-        else:
-            return True
-
-    def validate_requirement_groups(self, password):
-        if (
-            self.ppd is not None
-            and self.ppd.get("properties") is not None
-            and self.ppd.get("properties").get("characterSettings")
-            and self.ppd.get("properties")
-            .get("characterSettings")
-            .get("requirementGroups")
-        ):
-            return self.check_requirement_groups(
-                password,
-                self.ppd.get("properties")
-                .get("characterSettings")
-                .get("requirementGroups"),
-            )
-        else:
-            return True
-
-    def check_character_set_settings(self, password, character_set_settings):
-        for character_set_setting in character_set_settings:
-            if (
-                self.character_set_dictionary.get(character_set_setting["name"])
-                is not None
-            ):
-                character_set = self.character_set_dictionary[
-                    character_set_setting["name"]
-                ]
-                occurrences = self.count_character_occurrences(password, character_set)
-                if (
-                    character_set_setting.get("minOccurs") is not None
-                    and occurrences < character_set_setting["minOccurs"]
-                ):
-                    return False
-                if (
-                    character_set_setting.get("maxOccurs") is not None
-                    and occurrences > character_set_setting["maxOccurs"]
-                ):
-                    return False
-        return True
-
-    def check_position_restrictions(self, password, position_restrictions):
-        for position_restriction in position_restrictions:
-            if (
-                self.character_set_dictionary.get(
-                    position_restriction.get("characterSet")
-                )
-                is not None
-            ):
-                character_set = self.character_set_dictionary.get(
-                    position_restriction.get("characterSet")
-                )
-                occurrences = self.check_positions(
-                    password, position_restriction.get("positions"), character_set
-                )
-                if (
-                    occurrences is not None
-                    and occurrences < position_restriction["minOccurs"]
-                ):
-                    return False
-                if (
-                    occurrences is not None
-                    and occurrences > position_restriction["maxOccurs"]
-                ):
-                    return False
-
-        return True
-
-    def check_requirement_groups(self, password, requirement_groups):
-        for requirement_group in requirement_groups:
-            valid_rules = 0
-            for requirement_rule in requirement_group.get("requirementRules"):
-                occurrences = 0
-                if (
-                    self.character_set_dictionary.get(
-                        requirement_rule.get("characterSet")
-                    )
-                    is not None
-                ):
-                    if requirement_rule.get("positions") is not None:
-                        occurrences += self.check_positions(
-                            password,
-                            requirement_rule.get("positions"),
-                            self.character_set_dictionary.get(
-                                requirement_rule.get("characterSet")
-                            ),
-                        )
-                    else:
-                        occurrences += self.count_character_occurrences(
-                            password,
-                            self.character_set_dictionary.get(
-                                requirement_rule.get("characterSet")
-                            ),
-                        )
-                if requirement_rule.get("maxOccurs") is not None:
-                    if (
-                        requirement_rule.get("minOccurs")
-                        <= occurrences
-                        <= requirement_rule.get("maxOccurs")
-                    ):
-                        valid_rules += 1
-                else:
-                    if occurrences >= requirement_rule.get("minOccurs"):
-                        valid_rules += 1
-            if valid_rules < requirement_group.get("minRules"):
-                return False
-        return True
-
-    @staticmethod
-    def check_consecutive_characters(password, characters, max_consecutive):
-        escaped_chars = re.escape(characters)
-        return (
-            re.search(r"([%s])\1{%d,}" % (escaped_chars, max_consecutive), password)
-            is None
-        )
 
-    @staticmethod
-    def check_consecutive_characters_order(password, max_consecutive):
-        last_value = 255
-        longest_sequence = 0
-        counter = 1
-        character_bytes = list(
-            map(
-                lambda x: ord(x),
-                list("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0987654321"),
+def valid_positions(policy, password):
+    return all(
+        within(count_positions(password, positions, characters), min_occurs, max_occurs)
+        for positions, characters, min_occurs, max_occurs in policy.position_rules
+    )
+
+
+def valid_requirement_groups(policy, password, counts):
+    """Whether enough rules of every requirement group are satisfied."""
+    for min_rules, rules in policy.requirement_groups:
+        valid_rules = sum(
+            within(
+                count_rule(password, counts, positions, characters),
+                min_occurs,
+                max_occurs,
             )
+            for positions, characters, min_occurs, max_occurs in rules
         )
-        for letter in password:
-            value = ord(letter)
-            if value == last_value + 1 and value in character_bytes:
-                counter += 1
-            else:
-                counter = 1
-            last_value = value
-            if counter > longest_sequence:
-                longest_sequence = counter
-
-        return longest_sequence <= max_consecutive
-
-    @staticmethod
-    def check_positions(password, positions, character_set):
-        occurrences = 0
-        for position in positions.split(","):
-            if password[int(position)] in character_set:
-                occurrences += 1
-
-        return occurrences
-
-    @staticmethod
-    def count_character_occurrences(password, character_set):
-        result = 0
-        for char in password:
-            if char in character_set:
-                result += 1
-
-        return result
+        if valid_rules < min_rules:
+            return False
+    return True
+
+
+def count_rule(password, counts, positions, characters):
+    """The number of occurrences of a requirement rule, at its positions if it has
+    any."""
+    if characters is None:
+        return 0
+    elif positions is not None:
+        return count_positions(password, positions, characters)
+    else:
+        return count_occurrences(counts, characters)
+
+
+def scan_runs(password):
+    """The length of the longest run of identical characters, like "aaa", and of the
+    longest ordered sequence, like "abc", in a single pass."""
+    lookup = ORDERED_LOOKUP
+    size = len(lookup)
+    longest_repeated = longest_ordered = 0
+    repeated = ordered = 0
+    last_value = -2
+    for value in map(ord, password):
+        if value == last_value:
+            repeated += 1
+            ordered = 1
+        elif value == last_value + 1 and value < size and lookup[value]:
+            ordered += 1
+            repeated = 1
+        else:
+            repeated = ordered = 1
+        if repeated > longest_repeated:
+            longest_repeated = repeated
+        if ordered > longest_ordered:
+            longest_ordered = ordered
+        last_value = value
+    return longest_repeated, longest_ordered
+
+
+def count_positions(password, positions, characters):
+    """The number of positions in the password with a character from `characters`.
+    Positions beyond the end of the password don't count."""
+    length = len(password)
+    return sum(
+        1
+        for position in positions
+        if -length <= position < length and password[position] in characters
+    )
+
+
+def count_occurrences(counts, characters):
+    return sum(count for char, count in counts.items() if char in characters)
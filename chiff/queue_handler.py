@@ -1,10 +1,30 @@
 from chiff import api, crypto
+from concurrent.futures import Future, TimeoutError
+from math import ceil
+from random import uniform
+from time import monotonic, sleep, time
 import logging
+import requests
+import threading
+
+MAX_WAIT_TIME = 20
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 30
+# Connection errors are retried at least this many times, even after the deadline.
+MIN_RETRIES = 3
+# Responses that no request of this process is waiting for are left for other
+# processes, until their request is this many seconds old.
+UNCLAIMED_TIMEOUT = 600
 
 
 class QueueHandler:
     """A QueueHandler for polling a SQS queue."""
 
+    # Class defaults, so handlers pickled by older versions have them too.
+    polls = 0
+    last_poll_time = 0
+    total_poll_time = 0
+
     def __init__(self, keypair, env, endpoint):
         self.keypair = keypair
         self.url = "{host}/{env}/sessions/{pub_key}/{endpoint}".format(
@@ -14,17 +34,144 @@ class QueueHandler:
             endpoint=endpoint,
         )
 
-    def start(self, slow_polling, timeout):
-        """Start checking messages on this queue."""
-        logging.info(f"Polling queue, {timeout} attempts left.")
-        result = api.get_from_sqs(self.keypair, self.url, 20 if slow_polling else 0)
-        messages = result["messages"]
-        if result and len(messages) > 0:
-            return messages
-        elif timeout > 0:
-            return self.start(slow_polling, timeout - 1)
-        elif timeout < 0:
-            # negative means indefinite
-            return self.start(slow_polling, timeout)
-        else:
-            return []
+    def start(self, slow_polling, timeout=None):
+        """Start checking messages on this queue, until messages are received or
+        `timeout` seconds have passed. A timeout of `None` polls indefinitely, a
+        timeout of 0 polls once. With slow polling, every poll waits up to 20 seconds
+        for messages, but not past the deadline. Otherwise, the first poll returns
+        immediately and the wait time increases while the queue stays empty.
+        Connection errors are retried with backoff until the deadline, and at least
+        `MIN_RETRIES` times."""
+        deadline = None if timeout is None else monotonic() + timeout
+        wait_time = MAX_WAIT_TIME if slow_polling else 0
+        failures = 0
+        while True:
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining > 0:
+                wait_time = min(wait_time, ceil(remaining))
+            try:
+                messages = self.__poll(wait_time)
+                failures = 0
+            except (requests.ConnectionError, requests.Timeout) as err:
+                failures += 1
+                backoff = uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2**failures))
+                if (
+                    failures > MIN_RETRIES
+                    and deadline is not None
+                    and monotonic() + backoff > deadline
+                ):
+                    raise
+                logging.info(f"Polling queue failed, retrying in {backoff:.1f}s: {err}")
+                sleep(backoff)
+                continue
+            if messages:
+                return messages
+            if deadline is not None and monotonic() >= deadline:
+                return []
+            wait_time = min(MAX_WAIT_TIME, max(1, 2 * wait_time))
+
+    def __poll(self, wait_time):
+        logging.info(f"Polling queue with wait time {wait_time}s.")
+        start = monotonic()
+        try:
+            result = api.get_from_sqs(self.keypair, self.url, wait_time)
+        finally:
+            self.polls += 1
+            self.last_poll_time = monotonic() - start
+            self.total_poll_time += self.last_poll_time
+        logging.debug(f"Poll took {self.last_poll_time:.3f}s.")
+        return result and result["messages"]
+
+
+class ResponseDispatcher:
+    """Polls a queue on behalf of all pending requests of a session and hands every
+    response to the request with the same id, so concurrent requests share one poll
+    loop instead of consuming each other's responses. Responses are decrypted with
+    `decrypt` and passed to `delete` when they are claimed, when they can't be read,
+    or when their request is older than `UNCLAIMED_TIMEOUT`."""
+
+    def __init__(self, queue_handler, decrypt, delete):
+        self.queue_handler = queue_handler
+        self.decrypt = decrypt
+        self.delete = delete
+        self.lock = threading.Lock()
+        self.waiters = {}
+        self.unclaimed = {}
+        self.thread = None
+
+    def register(self, request_id):
+        """Register a request before it is sent. Returns the future that receives
+        the response."""
+        future = Future()
+        with self.lock:
+            self.waiters[request_id] = future
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, daemon=True)
+                self.thread.start()
+        return future
+
+    def wait(self, request_id, future, timeout=None):
+        """Wait `timeout` seconds for the response of a registered request, or
+        indefinitely if `timeout` is `None`. Returns `None` if it doesn't arrive."""
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            return None
+        finally:
+            with self.lock:
+                self.waiters.pop(request_id, None)
+
+    def __run(self):
+        while True:
+            with self.lock:
+                if not self.waiters:
+                    self.thread = None
+                    return
+            try:
+                # Long-poll, and retry connection errors for as long as one poll
+                # takes before the waiting requests fail.
+                self.__dispatch(self.queue_handler.start(True, MAX_WAIT_TIME))
+            except Exception as err:
+                with self.lock:
+                    waiters, self.waiters = self.waiters, {}
+                    self.thread = None
+                for future in waiters.values():
+                    future.set_exception(err)
+                return
+
+    def __dispatch(self, messages):
+        now = monotonic()
+        receipt_handles = []
+        for response in messages:
+            body = response["body"]
+            try:
+                message = self.decrypt(body)
+                request_id = message["b"]
+            except Exception as err:
+                # No other process of this session can read it either.
+                logging.warning(f"Deleting unreadable message on queue: {err}")
+                receipt_handles.append(response["receiptHandle"])
+                continue
+            with self.lock:
+                future = self.waiters.pop(request_id, None)
+            if future:
+                future.set_result(message)
+            elif self.__expired(message, body, now):
+                logging.info("Deleting expired message.")
+            else:
+                continue
+            receipt_handles.append(response["receiptHandle"])
+            self.unclaimed.pop(body, None)
+        for body, first_seen in list(self.unclaimed.items()):
+            if now - first_seen > 2 * UNCLAIMED_TIMEOUT:
+                del self.unclaimed[body]
+        if receipt_handles:
+            self.delete(receipt_handles)
+
+    def __expired(self, message, body, now):
+        """Whether an unclaimed response has expired. Its age is measured from the
+        timestamp of its request, so any process can delete it. Responses without a
+        timestamp expire after this process has seen them for `UNCLAIMED_TIMEOUT`."""
+        if "z" in message:
+            return time() - message["z"] / 1000 > UNCLAIMED_TIMEOUT
+        return now - self.unclaimed.setdefault(body, now) > UNCLAIMED_TIMEOUT
@@ -0,0 +1,87 @@
+from chiff.constants import (
+    APP_NAME,
+    CONTROL_SOCKET_NAME,
+    CONTROL_TIMEOUT,
+    MAX_CONTROL_MESSAGE_SIZE,
+    REMOTE_REQUEST_TIMEOUT,
+)
+from chiff.socket import FrameReader
+from chiff.ssh_key import Key
+from chiff.utils import length_and_data
+from pathlib import Path
+import click
+import json
+import socket
+
+
+class RemoteSession:
+    """A session that lives in chiffd and is used through its control socket. CLI
+    commands use it to reuse the session, HTTP connections and caches of the running
+    daemon. Every command has a timeout, so a daemon that hangs can't block the
+    CLI forever."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = FrameReader(sock, max_size=MAX_CONTROL_MESSAGE_SIZE)
+        self.id = None
+
+    @staticmethod
+    def connect():
+        """Connect to chiffd. Returns `None` if it isn't running or doesn't have an
+        active session."""
+        filename = Path(click.get_app_dir(APP_NAME), CONTROL_SOCKET_NAME)
+        if not filename.exists():
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CONTROL_TIMEOUT)
+        try:
+            sock.connect(str(filename))
+            session = RemoteSession(sock)
+            data = session.__call("session")
+        except Exception:
+            sock.close()
+            return None
+        if not data:
+            sock.close()
+            return None
+        session.id = data["id"]
+        return session
+
+    def get_accounts(self):
+        """Get all accounts for this session"""
+        return self.get_session_data()[0]
+
+    def get_session_data(self):
+        """Get all session objects (account or SSH identities)."""
+        data = self.__call("session_data")
+        return data["accounts"], [Key.from_dict(key) for key in data["identities"]]
+
+    def send_request(self, request, timeout=None):
+        """Send a request to the phone through chiffd and wait `timeout` seconds for
+        the response, or `REMOTE_REQUEST_TIMEOUT` seconds if `timeout` is `None`."""
+        if timeout is None:
+            timeout = REMOTE_REQUEST_TIMEOUT
+        return self.__call(
+            "request", timeout + CONTROL_TIMEOUT, request=request, timeout=timeout
+        )
+
+    def close(self):
+        self.sock.close()
+
+    def __call(self, command, wait=None, **kwargs):
+        """Send a command to chiffd and wait at most `wait` seconds for the answer,
+        or `CONTROL_TIMEOUT` seconds if `wait` is `None`."""
+        message = json.dumps({"c": command, **kwargs}).encode("utf-8")
+        self.sock.settimeout(CONTROL_TIMEOUT if wait is None else wait)
+        try:
+            self.sock.sendall(length_and_data(message))
+            data = self.reader.read()
+        except socket.timeout:
+            self.sock.close()
+            raise Exception("Error: chiffd didn't respond in time.")
+        if data is None:
+            raise Exception("Error: chiffd closed the connection.")
+        response = json.loads(bytes(data[4:]))
+        if "e" in response:
+            raise Exception(f"Error from chiffd: {response['e']}")
+        return response["r"]
@@ -1,16 +1,22 @@
+from chiff.account_cache import AccountCache
 from chiff.ssh_key import Key, KeyType
 from chiff import api, crypto
 from os import path
 from random import randint
 import os
-from qrcode import QRCode
-from qrcode.constants import ERROR_CORRECT_H
-import pickle
 import click
 import json
-from chiff.queue_handler import QueueHandler
-from chiff.constants import APP_NAME, MessageType
+from chiff.queue_handler import QueueHandler, ResponseDispatcher
+from chiff.constants import (
+    APP_NAME,
+    PAIRING_CHECK_INTERVAL,
+    PAIRING_STAMP,
+    SESSION_FORMAT_VERSION,
+    MessageType,
+)
+from chiff.utils import write_atomically
 import itertools
+import logging
 import threading
 import time
 import sys
@@ -18,12 +24,18 @@ import platform
 from urllib.parse import urlencode
 from pathlib import Path
 
+# Sessions loaded by this process, by path, with the stat of the file they were
+# loaded from.
+loaded_sessions = {}
+loaded_sessions_lock = threading.Lock()
+
 
 class Session:
     """A session with an app. Handles all communication with the app."""
 
     def __init__(self, key, session_id, user_id, version, os, app_version, env, arn):
         self.key = key
+        self.cipher = crypto.SessionCipher(key)
         self.id = session_id
         self.user_id = user_id
         self.version = version
@@ -37,37 +49,128 @@ class Session:
         self.persistent_queue_handler = QueueHandler(
             signing_keypair, env, "app-to-browser"
         )
+        self.identity_index = None
+        self.dispatcher = self.__create_dispatcher()
+        self.account_cache = AccountCache(self.cipher, session_id)
+
+    @staticmethod
+    def from_dict(data):
+        """Create a session from the contents of a session file."""
+        if data.get("format") != SESSION_FORMAT_VERSION:
+            raise Exception(f"Error: unsupported session format {data.get('format')}")
+        return Session(
+            crypto.from_base64(data["key"]),
+            data["id"],
+            data["userId"],
+            data["version"],
+            data["os"],
+            data["appVersion"],
+            data["env"],
+            data["arn"],
+        )
+
+    def to_dict(self):
+        """The contents of the session file."""
+        return {
+            "format": SESSION_FORMAT_VERSION,
+            "key": crypto.to_base64(self.key),
+            "id": self.id,
+            "userId": self.user_id,
+            "version": self.version,
+            "os": self.os,
+            "appVersion": self.app_version,
+            "env": self.env,
+            "arn": self.arn,
+        }
+
+    def save(self, session_path=None):
+        """Write the session file. Defaults to the session file in the app dir."""
+        session_path = session_path or Path(click.get_app_dir(APP_NAME), "session")
+        write_atomically(session_path, json.dumps(self.to_dict()).encode("utf-8"))
+        stat = os.stat(session_path)
+        with loaded_sessions_lock:
+            loaded_sessions[str(session_path)] = (Session.__stat_key(stat), self)
+
+    @staticmethod
+    def load(session_path=None):
+        """Load the session file, or return `None` if there is none. A loaded session
+        is reused until the file changes, so long-running processes don't read it
+        over and over and keep the state of the session. Sessions that were pickled
+        by older versions are converted."""
+        session_path = session_path or Path(click.get_app_dir(APP_NAME), "session")
+        try:
+            stat_key = Session.__stat_key(os.stat(session_path))
+        except FileNotFoundError:
+            with loaded_sessions_lock:
+                loaded_sessions.pop(str(session_path), None)
+            return None
+        with loaded_sessions_lock:
+            loaded = loaded_sessions.get(str(session_path))
+        if loaded and loaded[0] == stat_key:
+            return loaded[1]
+        with open(session_path, "rb") as f:
+            data = f.read()
+        if data.startswith(b"\x80"):  # Pickle protocol 2 or higher.
+            import pickle
+
+            # Only take the fields of the old session, since the objects it holds,
+            # like its queue handlers, may lack attributes of the current version.
+            session = Session.from_dict(pickle.loads(data).to_dict())
+            session.save(session_path)
+            return session
+        session = Session.from_dict(json.loads(data))
+        with loaded_sessions_lock:
+            loaded_sessions[str(session_path)] = (stat_key, session)
+        return session
+
+    @staticmethod
+    def __stat_key(stat):
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def __setstate__(self, state):
+        # Only used to load sessions pickled by older versions.
+        self.__dict__.update(state)
+        self.cipher = crypto.SessionCipher(self.key)
+        self.identity_index = None
+        self.dispatcher = self.__create_dispatcher()
+        self.account_cache = AccountCache(self.cipher, self.id)
 
     def get_ssh_identities(self):
         """Get all SSH identies for this session."""
         return self.get_session_data()[1]
 
     def get_ssh_identity(self, pubkey, key_type):
-        """Get a single SSH identity. Returns `None` if it can't be found."""
-        for identity in self.get_session_data()[1]:
-            if identity.pubkey == pubkey and identity.key_type is key_type:
-                return identity
+        """Get a single SSH identity. Returns `None` if it can't be found. Only fetches
+        the session data if it hasn't been fetched before, so identities created since
+        the last call to `get_session_data` are not found."""
+        if self.identity_index is None:
+            self.get_session_data()
+        return self.identity_index.get((key_type, bytes(pubkey)))
 
     def get_accounts(self):
         """Get all accounts for this session"""
         return self.get_session_data()[0]
 
-    def send_request(self, request, timeout=-1):
-        """Send a request to the phone. Adds the request id and timestamp."""
+    def send_request(self, request, timeout=None):
+        """Send a request to the phone. Adds the request id and timestamp. Waits
+        `timeout` seconds for a response, or indefinitely if `timeout` is `None`."""
         request_id = randint(0, 10**9)
         request["b"] = request_id
         request["z"] = int(time.time() * 1000)
-        request = crypto.encrypt(json.dumps(request).encode("utf-8"), self.key)
+        request = self.cipher.encrypt(json.dumps(request).encode("utf-8"))
+        # Register first, so the response can't arrive before anyone waits for it.
+        response = self.dispatcher.register(request_id)
         self.__send_push_message(
             request, "PASSWORD_REQUEST", "Open to authorize", title="Login request"
         )
-        return self.__poll_queue(request_id, True, timeout)
+        return self.dispatcher.wait(request_id, response, timeout)
 
-    def pairing_status(self):
-        """Check if the session has been ended by the app."""
-        messages = self.persistent_queue_handler.start(False, 0)
+    def pairing_status(self, wait=False):
+        """Check if the session has been ended by the app. Polls the queue once, with
+        `wait` a long-poll that waits up to 20 seconds for messages from the app."""
+        messages = self.persistent_queue_handler.start(wait, 0)
         for message in messages:
-            decrypted_message = json.loads(crypto.decrypt(message["body"], self.key))
+            decrypted_message = json.loads(self.cipher.decrypt(message["body"]))
             if decrypted_message["t"] == MessageType.END.value:
                 self.end(True)
                 return False
@@ -77,7 +180,7 @@ class Session:
         """Send multiple accounts to the app."""
         persistent_message = {"t": MessageType.ADD_BULK.value, "b": accounts}
         api.send_bulk_accounts(
-            crypto.encrypt(json.dumps(persistent_message).encode("utf-8"), self.key),
+            self.cipher.encrypt(json.dumps(persistent_message).encode("utf-8")),
             self.signing_keypair,
             self.env,
         )
@@ -90,24 +193,28 @@ class Session:
             api.delete_queues(self.signing_keypair, self.env)
         else:
             request = {"r": 7, "z": int(time.time() * 1000)}
-            request = crypto.encrypt(json.dumps(request).encode("utf-8"), self.key)
+            request = self.cipher.encrypt(json.dumps(request).encode("utf-8"))
             self.__send_push_message(request, "END_SESSION", "Session ended by CLI")
+        self.account_cache.remove()
         os.remove(Path(click.get_app_dir(APP_NAME), "session"))
 
     def get_session_data(self):
-        """Get all session objects (account or SSH identities)."""
-        session_data = api.get_session_data(self.signing_keypair, self.env)
-        data = json.loads(crypto.decrypt(session_data["data"], self.key))
-        if data["appVersion"] != self.app_version:
-            self.app_version = data["appVersion"]
-            with open(Path(click.get_app_dir(APP_NAME), "session"), "wb") as f:
-                pickle.dump(self, f)
+        """Get all session objects (account or SSH identities). The session data is
+        only downloaded if it changed, and only changed accounts are decrypted."""
+        etag = self.account_cache.load()
+        session_data = api.get_session_data(self.signing_keypair, self.env, etag)
+        if session_data is None:
+            objects = self.account_cache.objects()
+        else:
+            data = json.loads(self.cipher.decrypt(session_data["data"]))
+            if data["appVersion"] != self.app_version:
+                self.app_version = data["appVersion"]
+                self.save()
+            objects = self.account_cache.sync(session_data["accounts"])
+            self.account_cache.save(session_data.get("etag"))
         accounts = {}
         identities = []
-        for id, ciphertext in session_data["accounts"].items():
-            object = json.loads(crypto.decrypt(ciphertext, self.key))
-            if "id" not in object:
-                object["id"] = id
+        for id, object in objects.items():
             if "type" in object and object["type"] == "ssh":
                 identities.append(
                     Key(
@@ -119,6 +226,9 @@ class Session:
                 )
             else:
                 accounts[id] = object
+        self.identity_index = {
+            (identity.key_type, identity.pubkey): identity for identity in identities
+        }
         return accounts, identities
 
     def __send_push_message(self, message, category, body, **kwargs):
@@ -148,52 +258,98 @@ class Session:
         )
         api.send_to_sns(self.signing_keypair, data, self.arn, self.env)
 
-    def __poll_queue(self, request_id, slow_polling, timeout):
-        """Poll the volatile queue for new messages."""
-        messages = self.volatile_queue_handler.start(slow_polling, timeout)
-        for response in messages:
-            message = json.loads(crypto.decrypt(response["body"], self.key))
-            api.delete_from_volatile_queue(
-                self.signing_keypair, response["receiptHandle"], self.env
-            )
-            if message["b"] == request_id:
-                return message
+    def __create_dispatcher(self):
+        return ResponseDispatcher(
+            self.volatile_queue_handler,
+            lambda body: json.loads(self.cipher.decrypt(body)),
+            self.__delete_messages,
+        )
+
+    def __delete_messages(self, receipt_handles):
+        """Delete messages from the volatile queue on a background thread. The thread
+        is not a daemon, so the deletion finishes before the process exits."""
+
+        def delete():
+            for receipt_handle in receipt_handles:
+                try:
+                    api.delete_from_volatile_queue(
+                        self.signing_keypair, receipt_handle, self.env
+                    )
+                except Exception as err:
+                    logging.error(f"Deleting message failed: {err}")
+
+        threading.Thread(target=delete).start()
+
+    def __checked_recently(self, interval):
+        """Whether the pairing status of this session was checked in the last
+        `interval` seconds."""
+        stamp_path = Path(click.get_app_dir(APP_NAME), PAIRING_STAMP)
+        try:
+            if time.time() - os.stat(stamp_path).st_mtime >= interval:
+                return False
+            with open(stamp_path) as f:
+                return f.read() == self.id
+        except FileNotFoundError:
+            return False
+
+    def __mark_checked(self):
+        with open(Path(click.get_app_dir(APP_NAME), PAIRING_STAMP), "w") as f:
+            f.write(self.id)
+
+    @staticmethod
+    def get(check_interval=PAIRING_CHECK_INTERVAL):
+        """Load a session if there is any. Checks whether the session has been ended
+        by the app, unless that has been done in the last `check_interval` seconds.
+        With a `check_interval` of `None` it is not checked at all, e.g. because the
+        caller watches the session itself."""
+        session = Session.load()
+        if session:
+            if check_interval is None or session.__checked_recently(check_interval):
+                return session
+            elif session.pairing_status():
+                session.__mark_checked()
+                return session
             else:
-                return self.__poll_queue(request_id, slow_polling, timeout)
+                return None
 
     @staticmethod
-    def get():
-        """Load a session if there is any."""
-        session_path = Path(click.get_app_dir(APP_NAME), "session")
-        if path.exists(session_path):
-            with open(session_path, "rb") as f:
-                session = pickle.load(f)
-                f.close()
-                if session.pairing_status():
-                    return session
-                else:
-                    return None
+    def __load_pairing(pairing_path):
+        """Load the seed and keypair of a pairing that is in progress."""
+        with open(pairing_path, "rb") as f:
+            data = f.read()
+        if data.startswith(b"\x80"):  # Pickled by an older version.
+            import pickle
+
+            pairing = pickle.loads(data)
+            return pairing["seed"], pairing["priv_key"], pairing["pub_key"]
+        pairing = json.loads(data)
+        return (
+            crypto.from_base64(pairing["seed"]),
+            crypto.load_private_key(crypto.from_base64(pairing["privKey"])),
+            pairing["pubKey"],
+        )
 
     @staticmethod
     def pair():
         """Pair with the app. Displays pairing QR-code in the terminal."""
+        from qrcode import QRCode
+        from qrcode.constants import ERROR_CORRECT_H
+
         pairing_path = Path(click.get_app_dir(APP_NAME), "pairing")
         if path.exists(pairing_path):
-            with open(pairing_path, "rb") as f:
-                pairing = pickle.load(f)
-                seed = pairing["seed"]
-                priv_key = pairing["priv_key"]
-                pub_key = pairing["pub_key"]
-                f.close()
+            seed, priv_key, pub_key = Session.__load_pairing(pairing_path)
             pairing_keypair = crypto.create_signing_keypair(seed)
         else:
             seed = crypto.generate_seed(32)
             priv_key, pub_key = crypto.generate_keypair()
             pairing_keypair = crypto.create_signing_keypair(seed)
             api.create_pairing_queue(pairing_keypair)
-            with open(pairing_path, "wb") as f:
-                pickle.dump({"seed": seed, "priv_key": priv_key, "pub_key": pub_key}, f)
-                f.close()
+            pairing = {
+                "seed": crypto.to_base64(seed),
+                "privKey": crypto.to_base64(bytes(priv_key)),
+                "pubKey": pub_key,
+            }
+            write_atomically(pairing_path, json.dumps(pairing).encode("utf-8"))
 
         queue_handler = QueueHandler(pairing_keypair, "dev", "pairing")
         qr = QRCode(
@@ -230,8 +386,10 @@ class Session:
         t.daemon = True
         t.start()
 
-        message = queue_handler.start(True, -1)[0]["body"]
-        done = True
+        try:
+            message = queue_handler.start(True)[0]["body"]
+        finally:
+            done = True
         message = crypto.verify(message, pairing_keypair.verify_key)
         message = crypto.decrypt_anonymous(message, priv_key)
         message = json.loads(message)
@@ -251,9 +409,7 @@ class Session:
             message["environment"],
             message["arn"],
         )
-        with open(Path(click.get_app_dir(APP_NAME), "session"), "wb") as f:
-            pickle.dump(session, f)
-            f.close()
+        session.save()
         api.delete_pairing_queue(pairing_keypair)
         os.remove(pairing_path)
         return session, message["accounts"]
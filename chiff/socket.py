@@ -1,94 +1,261 @@
 from chiff.ssh_key import KeyType
 from chiff.crypto import from_base64, to_base64
-from chiff.utils import check_response, length_and_data, ssh_reader
-from chiff.session import Session
+from chiff.utils import SSHReader, SSHWriter, check_response, length_and_data
+from chiff.cache import IdentityCache
+from chiff import api
 import click
-from daemon import DaemonContext
 from pathlib import Path
 import socket
 import os
 import logging
 import errno
+import json
+import threading
 
-from chiff.constants import APP_NAME, SOCKET_NAME, MessageType, SSHMessageType
+from chiff.constants import (
+    APP_NAME,
+    CONTROL_SOCKET_NAME,
+    DEFAULT_BACKLOG,
+    DEFAULT_MAX_CLIENTS,
+    FRAME_BUFFER_SIZE,
+    IDENTITY_CACHE_TTL,
+    MAX_AGENT_MESSAGE_SIZE,
+    MAX_CONTROL_MESSAGE_SIZE,
+    SIGN_REQUEST_TIMEOUT,
+    SOCKET_NAME,
+    MessageType,
+    SSHMessageType,
+)
+
+identity_cache = IdentityCache()
 
 
 @click.command()
 @click.option("-d", "--daemon", is_flag=True, help="Run as a daemon process.")
+@click.option(
+    "-b",
+    "--backlog",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BACKLOG,
+    show_default=True,
+    help="The number of pending connections the socket queues up.",
+)
+@click.option(
+    "-c",
+    "--max-clients",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_CLIENTS,
+    show_default=True,
+    help="The number of ssh-agent clients that are served concurrently.",
+)
+@click.option(
+    "-t",
+    "--identity-ttl",
+    type=click.FloatRange(min=0),
+    default=IDENTITY_CACHE_TTL,
+    show_default=True,
+    help="The number of seconds after which cached SSH identities are refreshed.",
+)
 @click.option("-v", "--verbose", count=True)
-def main(daemon, verbose):
+def main(daemon, backlog, max_clients, identity_ttl, verbose):
     level = logging.WARNING
     if verbose == 1:
         level = logging.INFO
     elif verbose > 1:
         level = logging.DEBUG
-    logging.basicConfig(format="[%(levelname)s]\t%(asctime)s\t%(message)s", level=level)
+    logging.basicConfig(
+        format="[%(levelname)s]\t%(asctime)s\t%(threadName)s\t%(message)s",
+        level=level,
+    )
+    identity_cache.ttl = identity_ttl
+    identity_cache.watch = True
+    # Every client may poll a queue while other requests are made.
+    api.configure(pool_size=max(api.POOL_SIZE, 2 * max_clients))
     if daemon:
+        from daemon import DaemonContext
+
         with DaemonContext():
-            start()
+            start(backlog, max_clients)
     else:
-        start()
+        start(backlog, max_clients)
 
 
-def start():
+def start(backlog=DEFAULT_BACKLOG, max_clients=DEFAULT_MAX_CLIENTS):
     """Start the Chiff daemon."""
-    Path(click.get_app_dir(APP_NAME)).mkdir(parents=True, exist_ok=True)
-    filename = f"{click.get_app_dir(APP_NAME)}/{SOCKET_NAME}"
-    if os.path.exists(filename):
-        os.remove(filename)
+    app_dir = click.get_app_dir(APP_NAME)
+    Path(app_dir).mkdir(parents=True, exist_ok=True)
     org_file_name = os.environ.get("SSH_AUTH_SOCK")
     if org_file_name and org_file_name.endswith(SOCKET_NAME):
         org_file_name = None
     logging.info(f"Original ssh-agent socket: {org_file_name}")
-    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    sock.bind(filename)
-    sock.listen(1)
+    sock = listen(f"{app_dir}/{SOCKET_NAME}", backlog)
+    # Only the user may send commands to the daemon.
+    control_sock = listen(f"{app_dir}/{CONTROL_SOCKET_NAME}", backlog, 0o600)
+    threading.Thread(
+        target=serve_control, args=(control_sock, max_clients), daemon=True
+    ).start()
     logging.info("Starting Chiff daemon.")
+    serve(sock, org_file_name, max_clients)
+
+
+def listen(filename, backlog, mode=None):
+    """Create a Unix socket that listens on `filename`, replacing any existing
+    socket file. With `mode`, the socket file is created with these permissions, so
+    it is never accessible to others, not even briefly."""
+    if os.path.exists(filename):
+        os.remove(filename)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if mode is None:
+        sock.bind(filename)
+    else:
+        umask = os.umask(0o777 & ~mode)
+        try:
+            sock.bind(filename)
+        finally:
+            os.umask(umask)
+    sock.listen(backlog)
+    return sock
+
+
+def serve(sock, org_file_name, max_clients=DEFAULT_MAX_CLIENTS):
+    """Accept ssh-agent connections on a listening socket."""
+    accept(
+        sock,
+        max_clients,
+        lambda connection: serve_connection(connection, org_file_name),
+    )
+
+
+def serve_control(sock, max_clients=DEFAULT_MAX_CLIENTS):
+    """Accept connections from the chiff CLI on the control socket."""
+    accept(sock, max_clients, serve_control_connection)
+
+
+def accept(sock, max_clients, handler):
+    """Accept connections on a listening socket and handle each of them on its own
+    thread, so a pending phone approval doesn't block other clients. At most
+    `max_clients` connections are handled at the same time, the others wait in the
+    backlog of the socket."""
+    slots = threading.BoundedSemaphore(max_clients)
+
+    def handle(connection):
+        try:
+            handler(connection)
+        finally:
+            slots.release()
+
     while True:
-        connection = sock.accept()[0]
+        slots.acquire()
         try:
-            org_sock = None
-            if org_file_name:
-                logging.info("Setting up original socket.")
-                org_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                org_sock.connect(org_file_name)
-            else:
-                logging.info("Original socket not found.")
-            handle_connection(connection, org_sock)
-        except OSError as err:
-            if err.errno == errno.EPIPE:
-                logging.error(err)
-            else:
-                raise
-        except Exception as err:
+            connection = sock.accept()[0]
+        except BaseException:
+            slots.release()
+            raise
+        threading.Thread(target=handle, args=(connection,), daemon=True).start()
+
+
+def serve_connection(connection, org_file_name):
+    """Handle a single ssh-agent connection."""
+    org_sock = None
+    try:
+        if org_file_name:
+            logging.info("Setting up original socket.")
+            org_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            org_sock.connect(org_file_name)
+        else:
+            logging.info("Original socket not found.")
+        handle_connection(connection, org_sock)
+    except OSError as err:
+        if err.errno == errno.EPIPE:
             logging.error(err)
-            connection.sendall(length_and_data(SSHMessageType.SSH_AGENT_FAILURE.raw))
-        finally:
-            if org_sock:
-                org_sock.close()
-            connection.close()
-            logging.info("Closing connection.")
+        else:
+            raise
+    except Exception as err:
+        logging.error(err)
+        connection.sendall(length_and_data(SSHMessageType.SSH_AGENT_FAILURE.raw))
+    finally:
+        if org_sock:
+            org_sock.close()
+        connection.close()
+        logging.info("Closing connection.")
 
 
-def forward(data, connection, org_sock):
-    """Forward a message the original ssh agent."""
-    if data and len(data) >= 5:
-        logging.info(
-            "Forwarding message of type {type} to original agent.".format(type=data[4])
-        )
-        org_sock.sendall(data)
-        resp = org_sock.recv(2048)
-        connection.sendall(resp)
-        return forward(connection.recv(2048), connection, org_sock)
+def serve_control_connection(connection):
+    """Handle a single connection on the control socket."""
+    try:
+        handle_control_connection(connection)
+    except Exception as err:
+        logging.error(err)
+    finally:
+        connection.close()
+
+
+class FrameReader:
+    """Reads length-prefixed messages from a socket into a reusable buffer.
+    Multiple messages received at once are split, and partially received messages
+    are completed with subsequent reads. Returned frames are views on the buffer and
+    are only valid until the next call to `read`."""
 
+    def __init__(self, sock, size=FRAME_BUFFER_SIZE, max_size=MAX_AGENT_MESSAGE_SIZE):
+        self.sock = sock
+        self.max_size = max_size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
 
-def get_original_identities(org_sock, data):
+    def read(self):
+        """Read the next message, including its length prefix. Returns `None` if the
+        connection is closed."""
+        while True:
+            available = self.end - self.start
+            size = 4
+            if available >= size:
+                size += int.from_bytes(self.view[self.start : self.start + 4], "big")
+                if size > self.max_size:
+                    raise ValueError(f"Message of {size} bytes exceeds maximum size")
+                if available >= size:
+                    frame = self.view[self.start : self.start + size]
+                    self.start += size
+                    return frame
+            self.__reserve(size)
+            received = self.sock.recv_into(self.view[self.end :])
+            if received == 0:
+                return None
+            self.end += received
+
+    def __reserve(self, size):
+        """Make room for a message of `size` bytes at the start of the buffer."""
+        if self.start + size <= len(self.buffer):
+            return
+        available = self.end - self.start
+        if size > len(self.buffer):
+            buffer = bytearray(max(size, 2 * len(self.buffer)))
+            view = memoryview(buffer)
+            view[:available] = self.view[self.start : self.end]
+            self.buffer, self.view = buffer, view
+        else:
+            self.view[:available] = self.view[self.start : self.end]
+        self.start = 0
+        self.end = available
+
+
+def forward(data, org_reader):
+    """Forward a message to the original ssh agent and return its response."""
+    logging.info(
+        "Forwarding message of type {type} to original agent.".format(type=data[4])
+    )
+    org_reader.sock.sendall(data)
+    return org_reader.read()
+
+
+def get_original_identities(org_reader, data):
     """Get all SSH identities from the original agent."""
-    if not org_sock:
+    if not org_reader:
         return 0, None
     logging.info("Getting all SSH identities from the original agent.")
-    org_sock.sendall(data)
-    resp = org_sock.recv(2048)
+    org_reader.sock.sendall(data)
+    resp = org_reader.read()
     type = resp and len(resp) >= 5 and resp[4]
     if type == SSHMessageType.SSH_AGENT_IDENTITIES_ANSWER.value:
         length = int.from_bytes(resp[5:9], "big")
@@ -101,56 +268,56 @@ def get_original_identities(org_sock, data):
         return 0, None
 
 
-def handle_identities_request(connection, data, org_sock):
+def handle_identities_request(data, org_reader):
     """Get all Chiff SSH identities from the session and append the
     original SSH identities."""
-    session = Session.get()
+    session, identities = identity_cache.get()
     if not session:
-        if org_sock:
+        if org_reader:
             logging.info("No active session, forwarding request.")
-            return forward(data, connection, org_sock)
+            return forward(data, org_reader)
         else:
             logging.info("No active session and no original agent, ending.")
             return
-    identities = session.get_ssh_identities()
     logging.info("Obtained {count} identities from Chiff".format(count=len(identities)))
-    original_count, original_identities = get_original_identities(org_sock, data)
+    original_count, original_identities = get_original_identities(org_reader, data)
     total_count = len(identities) + original_count
     logging.info("Obtained {count} identities in total".format(count=total_count))
-    response = SSHMessageType.SSH_AGENT_IDENTITIES_ANSWER.raw + total_count.to_bytes(
-        4, "big", signed=False
-    )
-    for identity in identities:
-        response += identity.ssh_identity()
-    if original_count > 0:
-        response += original_identities
-    connection.sendall(length_and_data(response))
-    return handle_connection(connection, org_sock)
+    writer = SSHWriter()
+    with writer.nested_string():
+        writer.write_byte(SSHMessageType.SSH_AGENT_IDENTITIES_ANSWER.value)
+        writer.write_uint32(total_count)
+        for identity in identities:
+            writer.write_bytes(identity.ssh_identity())
+        if original_count > 0:
+            writer.write_bytes(original_identities)
+    return writer.getvalue()
 
 
-def handle_signing(connection, data, org_sock):
+def handle_signing(data, org_reader):
     """Handle a signing request. First checks if the key is present in Chiff,
     otherwise forwards to the original ssh-agent."""
-    hash_data, challenge, flags = ssh_reader(data[5:])
-    hash_reader = ssh_reader(hash_data)
-    key = None
-    key_type = KeyType(next(hash_reader).decode("utf-8"))
+    reader = SSHReader(data)
+    reader.read_bytes(5)  # Length and type
+    key_reader = SSHReader(reader.read_string())
+    challenge = reader.read_string()
+    reader.read_uint32()  # Flags
+    key_type = KeyType(bytes(key_reader.read_string()).decode("utf-8"))
     if key_type is KeyType.ECDSA256:
-        next(hash_reader)  # Curve
-    key = next(hash_reader)
-    session = Session.get()
+        key_reader.read_string()  # Curve
+    key = bytes(key_reader.read_string())
+    session, identity = identity_cache.find(key, key_type)
     if not session:
-        if org_sock:
+        if org_reader:
             logging.info("No active session, forwarding request.")
-            return forward(data, connection, org_sock)
+            return forward(data, org_reader)
         else:
             logging.info("No active session and no original agent, ending.")
             return
-    identity = session.get_ssh_identity(key, key_type)
     if not identity:
-        if org_sock:
+        if org_reader:
             logging.info("Request key not found in session, forwarding request.")
-            return forward(data, connection, org_sock)
+            return forward(data, org_reader)
         else:
             logging.info(
                 "Request key not found in session and no original agent, ending."
@@ -163,41 +330,87 @@ def handle_signing(connection, data, org_sock):
         "c": to_base64(challenge),
     }
     logging.info("Sending request to phone.")
-    response = session.send_request(request, 9)
+    response = session.send_request(request, SIGN_REQUEST_TIMEOUT)
     if check_response(response, logging.info):
-        response = (
-            SSHMessageType.SSH_AGENT_SIGN_RESPONSE.raw
-            + identity.encode_signature(from_base64(response["s"]))
-        )
+        writer = SSHWriter()
+        with writer.nested_string():
+            writer.write_byte(SSHMessageType.SSH_AGENT_SIGN_RESPONSE.value)
+            writer.write_bytes(identity.encode_signature(from_base64(response["s"])))
         logging.info("Response received from phone.")
-        connection.sendall(length_and_data(response))
-        return handle_connection(connection, org_sock)
+        return writer.getvalue()
     else:
         raise Exception("Request failed")
 
 
-def handle_connection(connection, org_sock):
-    """Handle socket connection. Forwards to original socket if Chiff doesn't
-    support the type of request"""
-    data = connection.recv(2048)
-    type = data and len(data) >= 5 and data[4]
-    if not type:
-        return
-    elif type == SSHMessageType.SSH_AGENTC_REQUEST_IDENTITIES.value:
-        return handle_identities_request(connection, data, org_sock)
+def handle_message(data, org_reader):
+    """Handle a single message and return the response. Forwards to original socket
+    if Chiff doesn't support the type of request. Returns `None` if the connection
+    should be closed."""
+    type = data[4]
+    if type == SSHMessageType.SSH_AGENTC_REQUEST_IDENTITIES.value:
+        return handle_identities_request(data, org_reader)
     elif type == SSHMessageType.SSH_AGENTC_SIGN_REQUEST.value:
-        return handle_signing(connection, data, org_sock)
+        return handle_signing(data, org_reader)
     elif type == SSHMessageType.SSH_AGENTC_EXTENSION.value:
         # Chiff doesn't support extensions.
-        connection.sendall(length_and_data(SSHMessageType.SSH_AGENT_FAILURE.raw))
-        return handle_connection(connection, org_sock)
-    elif org_sock:
+        return length_and_data(SSHMessageType.SSH_AGENT_FAILURE.raw)
+    elif org_reader:
         # Chiff doesn't support this request type, delegate to original SSH agent.
-        return forward(data, connection, org_sock)
+        return forward(data, org_reader)
     else:
         # Chiff doesn't support this request type, send failure message.
-        connection.sendall(length_and_data(SSHMessageType.SSH_AGENT_FAILURE.raw))
-        return handle_connection(connection, org_sock)
+        return length_and_data(SSHMessageType.SSH_AGENT_FAILURE.raw)
+
+
+def handle_connection(connection, org_sock):
+    """Handle socket connection. Answers messages until the client closes the
+    connection."""
+    reader = FrameReader(connection)
+    org_reader = FrameReader(org_sock) if org_sock else None
+    while True:
+        data = reader.read()
+        if data is None or len(data) < 5:
+            return
+        response = handle_message(data, org_reader)
+        if response is None:
+            return
+        connection.sendall(response)
+
+
+def handle_control_message(message):
+    """Handle a command of the chiff CLI with the session of the daemon, so the CLI
+    doesn't have to load the session and set up connections itself."""
+    session = identity_cache.get()[0]
+    command = message["c"]
+    if command == "session":
+        return session and {"id": session.id}
+    elif not session:
+        raise Exception("There is no active session.")
+    elif command == "session_data":
+        accounts, identities = session.get_session_data()
+        return {
+            "accounts": accounts,
+            "identities": [identity.to_dict() for identity in identities],
+        }
+    elif command == "request":
+        return session.send_request(message["request"], message.get("timeout"))
+    else:
+        raise Exception(f"Unknown command {command}")
+
+
+def handle_control_connection(connection):
+    """Answer JSON messages from the chiff CLI until it closes the connection."""
+    reader = FrameReader(connection, max_size=MAX_CONTROL_MESSAGE_SIZE)
+    while True:
+        data = reader.read()
+        if data is None:
+            return
+        try:
+            response = {"r": handle_control_message(json.loads(bytes(data[4:])))}
+        except Exception as err:
+            logging.error(f"Control command failed: {err}")
+            response = {"e": str(err)}
+        connection.sendall(length_and_data(json.dumps(response).encode("utf-8")))
 
 
 if __name__ == "__main__":
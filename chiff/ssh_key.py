@@ -1,5 +1,5 @@
-from chiff.crypto import sha256_data, to_default_base64
-from chiff.utils import length_and_data
+from chiff.crypto import from_base64, sha256_data, to_base64, to_default_base64
+from chiff.utils import SSHWriter
 from enum import Enum, unique
 
 
@@ -10,68 +10,112 @@ class KeyType(Enum):
     ECDSA256 = "ecdsa-sha2-nistp256"
     ED25519 = "ssh-ed25519"
 
-    @property
-    def raw(self):
-        return bytes(self.value, "utf-8")
-
-    @property
-    def curve(self):
-        if self == KeyType.ECDSA256:
-            return b"nistp256"
+    def __init__(self, value):
+        self.raw = bytes(value, "utf-8")
+        self.curve = b"nistp256" if value == "ecdsa-sha2-nistp256" else None
 
 
 class Key(object):
-    """A SSH key."""
+    """A SSH key. Keys are immutable, so the wire format and fingerprint are only
+    computed once. Keys are equal if they have the same type and public key."""
+
+    __slots__ = (
+        "id",
+        "pubkey",
+        "key_type",
+        "name",
+        "blob",
+        "identity",
+        "__fingerprint",
+    )
 
     def __init__(self, id, pubkey, key_type, name):
-        self.id = id
-        self.pubkey = pubkey
-        self.key_type = key_type
-        self.name = name
+        blob = Key.__key_blob(bytes(pubkey), key_type)
+        writer = SSHWriter()
+        writer.write_string(blob)
+        writer.write_string(bytes(name, "utf-8"))
+        fingerprint = "SHA256:{hash}".format(
+            hash=to_default_base64(sha256_data(blob)).rstrip("=")
+        )
+        for attribute, value in [
+            ("id", id),
+            ("pubkey", bytes(pubkey)),
+            ("key_type", key_type),
+            ("name", name),
+            ("blob", blob),
+            ("identity", writer.getvalue()),
+            ("_Key__fingerprint", fingerprint),
+        ]:
+            object.__setattr__(self, attribute, value)
 
-    def ssh_identity(self):
-        return length_and_data(self.__key_blob()) + length_and_data(
-            bytes(self.name, "utf-8")
+    @staticmethod
+    def from_dict(data):
+        """Create a key from the output of `to_dict`."""
+        return Key(
+            data["id"],
+            from_base64(data["pubKey"]),
+            KeyType(data["algorithm"]),
+            data["name"],
         )
 
+    def to_dict(self):
+        """A JSON serializable representation of the key."""
+        return {
+            "id": self.id,
+            "pubKey": to_base64(self.pubkey),
+            "algorithm": self.key_type.value,
+            "name": self.name,
+        }
+
+    def ssh_identity(self):
+        return self.identity
+
     def encode_signature(self, signature):
-        signature_data = length_and_data(self.key_type.raw)
-        if self.key_type is KeyType.ECDSA256:
-            r = signature[: len(signature) // 2]
-            if r[0] > 127:
-                # Prepend with zero if first bit is positive.
-                r = length_and_data(b"\x00" + r)
+        writer = SSHWriter()
+        with writer.nested_string():
+            writer.write_string(self.key_type.raw)
+            if self.key_type is KeyType.ECDSA256:
+                # The signature is r and s concatenated, encoded as mpints.
+                half = len(signature) // 2
+                with writer.nested_string():
+                    writer.write_mpint(int.from_bytes(signature[:half], "big"))
+                    writer.write_mpint(int.from_bytes(signature[half:], "big"))
             else:
-                r = length_and_data(r)
-            s = signature[len(signature) // 2 :]
-            if s[0] > 127:
-                # Prepend with zero if first bit is positive.
-                s = length_and_data(b"\x00" + s)
-            else:
-                s = length_and_data(s)
-            signature_data += length_and_data(r + s)
-        else:
-            signature_data += length_and_data(signature)
-        return length_and_data(signature_data)
+                writer.write_string(signature)
+        return writer.getvalue()
 
     def fingerprint(self):
-        return "SHA256:{hash}".format(
-            hash=to_default_base64(sha256_data(self.__key_blob())).rstrip("=")
-        )
+        return self.__fingerprint
+
+    @staticmethod
+    def __key_blob(pubkey, key_type):
+        writer = SSHWriter()
+        writer.write_string(key_type.raw)
+        if key_type is KeyType.ECDSA256:
+            writer.write_string(key_type.curve)
+        writer.write_string(pubkey)
+        return writer.getvalue()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Key is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Key is immutable")
+
+    def __reduce__(self):
+        return Key, (self.id, self.pubkey, self.key_type, self.name)
+
+    def __eq__(self, other):
+        if not isinstance(other, Key):
+            return NotImplemented
+        return self.key_type is other.key_type and self.pubkey == other.pubkey
 
-    def __key_blob(self):
-        if self.key_type is KeyType.ECDSA256:
-            return (
-                length_and_data(KeyType.ECDSA256.raw)
-                + length_and_data(KeyType.ECDSA256.curve)
-                + length_and_data(self.pubkey)
-            )
-        elif self.key_type is KeyType.ED25519:
-            return length_and_data(KeyType.ED25519.raw) + length_and_data(self.pubkey)
+    def __hash__(self):
+        return hash((self.key_type, self.pubkey))
 
     def __str__(self):
         return "{type} {key} {name}".format(
             type=self.key_type.value,
-            key=to_default_base64(self.__key_blob()),
+            key=to_default_base64(self.blob),
             name=self.name,
         )
@@ -1,20 +1,68 @@
 from __future__ import print_function
 
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from os import path
+from os import environ, path
 
 from chiff import crypto
 from urllib.parse import urlparse
 
-from chiff.constants import MessageType, APP_NAME
-import tldextract
+from chiff.constants import (
+    MessageType,
+    APP_NAME,
+    SITE_ID_CACHE_SIZE,
+    TLD_FETCH_TIMEOUT,
+    TLD_SNAPSHOT_ENV,
+)
 import click
+import os
+import tempfile
+import threading
 
 TLD_CACHE = Path(click.get_app_dir(APP_NAME), "cache")
 
-extract = tldextract.TLDExtract(cache_dir=TLD_CACHE)
-if not path.exists(TLD_CACHE):
-    extract.update(fetch_now=True)
+_extract = None
+_extract_lock = threading.Lock()
+
+
+def get_extractor():
+    """Get the public suffix list engine. It is loaded on first use, so commands
+    that don't need it don't pay for it. If the `CHIFF_TLD_SNAPSHOT` environment
+    variable is set, the snapshot bundled with tldextract is used and nothing is
+    fetched or cached."""
+    global _extract
+    if _extract is None:
+        with _extract_lock:
+            if _extract is None:
+                import tldextract
+
+                if environ.get(TLD_SNAPSHOT_ENV):
+                    extract = tldextract.TLDExtract(cache_dir=None, suffix_list_urls=())
+                else:
+                    extract = tldextract.TLDExtract(
+                        cache_dir=TLD_CACHE, cache_fetch_timeout=TLD_FETCH_TIMEOUT
+                    )
+                    if not path.exists(TLD_CACHE):
+                        extract.update(fetch_now=True)
+                _extract = extract
+    return _extract
+
+
+def write_atomically(file_path, data, mode=0o600):
+    """Write a file by writing a temporary file and renaming it, so readers never
+    see a partially written file. Every write uses its own temporary file, so
+    concurrent writers don't interfere and the last rename wins."""
+    directory, name = os.path.split(os.fspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), mode)
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
 
 
 def check_response(response, logger):
@@ -42,23 +90,127 @@ def length_and_data(data):
 
 def ssh_reader(data):
     """Generator for SSH messages."""
-    remaining = data
-    while len(remaining) > 0:
-        length = int.from_bytes(remaining[:4], "big")
-        data_chunk = remaining[4 : length + 4]
-        yield data_chunk
-        remaining = remaining[length + 4 :]
+    reader = SSHReader(data)
+    while reader.remaining:
+        yield bytes(reader.read_string())
+
+
+class SSHReader:
+    """Reads fields in the SSH wire format (RFC 4251) from a buffer. Fields are
+    returned as views on the buffer, so nothing is copied. Raises a `ValueError` when
+    a field extends beyond the end of the buffer."""
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.offset = 0
+
+    @property
+    def remaining(self):
+        return len(self.view) - self.offset
+
+    def read_bytes(self, length):
+        if length > self.remaining:
+            raise ValueError(
+                f"Truncated SSH message: expected {length} bytes at offset "
+                f"{self.offset}, but only {self.remaining} remain."
+            )
+        data = self.view[self.offset : self.offset + length]
+        self.offset += length
+        return data
+
+    def read_byte(self):
+        return self.read_bytes(1)[0]
+
+    def read_uint32(self):
+        return int.from_bytes(self.read_bytes(4), "big")
+
+    def read_string(self):
+        return self.read_bytes(self.read_uint32())
+
+    def read_mpint(self):
+        return int.from_bytes(self.read_string(), "big", signed=True)
+
+
+class SSHWriter:
+    """Builds a message in the SSH wire format (RFC 4251) in a single buffer."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write_bytes(self, data):
+        self.buffer += data
+        return self
+
+    def write_byte(self, value):
+        self.buffer.append(value)
+        return self
+
+    def write_uint32(self, value):
+        self.buffer += value.to_bytes(4, "big", signed=False)
+        return self
+
+    def write_string(self, data):
+        self.write_uint32(len(data))
+        self.buffer += data
+        return self
+
+    def write_mpint(self, value):
+        length = (value.bit_length() + 8) // 8 if value else 0
+        return self.write_string(value.to_bytes(length, "big", signed=True))
+
+    @contextmanager
+    def nested_string(self):
+        """Write a string whose contents are written in the `with` block. The length
+        is filled in afterwards, so the contents don't have to be built first."""
+        start = len(self.buffer)
+        self.buffer += bytes(4)
+        yield self
+        length = len(self.buffer) - start - 4
+        self.buffer[start : start + 4] = length.to_bytes(4, "big", signed=False)
+
+    def getvalue(self):
+        return bytes(self.buffer)
 
 
 def get_site_ids(url):
     """Get primary and secondary siteID for an url."""
-    parsed_domain = urlparse(url)  # contains the protocol
-    extracted_domain = extract(url)
+    return _get_origin_site_ids(site_id_origin(url))
 
-    top_domain = ""
 
-    if parsed_domain is None and url is None:
+def get_site_ids_batch(urls, executor=None):
+    """Get primary and secondary siteIDs for a list of urls, resolving every origin
+    only once. If an executor is provided (e.g. a ProcessPoolExecutor), the origins
+    are resolved by its workers."""
+    origins = [site_id_origin(url) for url in urls]
+    unique_origins = list(dict.fromkeys(origins))
+    if executor is None:
+        site_ids = map(_get_origin_site_ids, unique_origins)
+    else:
+        site_ids = executor.map(_get_origin_site_ids, unique_origins, chunksize=64)
+    resolved = dict(zip(unique_origins, site_ids))
+    return [resolved[origin] for origin in origins]
+
+
+def site_id_origin(url):
+    """The part of an url that determines its siteIDs: the scheme and host without
+    credentials, or the whole url if it has no host."""
+    if url is None:
         raise ValueError("Invalid / empty URL")
+    parsed_url = urlparse(url)
+    if not parsed_url.netloc:
+        return url
+    host = parsed_url.netloc.rpartition("@")[2]
+    if parsed_url.scheme:
+        return parsed_url.scheme + "://" + host
+    return "//" + host
+
+
+@lru_cache(maxsize=SITE_ID_CACHE_SIZE)
+def _get_origin_site_ids(origin):
+    parsed_domain = urlparse(origin)  # contains the protocol
+    extracted_domain = get_extractor()(origin)
+
+    top_domain = ""
 
     if extracted_domain.subdomain == "":
         full_domain = crypto.sha256(
@@ -1,5 +1,4 @@
 import json
-import pickle
 import pytest
 
 from os import path
@@ -50,14 +49,12 @@ def set_temp_path(mocker, tmp_path, session, requests_mock):
         d = tmp_path / app_name
         if not path.exists(d):
             d.mkdir()
-        p = d / "session"
-        with open(p, "wb") as f:
-            pickle.dump(session, f)
+        session.save(d / "session")
         return d
 
     mocker.patch("click.get_app_dir", get_tmp_path)
     mocker.patch("chiff.session.randint", lambda x, y: 42)
-    mocker.patch("chiff.session.QRCode.print_ascii", print_ascii)
+    mocker.patch("qrcode.QRCode.print_ascii", print_ascii)
     mocker.patch("chiff.api.get_from_sqs", api_call({"messages": []}))
     requests_mock.post(ANY, json={})
     requests_mock.delete(ANY, json={})
@@ -72,9 +69,7 @@ def get_parameterized_tmp_path(request, session, tmp_path):
         if not path.exists(d):
             d.mkdir()
         if request.param:
-            p = d / "session"
-            with open(p, "wb") as f:
-                pickle.dump(session, f)
+            session.save(d / "session")
         return d
 
     return _get_path
@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import json
+import threading
+
+import pytest
+
+from chiff import crypto
+from chiff.account_cache import AccountCache
+from tests.test_helper import SHARED_KEY, TEST_ACCOUNT
+
+
+def encrypt(account):
+    return crypto.encrypt(json.dumps(account).encode("utf-8"), SHARED_KEY)
+
+
+@pytest.fixture
+def accounts():
+    return {
+        f"account_{i}": encrypt(
+            {**TEST_ACCOUNT, "id": f"account_{i}", "password": "secret", "notes": "n"}
+        )
+        for i in range(10)
+    }
+
+
+@pytest.fixture
+def decrypted(mocker):
+    """The number of decrypted messages."""
+    count = [0]
+    decrypt_many = crypto.SessionCipher.decrypt_many
+
+    def _decrypt_many(self, messages):
+        count[0] += len(messages)
+        return decrypt_many(self, messages)
+
+    mocker.patch("chiff.crypto.SessionCipher.decrypt_many", _decrypt_many)
+    return count
+
+
+def test_only_changed_accounts_are_decrypted(accounts, decrypted):
+    cache = AccountCache(crypto.SessionCipher(SHARED_KEY), "test-session-id")
+    objects = cache.sync(accounts)
+    assert decrypted[0] == 10
+    assert objects["account_3"]["username"] == "test-username"
+    accounts["account_3"] = encrypt({**TEST_ACCOUNT, "username": "changed"})
+    del accounts["account_4"]
+    objects = cache.sync(accounts)
+    assert decrypted[0] == 11
+    assert objects["account_3"]["username"] == "changed"
+    assert objects["account_3"]["id"] == "account_id"
+    assert "account_4" not in objects
+
+
+def test_secrets_are_not_cached(accounts):
+    cache = AccountCache(crypto.SessionCipher(SHARED_KEY), "test-session-id")
+    objects = cache.sync(accounts)
+    assert "password" not in objects["account_0"]
+    assert "notes" not in objects["account_0"]
+    cache.save('"v1"')
+    with open(cache.path) as f:
+        data = f.read()
+    assert "test-username" not in data
+    assert "secret" not in crypto.decrypt(data, SHARED_KEY).decode("utf-8")
+
+
+def test_cache_is_persisted(accounts, decrypted):
+    cache = AccountCache(crypto.SessionCipher(SHARED_KEY), "test-session-id")
+    cache.sync(accounts)
+    cache.save('"v1"')
+    cache = AccountCache(crypto.SessionCipher(SHARED_KEY), "test-session-id")
+    cache.load()
+    assert cache.etag == '"v1"'
+    decrypted[0] = 0
+    assert cache.sync(accounts)["account_0"]["username"] == "test-username"
+    assert decrypted[0] == 0
+
+    other_session = AccountCache(crypto.SessionCipher(SHARED_KEY), "other-session-id")
+    other_session.load()
+    assert other_session.etag is None
+    assert other_session.objects() == {}
+
+
+def test_unchanged_cache_is_not_written(accounts):
+    cache = AccountCache(crypto.SessionCipher(SHARED_KEY), "test-session-id")
+    cache.sync(accounts)
+    cache.save('"v1"')
+    stat_key = cache.stat_key
+    cache.sync(accounts)
+    cache.save('"v1"')
+    assert cache.stat_key == stat_key
+    cache.save('"v2"')
+    assert cache.stat_key != stat_key
+
+
+def test_unreadable_cache_is_ignored(accounts):
+    cache = AccountCache(crypto.SessionCipher(SHARED_KEY), "test-session-id")
+    cache.path.write_text("garbage")
+    cache.load()
+    assert cache.objects() == {}
+    cache.remove()
+    assert not cache.path.exists()
+
+
+def test_cache_is_shared_by_threads(mocker, accounts):
+    cache = AccountCache(crypto.SessionCipher(SHARED_KEY), "test-session-id")
+    decrypting = threading.Event()
+    release = threading.Event()
+    decrypt_many = crypto.SessionCipher.decrypt_many
+
+    def _decrypt_many(self, messages):
+        decrypting.set()
+        release.wait(5)
+        return decrypt_many(self, messages)
+
+    mocker.patch("chiff.crypto.SessionCipher.decrypt_many", _decrypt_many)
+    with ThreadPoolExecutor(2) as executor:
+        synced = executor.submit(cache.sync, accounts)
+        assert decrypting.wait(5)
+        # Readers wait for the sync, instead of seeing it half done.
+        objects = executor.submit(cache.objects)
+        with pytest.raises(TimeoutError):
+            objects.result(0.05)
+        release.set()
+        assert len(synced.result(5)) == 10
+        assert len(objects.result(5)) == 10
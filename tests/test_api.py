@@ -6,6 +6,7 @@ from chiff.api import (
     delete_queues,
     delete_pairing_queue,
     get_from_sqs,
+    get_ppd,
     get_session_data,
     send_bulk_accounts,
     send_to_sns,
@@ -79,6 +80,37 @@ def test_get_session_data(requests_mock, status_code, expected, env):
         assert get_session_data(keypair, env) == {}
 
 
+def test_get_session_data_etag(requests_mock):
+    requests_mock.get(ANY, json={"accounts": {}}, headers={"ETag": '"v1"'})
+    keypair = crypto.create_signing_keypair(SEED + SEED)
+    assert get_session_data(keypair, "dev") == {"accounts": {}, "etag": '"v1"'}
+    assert "If-None-Match" not in requests_mock.last_request.headers
+    requests_mock.get(ANY, status_code=304)
+    assert get_session_data(keypair, "dev", '"v1"') is None
+    assert requests_mock.last_request.headers["If-None-Match"] == '"v1"'
+
+
+@pytest.mark.parametrize(
+    "status_code, expected, env",
+    [
+        (200, {"properties": {}}, "dev"),
+        (200, {"properties": {}}, "prod"),
+        (404, None, "dev"),
+    ],
+)
+def test_get_ppd(requests_mock, status_code, expected, env):
+    requests_mock.get(ANY, json={"properties": {}}, status_code=status_code)
+    assert get_ppd("site_id", env) == expected
+    endpoint = "dev" if env == "dev" else "v1"
+    assert requests_mock.last_request.url == f"{api.API_URL}/{endpoint}/ppd/site_id"
+
+
+def test_get_ppd_error(requests_mock):
+    requests_mock.get(ANY, status_code=500)
+    with pytest.raises(Exception, match="Error 500"):
+        get_ppd("site_id", "dev")
+
+
 @pytest.mark.parametrize(
     "status_code, expected, env",
     [
@@ -143,3 +175,24 @@ def test_send_bulk_accounts(requests_mock, status_code, expected, env):
     keypair = crypto.create_signing_keypair(SEED + SEED)
     with expected:
         assert send_bulk_accounts("data", keypair, env) == {}
+
+
+def test_client_is_shared(requests_mock):
+    requests_mock.get(ANY, json={})
+    keypair = crypto.create_signing_keypair(SEED + SEED)
+    client = api.get_client()
+    get_session_data(keypair, "dev")
+    assert api.get_client() is client
+    assert requests_mock.last_request.timeout == api.TIMEOUT
+
+
+def test_configure_client(requests_mock):
+    requests_mock.get(ANY, json={})
+    keypair = crypto.create_signing_keypair(SEED + SEED)
+    client = api.get_client()
+    api.configure(pool_size=2, timeout=5)
+    assert api.get_client() is not client
+    assert api.get_client().adapters["https://"]._pool_maxsize == 2
+    get_session_data(keypair, "dev")
+    assert requests_mock.last_request.timeout == 5
+    api.configure()
@@ -0,0 +1,51 @@
+from chiff.bulk_import import add_site_ids, audit_accounts, chunked
+from chiff.password_audit import TOO_SHORT
+from chiff.utils import get_site_ids
+
+
+def test_chunked():
+    assert list(chunked(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(chunked([], 3)) == []
+
+
+def test_add_site_ids():
+    accounts = [{"l": f"https://site{i % 3}.example.com/login"} for i in range(7)]
+    chunks = list(add_site_ids(chunked(accounts, 3)))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    for account in accounts:
+        assert account["s"] == get_site_ids(account["l"])[0]
+
+
+def test_audit_accounts(mocker):
+    ppds = {get_site_ids("https://strict.example.com")[0]: {"properties": {}}}
+    get_ppd = mocker.patch(
+        "chiff.api.get_ppd", side_effect=lambda site_id, env: ppds.get(site_id)
+    )
+    accounts = [
+        {"l": "https://strict.example.com/login", "p": "short"},
+        {"l": "https://strict.example.com/", "p": "longenough"},
+        {"l": "https://strict.example.com/", "p": None},
+        {"l": "https://other.example.com/", "p": "short"},
+    ]
+    failures, unchecked = audit_accounts(accounts, "dev", 2)
+    assert failures == [(accounts[0], [TOO_SHORT]), (accounts[2], [TOO_SHORT])]
+    assert unchecked == []
+    assert get_ppd.call_count == 2
+
+
+def test_audit_accounts_skips_sites_with_errors(mocker):
+    broken = get_site_ids("https://broken.example.com")[0]
+
+    def get_ppd(site_id, env):
+        if site_id == broken:
+            raise Exception("Error 500: Internal server error")
+        return {"properties": {}}
+
+    mocker.patch("chiff.api.get_ppd", get_ppd)
+    accounts = [
+        {"l": "https://broken.example.com/", "p": "short"},
+        {"l": "https://other.example.com/", "p": "short"},
+    ]
+    failures, unchecked = audit_accounts(accounts, "dev", 2)
+    assert failures == [(accounts[1], [TOO_SHORT])]
+    assert unchecked == [accounts[0]]
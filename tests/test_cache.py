@@ -0,0 +1,115 @@
+import os
+import threading
+
+import pytest
+
+from chiff.cache import MISS_REFRESH_INTERVAL, IdentityCache, invalidate_identities
+from chiff.ssh_key import KeyType
+from tests.test_helper import ECDSA_PUB_KEY, PUB_KEY
+
+
+@pytest.fixture
+def session_data_calls(mocker, get_session_data):
+    calls = []
+
+    def _get_session_data(*args):
+        calls.append(args)
+        return get_session_data(*args)
+
+    mocker.patch("chiff.api.get_session_data", _get_session_data)
+    return calls
+
+
+@pytest.fixture
+def app_dir(mocker, tmp_path, session):
+    """An app dir with a session that isn't rewritten on every access."""
+    d = tmp_path / "app"
+    d.mkdir()
+    session.save(d / "session")
+    mocker.patch("click.get_app_dir", lambda app_name: d)
+    return d
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [1000.0]
+    mocker.patch("chiff.cache.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_identities_served_from_memory(app_dir, session_data_calls):
+    cache = IdentityCache(60)
+    session, identities = cache.get()
+    assert session.id == "test-session-id"
+    assert identities[0].id == "identity_id"
+    assert cache.get()[1] is identities
+    assert len(session_data_calls) == 1
+
+
+def test_expired_identities_refresh_in_background(app_dir, session_data_calls, clock):
+    cache = IdentityCache(60)
+    identities = cache.get()[1]
+    clock[0] += 61
+    assert cache.get()[1] is identities
+    cache.refresh_thread.join()
+    assert len(session_data_calls) == 2
+    assert cache.get()[1] is not identities
+
+
+def test_invalidate_identities(app_dir, session_data_calls):
+    cache = IdentityCache(60)
+    cache.get()
+    invalidate_identities()
+    cache.get()
+    assert len(session_data_calls) == 2
+    cache.invalidate()
+    cache.get()
+    assert len(session_data_calls) == 3
+
+
+def test_ended_session_clears_identities(app_dir, session_data_calls):
+    cache = IdentityCache(60)
+    cache.get()
+    os.remove(app_dir / "session")
+    assert cache.get() == (None, [])
+
+
+def test_watch_session(mocker, app_dir, session_data_calls):
+    polled = threading.Event()
+    end = threading.Event()
+
+    def pairing_status(self, wait=False):
+        assert wait
+        polled.set()
+        end.wait(5)
+        os.remove(app_dir / "session")
+        return False
+
+    mocker.patch("chiff.session.Session.pairing_status", pairing_status)
+    cache = IdentityCache(60, watch=True)
+    session = cache.get()[0]
+    assert session.id == "test-session-id"
+    assert polled.wait(5)
+    assert cache.get()[0] is session
+    end.set()
+    cache.watch_thread.join(5)
+    assert cache.session is None
+    assert cache.get() == (None, [])
+
+
+def test_find_identity(app_dir, session_data_calls, clock):
+    cache = IdentityCache(60)
+    session, identity = cache.find(ECDSA_PUB_KEY, KeyType.ECDSA256)
+    assert identity.id == "identity_id"
+    assert len(session_data_calls) == 1
+    session, identity = cache.find(PUB_KEY, KeyType.ED25519)
+    assert session and not identity
+    assert len(session_data_calls) == 1
+    clock[0] += MISS_REFRESH_INTERVAL
+    session, identity = cache.find(PUB_KEY, KeyType.ED25519)
+    assert session and not identity
+    assert len(session_data_calls) == 2
+    # Unknown keys don't refresh the identities on every request.
+    for _ in range(10):
+        assert cache.find(PUB_KEY, KeyType.ED25519)[1] is None
+    assert len(session_data_calls) == 2
@@ -7,6 +7,8 @@ from tests.test_helper import (
 )
 from chiff import crypto
 from nacl import signing, encoding, public
+import pytest
+import random
 
 
 def test_test_generate_seed():
@@ -56,6 +58,40 @@ def test_encrypt_and_decrypt():
     assert crypto.decrypt(encrypted, key) == message
 
 
+def test_session_cipher():
+    key = SEED + SEED
+    cipher = crypto.SessionCipher(key)
+    message = b"Hello!"
+    assert cipher.decrypt(cipher.encrypt(message)) == message
+    assert crypto.decrypt(cipher.encrypt(message), key) == message
+    assert cipher.decrypt(crypto.encrypt(message, key)) == message
+
+
+def test_session_cipher_many():
+    cipher = crypto.SessionCipher(SEED + SEED)
+    messages = [f"Hello {i}!".encode("utf-8") for i in range(10)]
+    encrypted = cipher.encrypt_many(messages)
+    assert len(set(encrypted)) == len(messages)
+    assert cipher.decrypt_many(encrypted) == messages
+
+
+def test_decrypt_many():
+    key = SEED + SEED
+    messages = [f"Hello {i}!".encode("utf-8") for i in range(10)]
+    encrypted = [crypto.encrypt(message, key) for message in messages]
+    assert crypto.decrypt_many(encrypted, key) == messages
+    assert crypto.decrypt_many([], key) == []
+
+
+def test_decrypt_many_parallel():
+    key = SEED + SEED
+    count = crypto.PARALLEL_DECRYPT_THRESHOLD + 3
+    messages = [f"Hello {i}!".encode("utf-8") for i in range(count)]
+    encrypted = [crypto.encrypt(message, key) for message in messages]
+    assert crypto.decrypt_many(encrypted, key, workers=4) == messages
+    assert crypto.decrypt_many(encrypted, key, workers=1) == messages
+
+
 def test_decrypt_anonymous():
     message = b"Hello!Hello!Hello!Hello!Hello!Hello!Helloasoudhasoudhaoishdaosidhj"
     key = public.PrivateKey(SEED + SEED)
@@ -114,3 +150,43 @@ def test_to_default_base64():
 
 def test_from_base64():
     assert crypto.from_base64(BASE64_PUB_KEY) == PUB_KEY
+
+
+def reference_pad(src):
+    """The padding as the app does it."""
+    pad_size = crypto.PADDING_BLOCK_SIZE - len(src) % crypto.PADDING_BLOCK_SIZE
+    return src + b"\x80" + b"\x00" * (pad_size - 1)
+
+
+def random_messages():
+    rng = random.Random(42)
+    sizes = [0, 1, 198, 199, 200, 201, 399, 400, 401] + [
+        rng.randrange(2000) for _ in range(200)
+    ]
+    for size in sizes:
+        # Include the padding bytes themselves in the messages.
+        yield bytes(rng.choice([0x00, 0x80, rng.randrange(256)]) for _ in range(size))
+
+
+def test_pad_and_unpad():
+    for message in random_messages():
+        padded = crypto.pad(message)
+        assert padded == reference_pad(message)
+        assert len(padded) % crypto.PADDING_BLOCK_SIZE == 0
+        assert len(padded) > len(message)
+        assert crypto.unpad(padded) == message
+
+
+@pytest.mark.parametrize(
+    "padded",
+    [
+        b"",
+        b"message",
+        b"message" + bytes(193),
+        b"message\x80" + bytes(191) + b"\x01",
+        b"message\x80" + b"\x00\x80\x01" + bytes(189),
+    ],
+)
+def test_unpad_invalid(padded):
+    with pytest.raises(ValueError, match="Invalid padding"):
+        crypto.unpad(padded)
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules that are only needed by some commands, and should be imported on demand.
+HEAVY_MODULES = [
+    "pykeepass",
+    "lxml",
+    "tabulate",
+    "qrcode",
+    "PIL",
+    "tldextract",
+    "numpy",
+]
+# Generous, so the test only fails on real regressions on slow machines.
+IMPORT_BUDGET = 1.0
+
+
+def run_with_importtime(code, *args, home):
+    """Run python code and return the cumulative import time per top-level module in
+    seconds."""
+    env = dict(os.environ, HOME=str(home))
+    env.pop("XDG_CONFIG_HOME", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, *args],
+        input="n\n",
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        if cumulative.strip().isdigit():
+            imports[module.strip()] = int(cumulative) / 1e6
+    return imports
+
+
+@pytest.mark.parametrize(
+    "code, args, allowed",
+    [
+        ("from chiff.main import main; main()", ["get", "-i", "id"], []),
+        ("from chiff.main import main; main()", ["accounts"], []),
+        ("from chiff.main import main; main()", ["status"], ["tabulate"]),
+        ("from chiff.main import main; main()", ["--help"], []),
+        ("import chiff.socket", [], []),
+    ],
+)
+def test_command_imports(tmp_path, code, args, allowed):
+    imports = run_with_importtime(code, *args, home=tmp_path)
+    entry_point = code.split()[1]
+    assert entry_point in imports
+    assert imports[entry_point] < IMPORT_BUDGET
+    assert [
+        module
+        for module in HEAVY_MODULES
+        if module in imports and module not in allowed
+    ] == []
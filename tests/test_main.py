@@ -13,7 +13,10 @@ from tests.test_helper import (
     PAIR_CLI_PUB_KEY_B64,
     SHARED_KEY,
     get_sqs_message,
+    sample_ppd,
 )
+from chiff.password_validator import PasswordValidator
+from chiff.session import Session
 import pytest
 from pytest_mock import MockerFixture
 
@@ -238,6 +241,89 @@ def test_add_account(
     assert expected in result.output
 
 
+def test_add_account_with_generated_password(mocker, tmp_path, get_session_data):
+    mocker.patch("chiff.session.Session.pairing_status", lambda x: True)
+    mocker.patch("chiff.api.get_session_data", get_session_data)
+    mocker.patch(
+        "chiff.api.get_from_sqs",
+        get_sqs_message(
+            crypto.encrypt(
+                json.dumps({"b": 42, "t": MessageType.ADD.value}).encode("utf-8"),
+                SHARED_KEY,
+            )
+        ),
+    )
+    send_request = mocker.spy(Session, "send_request")
+    ppd = sample_ppd(8, 12, 2)
+    ppd_path = tmp_path / "ppd.json"
+    ppd_path.write_text(json.dumps(ppd))
+    result = CliRunner().invoke(
+        main,
+        ["add", "-u", "username", "-s", "example-site", "-l", "https://example.com"]
+        + ["-g", "--ppd", str(ppd_path)],
+    )
+    assert not result.exception
+    assert "Account created with id" in result.output
+    password = send_request.call_args.args[1]["p"]
+    assert len(password) == 12
+    assert PasswordValidator(ppd).validate(password)
+
+
+IMPOSSIBLE_PPD = sample_ppd(
+    8, 12, 0, [{"minOccurs": 20, "maxOccurs": None, "name": "Numbers"}]
+)
+
+
+def test_add_account_with_impossible_ppd(tmp_path):
+    ppd_path = tmp_path / "ppd.json"
+    ppd_path.write_text(json.dumps(IMPOSSIBLE_PPD))
+    result = CliRunner().invoke(
+        main,
+        ["add", "-u", "username", "-s", "example-site", "-l", "https://example.com"]
+        + ["-g", "--ppd", str(ppd_path)],
+    )
+    assert result.exit_code == 1
+    assert isinstance(result.exception, SystemExit)
+    assert "Error: Could not generate a password for this PPD." in result.output
+
+
+@pytest.mark.parametrize(
+    "test_input",
+    [["-p", "p@ssword", "-g"], ["--ppd", "-"]],
+)
+def test_add_account_invalid_password_options(test_input):
+    result = CliRunner().invoke(
+        main,
+        ["add", "-u", "username", "-s", "example-site", "-l", "https://example.com"]
+        + test_input,
+    )
+    assert result.exit_code == 2
+
+
+def test_generate(tmp_path):
+    ppd = sample_ppd(8, 16, 2)
+    ppd_path = tmp_path / "ppd.json"
+    ppd_path.write_text(json.dumps(ppd))
+    result = CliRunner().invoke(main, ["generate", "--ppd", str(ppd_path), "-c", "5"])
+    assert not result.exception
+    passwords = result.output.splitlines()
+    assert len(passwords) == 5
+    assert all(len(password) == 16 for password in passwords)
+    assert all(PasswordValidator(ppd).validate(password) for password in passwords)
+    result = CliRunner().invoke(main, ["generate", "--ppd", str(ppd_path), "-l", "20"])
+    assert result.exit_code == 2
+    assert "between 8 and 16" in result.output
+
+
+def test_generate_with_impossible_ppd(tmp_path):
+    ppd_path = tmp_path / "ppd.json"
+    ppd_path.write_text(json.dumps(IMPOSSIBLE_PPD))
+    result = CliRunner().invoke(main, ["generate", "--ppd", str(ppd_path)])
+    assert result.exit_code == 1
+    assert isinstance(result.exception, SystemExit)
+    assert "Error: Could not generate a password for this PPD." in result.output
+
+
 @pytest.mark.parametrize(
     "test_input, prompted_input, expected",
     [
@@ -302,6 +388,12 @@ def test_update_account(
             None,
             "Sending 2 accounts to phone...",
         ),
+        (
+            ["csv", "-j", "2"],
+            "test.csv",
+            None,
+            "Sending 3 accounts to phone...",
+        ),
         (
             ["json"],
             "test.json",
@@ -353,6 +445,77 @@ def test_imports_accounts(
     assert expected in result.output
 
 
+def test_import_accounts_in_one_upload(mocker, get_session_data):
+    mocker.patch("chiff.session.Session.pairing_status", lambda x: True)
+    mocker.patch("chiff.api.get_session_data", get_session_data)
+    upload = mocker.patch("chiff.api.send_bulk_accounts")
+    send_request = mocker.patch.object(
+        Session, "send_request", return_value={"b": 42, "t": 0}
+    )
+    result = CliRunner().invoke(
+        main, ["import", "-f", "csv", "-p", "tests/resources/test.csv"]
+    )
+    assert "3 accounts successfully imported!" in result.output
+    assert upload.call_count == 1
+    message = json.loads(crypto.decrypt(upload.call_args.args[0], SHARED_KEY))
+    assert len(message["b"]) == 3
+    assert send_request.call_args.args[0]["x"] == 3
+
+
+@pytest.mark.parametrize(
+    "prompted_input, expected",
+    [
+        ("y\n", "Sending 3 accounts to phone..."),
+        ("n\n", "Aborted!"),
+    ],
+)
+def test_import_accounts_with_audit(mocker, get_session_data, prompted_input, expected):
+    mocker.patch("chiff.session.Session.pairing_status", lambda x: True)
+    mocker.patch("chiff.api.get_session_data", get_session_data)
+    mocker.patch("chiff.api.get_ppd", return_value=sample_ppd(10, 32))
+    mocker.patch(
+        "chiff.api.get_from_sqs",
+        get_sqs_message(
+            crypto.encrypt(
+                json.dumps({"b": 42, "t": MessageType.ADD_BULK.value}).encode("utf-8"),
+                SHARED_KEY,
+            )
+        ),
+    )
+    result = CliRunner().invoke(
+        main,
+        ["import", "-f", "csv", "-p", "tests/resources/test.csv", "--audit"],
+        input=prompted_input,
+    )
+    assert "Test2 (usuario): too short" in result.output
+    assert "of 3 passwords don't satisfy" in result.output
+    assert expected in result.output
+
+
+def test_import_accounts_with_audit_fetch_errors(mocker, get_session_data):
+    mocker.patch("chiff.session.Session.pairing_status", lambda x: True)
+    mocker.patch("chiff.api.get_session_data", get_session_data)
+    mocker.patch("chiff.api.get_ppd", side_effect=Exception("Error 500: Error"))
+    mocker.patch(
+        "chiff.api.get_from_sqs",
+        get_sqs_message(
+            crypto.encrypt(
+                json.dumps({"b": 42, "t": MessageType.ADD_BULK.value}).encode("utf-8"),
+                SHARED_KEY,
+            )
+        ),
+    )
+    result = CliRunner().invoke(
+        main, ["import", "-f", "csv", "-p", "tests/resources/test.csv", "--audit"]
+    )
+    assert "Could not fetch the password policy of the site of 3 accounts" in (
+        result.output
+    )
+    assert "Test2 (usuario)" in result.output
+    assert "All passwords satisfy" not in result.output
+    assert "Sending 3 accounts to phone..." in result.output
+
+
 @pytest.mark.parametrize(
     "test_input, expected, pub_key",
     [
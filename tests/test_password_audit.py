@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from tests import test_helper
+from chiff import password_audit
+from chiff.password_audit import audit
+from chiff.password_validator import PasswordValidator
+
+POSITION_RESTRICTIONS = [
+    {"positions": "0,-1,30", "minOccurs": 1, "maxOccurs": 2, "characterSet": "Specials"}
+]
+REQUIREMENT_GROUPS = [
+    {
+        "minRules": 2,
+        "requirementRules": [
+            {"positions": "-1", "minOccurs": 1, "characterSet": "Numbers"},
+            {"minOccurs": 2, "maxOccurs": 3, "characterSet": "UpperLetters"},
+            {"minOccurs": 1, "characterSet": "Unknown"},
+        ],
+    }
+]
+PPDS = [
+    None,
+    test_helper.sample_ppd(4, 32, 2),
+    test_helper.sample_ppd(
+        0, 20, 1, [{"minOccurs": 1, "maxOccurs": 3, "name": "Numbers"}]
+    ),
+    test_helper.sample_ppd(8, 40, 3, None, POSITION_RESTRICTIONS, REQUIREMENT_GROUPS),
+]
+
+numpy_required = pytest.mark.skipif(
+    password_audit.numpy is None, reason="NumPy is not installed"
+)
+
+
+@pytest.fixture(scope="module")
+def passwords():
+    rng = random.Random(42)
+    characters = "abcdxyzABCDXYZ0123!@ €😀"
+    return [
+        "".join(rng.choice(characters) for _ in range(rng.randrange(45)))
+        for _ in range(3000)
+    ] + ["", "aaaa", "abcd", "1234", "Password123", "a" * 1000]
+
+
+@pytest.mark.parametrize("ppd", PPDS)
+@pytest.mark.parametrize("vectorize", [False, pytest.param(True, marks=numpy_required)])
+def test_audit_matches_validator(passwords, ppd, vectorize):
+    validator = PasswordValidator(ppd)
+    reasons = audit(passwords, ppd, vectorize)
+    assert len(reasons) == len(passwords)
+    assert [not r for r in reasons] == [validator.validate(p) for p in passwords]
+
+
+@numpy_required
+@pytest.mark.parametrize("ppd", PPDS)
+def test_vectorized_audit_matches_python(mocker, passwords, ppd):
+    mocker.patch("chiff.password_audit.AUDIT_CHUNK_SIZE", 500)
+    assert audit(passwords, ppd, True) == audit(passwords, ppd, False)
+
+
+@pytest.mark.parametrize("vectorize", [False, pytest.param(True, marks=numpy_required)])
+def test_audit_reasons(vectorize):
+    ppd = test_helper.sample_ppd(
+        8,
+        12,
+        2,
+        [{"minOccurs": 1, "maxOccurs": None, "name": "Numbers"}],
+        POSITION_RESTRICTIONS,
+    )
+    reasons = audit(
+        ["!Password1!", "!pass!", "!Password€!", "!Passsword!", "!Pabcword1!", ""],
+        ppd,
+        vectorize,
+    )
+    assert reasons == [
+        [],
+        [password_audit.TOO_SHORT, password_audit.CHARACTER_SETS],
+        [password_audit.INVALID_CHARACTERS, password_audit.CHARACTER_SETS],
+        [password_audit.REPEATED_CHARACTERS, password_audit.CHARACTER_SETS],
+        [password_audit.ORDERED_CHARACTERS],
+        [
+            password_audit.TOO_SHORT,
+            password_audit.CHARACTER_SETS,
+            password_audit.POSITIONS,
+        ],
+    ]
+
+
+def test_audit_without_passwords():
+    assert audit([], None) == []
@@ -0,0 +1,146 @@
+import pytest
+
+from tests import test_helper
+from chiff import password_validator
+from chiff.password_generator import (
+    PasswordGenerationError,
+    PasswordGenerator,
+    RandomSource,
+)
+
+CHARACTER_SET_SETTINGS = [
+    {"minOccurs": 1, "maxOccurs": 2, "name": "Specials"},
+    {"minOccurs": 2, "maxOccurs": None, "name": "UpperLetters"},
+]
+POSITION_RESTRICTIONS = [
+    {"positions": "0", "minOccurs": 1, "maxOccurs": 1, "characterSet": "UpperLetters"},
+    {"positions": "1,2", "minOccurs": 0, "maxOccurs": 0, "characterSet": "Numbers"},
+]
+REQUIREMENT_GROUPS = [
+    {
+        "minRules": 2,
+        "requirementRules": [
+            {
+                "positions": "-1,-2",
+                "minOccurs": 2,
+                "maxOccurs": 2,
+                "characterSet": "Numbers",
+            },
+            {"minOccurs": 3, "maxOccurs": None, "characterSet": "LowerLetters"},
+            {"minOccurs": 1, "maxOccurs": 1, "characterSet": "Specials"},
+        ],
+    }
+]
+
+
+@pytest.mark.parametrize(
+    "ppd",
+    [
+        None,
+        test_helper.sample_ppd(8, 32),
+        test_helper.sample_ppd(8, 12, 1),
+        test_helper.sample_ppd(8, 10, 2, CHARACTER_SET_SETTINGS),
+        test_helper.sample_ppd(8, 32, None, None, POSITION_RESTRICTIONS),
+        test_helper.sample_ppd(8, 32, 2, None, None, REQUIREMENT_GROUPS),
+        test_helper.sample_ppd(
+            8,
+            12,
+            2,
+            CHARACTER_SET_SETTINGS,
+            POSITION_RESTRICTIONS,
+            REQUIREMENT_GROUPS,
+        ),
+    ],
+)
+def test_generated_passwords_are_valid(ppd):
+    generator = PasswordGenerator(ppd)
+    validator = password_validator.PasswordValidator(ppd)
+    passwords = [generator.generate() for _ in range(200)]
+    assert all(validator.validate(password) for password in passwords)
+    assert len(set(passwords)) == len(passwords)
+
+
+def test_generate_default_length():
+    assert len(PasswordGenerator(None).generate()) == 22
+    assert len(PasswordGenerator(test_helper.sample_ppd(8, 12)).generate()) == 12
+    assert len(PasswordGenerator(test_helper.sample_ppd(30, 40)).generate()) == 30
+
+
+def test_generate_length():
+    generator = PasswordGenerator(test_helper.sample_ppd(8, 32))
+    assert len(generator.generate(16)) == 16
+    with pytest.raises(ValueError, match="between 8 and 32"):
+        generator.generate(33)
+
+
+def test_generate_impossible_ppd():
+    character_set_settings = [{"minOccurs": 20, "maxOccurs": None, "name": "Numbers"}]
+    generator = PasswordGenerator(
+        test_helper.sample_ppd(8, 12, 0, character_set_settings)
+    )
+    with pytest.raises(PasswordGenerationError, match="Could not generate a password"):
+        generator.generate()
+
+
+def test_generate_min_length_exceeds_max_length():
+    generator = PasswordGenerator(test_helper.sample_ppd(16, 12))
+    with pytest.raises(PasswordGenerationError, match="exceeds its maximum length"):
+        generator.generate()
+
+
+@pytest.mark.parametrize(
+    "character_set_settings, requirement_groups",
+    [
+        (
+            [{"minOccurs": 1, "maxOccurs": 1, "name": "Specials"}],
+            [
+                {
+                    "minRules": 4,
+                    "requirementRules": [
+                        {"minOccurs": 1, "maxOccurs": None, "characterSet": name}
+                        for name in (
+                            "LowerLetters",
+                            "UpperLetters",
+                            "Numbers",
+                            "Specials",
+                        )
+                    ],
+                }
+            ],
+        ),
+        (
+            [{"minOccurs": 2, "maxOccurs": 2, "name": "Numbers"}],
+            [
+                {
+                    "minRules": 1,
+                    "requirementRules": [
+                        {"minOccurs": 2, "maxOccurs": None, "characterSet": "Numbers"}
+                    ],
+                }
+            ],
+        ),
+    ],
+)
+def test_generate_rules_on_same_characters(
+    mocker, character_set_settings, requirement_groups
+):
+    # Rules on the same characters share their reserved positions, so the first
+    # attempt is valid instead of exceeding maxOccurs.
+    mocker.patch("chiff.password_generator.MAX_GENERATION_ATTEMPTS", 1)
+    ppd = test_helper.sample_ppd(
+        8, 20, None, character_set_settings, None, requirement_groups
+    )
+    generator = PasswordGenerator(ppd)
+    validator = password_validator.PasswordValidator(ppd)
+    assert all(validator.validate(generator.generate()) for _ in range(500))
+
+
+def test_random_source():
+    random = RandomSource()
+    values = [random.below(3) for _ in range(3000)]
+    assert set(values) == {0, 1, 2}
+    assert all(700 < values.count(value) < 1300 for value in range(3))
+    assert all(0 <= random.below(1000) < 1000 for _ in range(1000))
+    assert sorted(random.sample(range(10), 10)) == list(range(10))
+    with pytest.raises(ValueError):
+        random.below(0)
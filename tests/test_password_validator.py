@@ -1,3 +1,8 @@
+from itertools import product
+import re
+
+import pytest
+
 from tests import test_helper
 from chiff import password_validator
 
@@ -149,3 +154,111 @@ def test_validate_should_return_false_if_requirement_group_is_not_met():
     assert validator.validate("Password123")  # follows both
     assert not validator.validate("Password")  # follows rule1 not rule2
     assert not validator.validate("password123")  # follows rule2 not rule1
+
+
+def test_validate_without_ppd():
+    validator = password_validator.PasswordValidator(None)
+
+    assert validator.validate("Password123")
+    assert not validator.validate("Password-123")
+    assert not validator.validate("short")
+
+
+def test_compile_ppd():
+    position_restriction = [
+        {"positions": "0,-1", "minOccurs": 1, "maxOccurs": 2, "characterSet": "Numbers"}
+    ]
+    ppd = test_helper.sample_ppd(8, 32, 3, None, position_restriction)
+    policy = password_validator.compile_ppd(ppd)
+
+    assert policy.min_length == 8
+    assert policy.max_length == 32
+    assert policy.max_consecutive == 3
+    assert "a" in policy.characters and "€" not in policy.characters
+    assert policy.position_rules == ((((0, -1)), frozenset("0123456789"), 1, 2),)
+    with pytest.raises(AttributeError):
+        policy.max_length = 64
+
+
+def test_validate_ignores_positions_beyond_the_password():
+    position_restriction = [
+        {"positions": "40", "minOccurs": 0, "maxOccurs": 0, "characterSet": "Numbers"}
+    ]
+    ppd = test_helper.sample_ppd(8, 50, None, None, position_restriction)
+    validator = password_validator.PasswordValidator(ppd)
+
+    assert validator.validate("Password123")
+
+
+# Characters around the edges of the ordered character set: "/" precedes "0", "{"
+# follows "z" and "€" is outside of ASCII.
+SCAN_ALPHABET = "abc{z/0€"
+SCAN_MAX_LENGTH = 5
+
+
+def reference_check_consecutive_characters(password, characters, max_consecutive):
+    """The previous implementation, with a regex."""
+    escaped_chars = re.escape(characters)
+    return (
+        re.search(r"([%s])\1{%d,}" % (escaped_chars, max_consecutive), password) is None
+    )
+
+
+def reference_check_consecutive_characters_order(password, max_consecutive):
+    """The previous implementation, with a list of code points."""
+    last_value = 255
+    longest_sequence = 0
+    counter = 1
+    character_bytes = list(
+        map(
+            lambda x: ord(x),
+            list("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0987654321"),
+        )
+    )
+    for letter in password:
+        value = ord(letter)
+        if value == last_value + 1 and value in character_bytes:
+            counter += 1
+        else:
+            counter = 1
+        last_value = value
+        if counter > longest_sequence:
+            longest_sequence = counter
+
+    return longest_sequence <= max_consecutive
+
+
+def test_scan_runs_matches_reference():
+    for length in range(SCAN_MAX_LENGTH + 1):
+        for characters in product(SCAN_ALPHABET, repeat=length):
+            password = "".join(characters)
+            repeated, ordered = password_validator.scan_runs(password)
+            for max_consecutive in range(1, length + 1):
+                assert (repeated <= max_consecutive) == (
+                    reference_check_consecutive_characters(
+                        password, SCAN_ALPHABET, max_consecutive
+                    )
+                ), password
+                assert (ordered <= max_consecutive) == (
+                    reference_check_consecutive_characters_order(
+                        password, max_consecutive
+                    )
+                ), password
+
+
+@pytest.mark.parametrize(
+    "password, runs",
+    [
+        ("", (0, 0)),
+        ("a", (1, 1)),
+        ("aaab", (3, 2)),
+        ("abcdd", (2, 4)),
+        ("/01", (1, 3)),
+        ("yz{", (1, 2)),
+        ("9:;", (1, 1)),
+        ("XYZ[", (1, 3)),
+        ("€€€", (3, 1)),
+    ],
+)
+def test_scan_runs(password, runs):
+    assert password_validator.scan_runs(password) == runs
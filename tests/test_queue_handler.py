@@ -1,4 +1,19 @@
-from chiff.queue_handler import QueueHandler
+import json
+import queue as queue_module
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+from requests_mock import ANY
+
+from chiff.api import get_from_sqs
+from chiff.queue_handler import (
+    BACKOFF_BASE,
+    MIN_RETRIES,
+    QueueHandler,
+    ResponseDispatcher,
+)
 from tests.test_helper import (
     SEED,
 )
@@ -43,3 +58,212 @@ def test_queue_handler_start_return_second_time(mocker):
     handler = QueueHandler(signing_keypair, "dev", "volatile")
     messages = handler.start(True, 1)
     assert len(messages) == 1
+
+
+@pytest.fixture
+def fake_queue(mocker, requests_mock):
+    """A fake queue endpoint that holds every poll for its wait time on a fake
+    clock, and returns the messages that are due."""
+    now = [0.0]
+    queue = {"due": None, "wait_times": []}
+    mocker.patch("chiff.api.get_from_sqs", get_from_sqs)
+    mocker.patch("chiff.queue_handler.monotonic", lambda: now[0])
+    mocker.patch(
+        "chiff.queue_handler.sleep",
+        lambda seconds: now.__setitem__(0, now[0] + seconds),
+    )
+    signing_keypair = crypto.create_signing_keypair(SEED + SEED)
+
+    def poll(request, context):
+        message = json.loads(
+            crypto.from_base64(parse_qs(urlparse(request.url).query)["m"][0])
+        )
+        wait_time = message["waitTime"]
+        queue["wait_times"].append(wait_time)
+        due = queue["due"]
+        if due is not None and due <= now[0] + wait_time:
+            now[0] = max(now[0], due)
+            return {"messages": ["dummy-message"]}
+        now[0] += wait_time
+        return {"messages": []}
+
+    requests_mock.get(ANY, json=poll)
+    queue["handler"] = QueueHandler(signing_keypair, "dev", "volatile")
+    queue["now"] = now
+    return queue
+
+
+def test_queue_handler_polls_for_hours(fake_queue):
+    fake_queue["due"] = 3 * 60 * 60
+    messages = fake_queue["handler"].start(True)
+    assert messages == ["dummy-message"]
+    assert set(fake_queue["wait_times"]) == {20}
+    assert fake_queue["handler"].polls == len(fake_queue["wait_times"]) == 540
+
+
+def test_queue_handler_increases_wait_time(fake_queue):
+    fake_queue["due"] = 60 * 60
+    fake_queue["handler"].start(False)
+    assert fake_queue["wait_times"][:8] == [0, 1, 2, 4, 8, 16, 20, 20]
+
+
+def test_queue_handler_deadline(fake_queue):
+    messages = fake_queue["handler"].start(True, 2 * 60 * 60 + 5)
+    assert messages == []
+    assert fake_queue["now"][0] == 2 * 60 * 60 + 5
+    assert fake_queue["wait_times"][-1] == 5
+
+
+def test_queue_handler_backs_off_on_connection_errors(mocker, fake_queue):
+    sleeps = []
+    mocker.patch("chiff.queue_handler.sleep", sleeps.append)
+    failures = [requests.ConnectionError("down")] * 3
+
+    def mock_get_from_sqs(keypair, url, wait_time):
+        if failures:
+            raise failures.pop()
+        return {"messages": ["dummy-message"]}
+
+    mocker.patch("chiff.api.get_from_sqs", mock_get_from_sqs)
+    assert fake_queue["handler"].start(True) == ["dummy-message"]
+    assert len(sleeps) == 3
+    assert all(0 <= s <= BACKOFF_BASE * 2 ** (i + 1) for i, s in enumerate(sleeps))
+
+
+def test_queue_handler_polls_once_without_timeout(fake_queue):
+    assert fake_queue["handler"].start(True, 0) == []
+    assert fake_queue["handler"].start(False, 0) == []
+    assert fake_queue["wait_times"] == [20, 0]
+
+
+def test_queue_handler_retries_without_timeout(mocker, fake_queue):
+    failures = [requests.ConnectionError("down")] * MIN_RETRIES
+    wait_times = []
+
+    def mock_get_from_sqs(keypair, url, wait_time):
+        wait_times.append(wait_time)
+        if failures:
+            raise failures.pop()
+        return {"messages": ["dummy-message"]}
+
+    mocker.patch("chiff.api.get_from_sqs", mock_get_from_sqs)
+    assert fake_queue["handler"].start(True, 0) == ["dummy-message"]
+    assert wait_times == [20] * (MIN_RETRIES + 1)
+
+
+def test_queue_handler_raises_after_deadline(mocker, fake_queue):
+    attempts = []
+
+    def mock_get_from_sqs(keypair, url, wait_time):
+        attempts.append(wait_time)
+        raise requests.Timeout("timeout")
+
+    mocker.patch("chiff.api.get_from_sqs", mock_get_from_sqs)
+    with pytest.raises(requests.Timeout):
+        fake_queue["handler"].start(True, 0)
+    assert len(attempts) == MIN_RETRIES + 1
+
+
+def test_queue_handler_pickled_by_older_version(fake_queue):
+    # Older versions only had the keypair and the url.
+    handler = QueueHandler.__new__(QueueHandler)
+    handler.__dict__.update(
+        keypair=fake_queue["handler"].keypair, url=fake_queue["handler"].url
+    )
+    handler.start(True, 0)
+    assert handler.polls == 1
+
+
+class FakeQueue:
+    def __init__(self, *batches):
+        self.batches = list(batches)
+        self.ready = threading.Event()
+
+    def start(self, slow_polling, timeout=None):
+        self.ready.wait(5)
+        if isinstance(self.batches[0], Exception):
+            raise self.batches.pop(0)
+        return self.batches.pop(0) if len(self.batches) > 1 else self.batches[0]
+
+
+def test_dispatcher_routes_responses_by_request_id():
+    queue = FakeQueue(
+        [
+            {"body": '{"b": 2, "p": "second"}', "receiptHandle": "handle-2"},
+            {"body": '{"b": 99}', "receiptHandle": "handle-99"},
+            {"body": '{"b": 1, "p": "first"}', "receiptHandle": "handle-1"},
+        ],
+        [],
+    )
+    deleted = []
+    dispatcher = ResponseDispatcher(queue, json.loads, deleted.extend)
+    first = dispatcher.register(1)
+    second = dispatcher.register(2)
+    queue.ready.set()
+    assert dispatcher.wait(1, first, 5)["p"] == "first"
+    assert dispatcher.wait(2, second, 5)["p"] == "second"
+    assert deleted == ["handle-2", "handle-1"]
+    assert not dispatcher.waiters
+
+
+def test_dispatcher_deletes_unreadable_and_expired_responses(mocker):
+    mocker.patch("chiff.queue_handler.time", lambda: 10_000)
+    queue = FakeQueue(
+        [
+            {"body": "garbage", "receiptHandle": "handle-garbage"},
+            {"body": '{"b": 2, "z": 9000000}', "receiptHandle": "handle-2"},
+            {"body": '{"b": 3, "z": 9500000}', "receiptHandle": "handle-3"},
+            {"body": '{"b": 1}', "receiptHandle": "handle-1"},
+        ],
+        [],
+    )
+    deleted = queue_module.Queue()
+    dispatcher = ResponseDispatcher(queue, json.loads, deleted.put)
+    response = dispatcher.register(1)
+    queue.ready.set()
+    assert dispatcher.wait(1, response, 5) == {"b": 1}
+    assert deleted.get(timeout=5) == ["handle-garbage", "handle-2", "handle-1"]
+
+
+def test_dispatcher_times_out():
+    queue = FakeQueue([])
+    dispatcher = ResponseDispatcher(queue, json.loads, None)
+    response = dispatcher.register(1)
+    queue.ready.set()
+    assert dispatcher.wait(1, response, 0.01) is None
+    assert not dispatcher.waiters
+
+
+def test_dispatcher_raises_poll_errors():
+    queue = FakeQueue(Exception("Error 500: Internal server error"))
+    dispatcher = ResponseDispatcher(queue, json.loads, None)
+    response = dispatcher.register(1)
+    queue.ready.set()
+    with pytest.raises(Exception, match="Error 500"):
+        dispatcher.wait(1, response, 5)
+
+
+def test_dispatcher_long_polls_and_retries(mocker):
+    mocker.patch("chiff.queue_handler.sleep")
+    responses = [
+        requests.ConnectionError("down"),
+        {"messages": [{"body": '{"b": 1}', "receiptHandle": "handle-1"}]},
+    ]
+    wait_times = []
+
+    def mock_get_from_sqs(keypair, url, wait_time):
+        wait_times.append(wait_time)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    mocker.patch("chiff.api.get_from_sqs", mock_get_from_sqs)
+    signing_keypair = crypto.create_signing_keypair(SEED + SEED)
+    handler = QueueHandler(signing_keypair, "dev", "volatile")
+    deleted = []
+    dispatcher = ResponseDispatcher(handler, json.loads, deleted.extend)
+    response = dispatcher.register(1)
+    assert dispatcher.wait(1, response, 5) == {"b": 1}
+    assert wait_times == [20, 20]
+    assert deleted == ["handle-1"]
@@ -0,0 +1,135 @@
+import os
+import socket
+import threading
+from pathlib import Path
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from chiff import socket as chiff_socket
+from chiff.constants import APP_NAME, CONTROL_SOCKET_NAME, MessageType
+from chiff.main import main
+from chiff.remote import RemoteSession
+from chiff.session import Session
+
+
+@pytest.fixture
+def daemon(mocker, get_session_data):
+    mocker.patch("chiff.api.get_session_data", get_session_data)
+    chiff_socket.identity_cache.invalidate()
+    filename = str(Path(click.get_app_dir(APP_NAME), CONTROL_SOCKET_NAME))
+    listener = chiff_socket.listen(filename, 4, 0o600)
+
+    def serve():
+        try:
+            chiff_socket.serve_control(listener, 2)
+        except OSError:
+            pass  # The listener was shut down.
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield filename
+    listener.shutdown(socket.SHUT_RDWR)
+    listener.close()
+    thread.join(5)
+    chiff_socket.identity_cache.invalidate()
+
+
+@pytest.fixture
+def requests_sent(mocker):
+    sent = []
+
+    def send_request(self, request, timeout=None):
+        sent.append((request, timeout, threading.current_thread()))
+        return {"p": "p@ssword", "b": 42, "t": MessageType.GET_DETAILS.value}
+
+    mocker.patch("chiff.session.Session.send_request", send_request)
+    return sent
+
+
+def test_connect_without_daemon():
+    assert RemoteSession.connect() is None
+
+
+def test_connect_to_stale_socket():
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(Path(click.get_app_dir(APP_NAME), CONTROL_SOCKET_NAME)))
+    stale.close()
+    assert RemoteSession.connect() is None
+
+
+def test_control_socket_is_private(daemon):
+    assert Path(daemon).stat().st_mode & 0o777 == 0o600
+
+
+def test_control_socket_is_created_private(mocker, tmp_path):
+    # The permissions must be right when the socket is bound, not changed later.
+    mocker.patch("os.chmod")
+    umask = os.umask(0o022)
+    try:
+        listener = chiff_socket.listen(str(tmp_path / "control"), 4, 0o600)
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(umask)
+    listener.close()
+    assert (tmp_path / "control").stat().st_mode & 0o777 == 0o600
+
+
+@pytest.fixture
+def hung_daemon(mocker):
+    """A control socket that accepts connections, but never answers."""
+    mocker.patch("chiff.remote.CONTROL_TIMEOUT", 0.05)
+    filename = str(Path(click.get_app_dir(APP_NAME), CONTROL_SOCKET_NAME))
+    listener = chiff_socket.listen(filename, 4, 0o600)
+    yield filename
+    listener.close()
+
+
+def test_connect_to_hung_daemon(hung_daemon):
+    assert RemoteSession.connect() is None
+
+
+def test_request_to_hung_daemon(hung_daemon):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(hung_daemon)
+    with pytest.raises(Exception, match="didn't respond in time"):
+        RemoteSession(sock).send_request({"r": MessageType.GET_DETAILS.value}, 0)
+
+
+def test_remote_session_data(daemon, get_session_data):
+    session = RemoteSession.connect()
+    assert session.id == "test-session-id"
+    accounts, identities = session.get_session_data()
+    local_accounts, local_identities = Session.get().get_session_data()
+    assert accounts == local_accounts
+    assert [str(identity) for identity in identities] == [
+        str(identity) for identity in local_identities
+    ]
+    assert session.get_accounts() == local_accounts
+    session.close()
+
+
+def test_remote_send_request(daemon, requests_sent):
+    session = RemoteSession.connect()
+    response = session.send_request({"r": MessageType.GET_DETAILS.value}, 5)
+    assert response["p"] == "p@ssword"
+    request, timeout, thread = requests_sent[0]
+    assert request == {"r": MessageType.GET_DETAILS.value}
+    assert timeout == 5
+    assert thread is not threading.current_thread()
+
+
+def test_remote_error(mocker, daemon, get_empty_tmp_path):
+    session = RemoteSession.connect()
+    mocker.patch("click.get_app_dir", get_empty_tmp_path)
+    Path(get_empty_tmp_path(APP_NAME), "session").unlink()
+    with pytest.raises(Exception, match="There is no active session"):
+        session.get_accounts()
+
+
+def test_get_through_daemon(daemon, requests_sent):
+    result = CliRunner().invoke(main, ["get", "-i", "account_id"])
+    assert not result.exception
+    assert result.output == "p@ssword"
+    assert requests_sent[0][2] is not threading.current_thread()
@@ -6,12 +6,21 @@ from tests.test_helper import (
     SHARED_KEY,
     get_sqs_message,
 )
-from chiff.constants import MessageType
+from chiff.api import get_from_sqs
+from chiff.constants import APP_NAME, PAIRING_STAMP, MessageType
+from chiff.queue_handler import UNCLAIMED_TIMEOUT
 
 from chiff.ssh_key import KeyType
 from nacl import public
+from requests_mock import ANY
 
+import click
 import json
+import os
+import pytest
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
 
 from chiff import crypto
 from chiff.session import Session
@@ -21,6 +30,89 @@ def test_get_session(session):
     assert Session.get().id == session.id
 
 
+def test_session_file(tmp_path, session):
+    session.save(tmp_path / "session")
+    with open(tmp_path / "session") as f:
+        data = json.load(f)
+    assert data["format"] == 1
+    assert crypto.from_base64(data["key"]) == SHARED_KEY
+    assert os.stat(tmp_path / "session").st_mode & 0o777 == 0o600
+    loaded = Session.from_dict(data)
+    assert loaded.to_dict() == session.to_dict()
+    assert loaded.signing_keypair.verify_key == session.signing_keypair.verify_key
+
+
+def test_load_session_until_file_changes(tmp_path, session):
+    session_path = tmp_path / "session"
+    assert Session.load(session_path) is None
+    session.save(session_path)
+    loaded = Session.load(session_path)
+    assert loaded is session
+    data = session.to_dict()
+    data["appVersion"] = "4.0.0"
+    with open(session_path, "w") as f:
+        json.dump(data, f)
+    loaded = Session.load(session_path)
+    assert loaded is not session
+    assert loaded.app_version == "4.0.0"
+    assert Session.load(session_path) is loaded
+    os.remove(session_path)
+    assert Session.load(session_path) is None
+
+
+def test_load_pickled_session(pytestconfig, tmp_path, session):
+    # Pickled by the last version that stored sessions with pickle.
+    legacy_path = pytestconfig.rootpath / "tests" / "resources" / "legacy-session"
+    session_path = tmp_path / "session"
+    session_path.write_bytes(legacy_path.read_bytes())
+    loaded = Session.load(session_path)
+    assert loaded.to_dict() == session.to_dict()
+    assert loaded.pairing_status(True)
+    assert loaded.persistent_queue_handler.polls == 1
+    with open(session_path) as f:
+        assert json.load(f)["id"] == session.id
+
+
+def test_unsupported_session_format(session):
+    data = session.to_dict()
+    data["format"] = 2
+    with pytest.raises(Exception, match="unsupported session format 2"):
+        Session.from_dict(data)
+
+
+def test_pairing_status_checked_once_per_interval(mocker):
+    pairing_status = mocker.patch(
+        "chiff.session.Session.pairing_status", return_value=True
+    )
+    assert Session.get(60)
+    assert Session.get(60)
+    assert pairing_status.call_count == 1
+    assert Session.get(0)
+    assert pairing_status.call_count == 2
+    stamp = os.path.join(click.get_app_dir(APP_NAME), PAIRING_STAMP)
+    os.utime(stamp, (0, 0))
+    assert Session.get(60)
+    assert pairing_status.call_count == 3
+    assert Session.get(None)
+    assert pairing_status.call_count == 3
+
+
+def test_pairing_status_checked_for_new_session(mocker):
+    pairing_status = mocker.patch(
+        "chiff.session.Session.pairing_status", return_value=True
+    )
+    Session.get(60)
+    with open(os.path.join(click.get_app_dir(APP_NAME), PAIRING_STAMP), "w") as f:
+        f.write("other-session-id")
+    Session.get(60)
+    assert pairing_status.call_count == 2
+
+
+def test_get_ended_session(mocker, get_end_session_from_sqs):
+    mocker.patch("chiff.api.get_from_sqs", get_end_session_from_sqs)
+    assert Session.get(0) is None
+
+
 def test_pair(mocker, get_pairing_from_sqs, get_empty_tmp_path):
     mocker.patch(
         "chiff.crypto.generate_keypair",
@@ -34,6 +126,24 @@ def test_pair(mocker, get_pairing_from_sqs, get_empty_tmp_path):
     assert accounts["account_id"]["id"] == "account_id"
 
 
+def test_resume_pairing(mocker, get_pairing_from_sqs, get_empty_tmp_path):
+    mocker.patch(
+        "chiff.crypto.generate_keypair",
+        lambda: (public.PrivateKey(PAIR_CLI_PRIV_KEY), PAIR_CLI_PUB_KEY_B64),
+    )
+    mocker.patch("chiff.crypto.generate_seed", lambda n: PAIRING_SEED)
+    mocker.patch("click.get_app_dir", get_empty_tmp_path)
+    mocker.patch("chiff.api.get_from_sqs", side_effect=RuntimeError)
+    with pytest.raises(RuntimeError):
+        Session.pair()
+    with open(os.path.join(get_empty_tmp_path(APP_NAME), "pairing")) as f:
+        assert json.load(f)["pubKey"] == PAIR_CLI_PUB_KEY_B64
+    mocker.patch("chiff.crypto.generate_keypair", side_effect=AssertionError)
+    mocker.patch("chiff.api.get_from_sqs", get_pairing_from_sqs)
+    session, accounts = Session.pair()
+    assert session.id == "test-session-id"
+
+
 def test_end_session(mocker, session):
     session.end()
 
@@ -52,6 +162,16 @@ def test_ssh_identities(mocker, session, get_session_data):
     assert identities[0].id == "identity_id"
 
 
+def test_unchanged_session_data_is_not_downloaded(mocker, session, get_session_data):
+    session_data = {**get_session_data(), "etag": '"v1"'}
+    get = mocker.patch("chiff.api.get_session_data", return_value=session_data)
+    accounts, identities = session.get_session_data()
+    get.return_value = None
+    assert session.get_session_data()[0] == accounts
+    assert session.get_ssh_identities()[0].id == identities[0].id
+    assert get.call_args.args[2] == '"v1"'
+
+
 def test_get_ssh_identity(mocker, session, get_session_data):
     mocker.patch("chiff.api.get_session_data", get_session_data)
     identity = session.get_ssh_identity(ECDSA_PUB_KEY, KeyType.ECDSA256)
@@ -62,6 +182,19 @@ def test_session_pairing_status(session):
     assert session.pairing_status()
 
 
+@pytest.mark.parametrize("wait, wait_time", [(False, 0), (True, 20)])
+def test_session_pairing_status_wait_time(
+    mocker, requests_mock, session, wait, wait_time
+):
+    mocker.patch("chiff.api.get_from_sqs", get_from_sqs)
+    mock = requests_mock.get(ANY, json={"messages": []})
+    assert session.pairing_status(wait)
+    assert mock.call_count == 1
+    query = parse_qs(urlparse(mock.last_request.url).query)
+    message = json.loads(crypto.from_base64(query["m"][0]))
+    assert message["waitTime"] == wait_time
+
+
 def test_send_request(mocker, session):
     response = {"b": 42, "p": "p@ssword"}
     mocker.patch(
@@ -98,6 +231,89 @@ def test_send_bulk_accounts(mocker, session):
     assert message["r"] == MessageType.ADD_BULK.value
 
 
+def test_send_bulk_accounts_in_one_upload(mocker, session):
+    upload = mocker.patch("chiff.api.send_bulk_accounts")
+    send_request = mocker.patch.object(Session, "send_request")
+    session.send_bulk_accounts([{"u": "username"}])
+    assert upload.call_count == 1
+    message = json.loads(crypto.decrypt(upload.call_args.args[0], SHARED_KEY))
+    assert message == {"t": MessageType.ADD_BULK.value, "b": [{"u": "username"}]}
+    assert send_request.call_args.args[0] == {"r": MessageType.ADD_BULK.value, "x": 1}
+
+
 def test_session_pairing_status_ended(mocker, session, get_end_session_from_sqs):
     mocker.patch("chiff.api.get_from_sqs", get_end_session_from_sqs)
     assert not session.pairing_status()
+
+
+def test_get_ssh_identity_uses_index(mocker, session, get_session_data):
+    get_session_data = mocker.Mock(side_effect=get_session_data)
+    mocker.patch("chiff.api.get_session_data", get_session_data)
+    session.get_ssh_identity(ECDSA_PUB_KEY, KeyType.ECDSA256)
+    identity = session.get_ssh_identity(ECDSA_PUB_KEY, KeyType.ECDSA256)
+    assert identity.id == "identity_id"
+    assert not session.get_ssh_identity(ECDSA_PUB_KEY, KeyType.ED25519)
+    assert get_session_data.call_count == 1
+
+
+def test_send_request_deletes_response_in_background(mocker, session):
+    messages = [
+        {
+            "body": crypto.encrypt(
+                json.dumps({"b": request_id}).encode("utf-8"), SHARED_KEY
+            ),
+            "receiptHandle": f"handle-{request_id}",
+        }
+        for request_id in range(30, 43)
+    ]
+    mocker.patch("chiff.api.get_from_sqs", lambda *args: {"messages": messages})
+    deleted = threading.Event()
+    receipt_handles = []
+
+    def delete(keypair, receipt_handle, env):
+        deleted.wait(5)
+        receipt_handles.append(receipt_handle)
+
+    mocker.patch("chiff.api.delete_from_volatile_queue", delete)
+    message = session.send_request({"r": MessageType.GET_DETAILS.value})
+    assert message["b"] == 42
+    assert not receipt_handles
+    deleted.set()
+    join_threads()
+    assert receipt_handles == ["handle-42"]
+
+
+def test_expired_responses_are_deleted(mocker, session):
+    # A new process deletes responses to old requests right away, and leaves recent
+    # ones for the processes that may still be waiting for them.
+    now = time.time()
+    expired = now - UNCLAIMED_TIMEOUT - 1
+    messages = [
+        {
+            "body": crypto.encrypt(
+                json.dumps({"b": request_id, "z": int(timestamp * 1000)}).encode(
+                    "utf-8"
+                ),
+                SHARED_KEY,
+            ),
+            "receiptHandle": f"handle-{request_id}",
+        }
+        for request_id, timestamp in [
+            (20, expired),
+            (21, now),
+            (22, expired),
+            (42, now),
+        ]
+    ]
+    mocker.patch("chiff.api.get_from_sqs", lambda *args: {"messages": messages})
+    delete = mocker.patch("chiff.api.delete_from_volatile_queue")
+    session.send_request({"r": MessageType.GET_DETAILS.value})
+    join_threads()
+    receipt_handles = [call.args[1] for call in delete.call_args_list]
+    assert receipt_handles == ["handle-20", "handle-22", "handle-42"]
+
+
+def join_threads():
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join()
@@ -0,0 +1,148 @@
+import socket
+import threading
+
+import pytest
+
+from chiff import socket as chiff_socket
+from chiff.constants import SSHMessageType
+from chiff.ssh_key import KeyType
+from chiff.utils import length_and_data
+from tests.test_helper import ECDSA_PUB_KEY
+
+
+def sign_request(pubkey):
+    key_blob = (
+        length_and_data(KeyType.ECDSA256.raw)
+        + length_and_data(KeyType.ECDSA256.curve)
+        + length_and_data(pubkey)
+    )
+    return length_and_data(
+        SSHMessageType.SSH_AGENTC_SIGN_REQUEST.raw
+        + length_and_data(key_blob)
+        + length_and_data(b"challenge")
+        + (0).to_bytes(4, "big")
+    )
+
+
+def identities_request():
+    return length_and_data(SSHMessageType.SSH_AGENTC_REQUEST_IDENTITIES.raw)
+
+
+def receive(client):
+    header = client.recv(4)
+    length = int.from_bytes(header, "big")
+    data = b""
+    while len(data) < length:
+        data += client.recv(length - len(data))
+    return data
+
+
+@pytest.fixture
+def server(tmp_path):
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(str(tmp_path / "s"))
+    listener.listen(4)
+    thread = threading.Thread(
+        target=chiff_socket.serve, args=(listener, None, 2), daemon=True
+    )
+    thread.start()
+
+    def connect():
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(5)
+        client.connect(str(tmp_path / "s"))
+        return client
+
+    yield connect
+    listener.close()
+
+
+def test_identities_served_while_signing_pending(mocker, server, get_session_data):
+    approved = threading.Event()
+    pending = threading.Event()
+
+    def send_request(self, request, timeout=-1):
+        pending.set()
+        approved.wait(5)
+        return None
+
+    mocker.patch("chiff.api.get_session_data", get_session_data)
+    mocker.patch("chiff.session.Session.send_request", send_request)
+    signing_client = server()
+    signing_client.sendall(sign_request(ECDSA_PUB_KEY))
+    assert pending.wait(5)
+
+    identities_client = server()
+    identities_client.sendall(identities_request())
+    response = receive(identities_client)
+    assert response[0] == SSHMessageType.SSH_AGENT_IDENTITIES_ANSWER.value
+    assert int.from_bytes(response[1:5], "big") == 1
+
+    approved.set()
+    assert receive(signing_client) == SSHMessageType.SSH_AGENT_FAILURE.raw
+    signing_client.close()
+    identities_client.close()
+
+
+def test_extension_request_fails(server):
+    client = server()
+    client.sendall(length_and_data(SSHMessageType.SSH_AGENTC_EXTENSION.raw))
+    assert receive(client) == SSHMessageType.SSH_AGENT_FAILURE.raw
+    client.close()
+
+
+def test_frame_reader_splits_pipelined_frames():
+    server_end, client_end = socket.socketpair()
+    frames = [length_and_data(bytes([i]) * i) for i in range(1, 6)]
+    client_end.sendall(b"".join(frames))
+    client_end.close()
+    reader = chiff_socket.FrameReader(server_end, 16)
+    for frame in frames:
+        assert bytes(reader.read()) == frame
+    assert reader.read() is None
+    server_end.close()
+
+
+def test_frame_reader_reassembles_partial_frames():
+    server_end, client_end = socket.socketpair()
+    frame = length_and_data(b"\x0d" + b"x" * 10000)
+
+    def send():
+        for i in range(0, len(frame), 7):
+            client_end.sendall(frame[i : i + 7])
+        client_end.close()
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    reader = chiff_socket.FrameReader(server_end, 8)
+    assert bytes(reader.read()) == frame
+    assert reader.read() is None
+    thread.join()
+    server_end.close()
+
+
+def test_frame_reader_rejects_oversized_frames():
+    server_end, client_end = socket.socketpair()
+    client_end.sendall((chiff_socket.MAX_AGENT_MESSAGE_SIZE + 1).to_bytes(4, "big"))
+    reader = chiff_socket.FrameReader(server_end)
+    with pytest.raises(ValueError):
+        reader.read()
+    client_end.close()
+    server_end.close()
+
+
+def test_handle_connection_answers_pipelined_messages():
+    server_end, client_end = socket.socketpair()
+    count = 5000
+    client_end.sendall(length_and_data(SSHMessageType.SSH_AGENTC_EXTENSION.raw) * count)
+    client_end.shutdown(socket.SHUT_WR)
+    thread = threading.Thread(
+        target=chiff_socket.handle_connection, args=(server_end, None)
+    )
+    thread.start()
+    reader = chiff_socket.FrameReader(client_end)
+    for _ in range(count):
+        assert bytes(reader.read()[4:]) == SSHMessageType.SSH_AGENT_FAILURE.raw
+    thread.join()
+    server_end.close()
+    client_end.close()
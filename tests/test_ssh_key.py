@@ -1,3 +1,7 @@
+import pickle
+
+import pytest
+
 from chiff.ssh_key import Key, KeyType
 from tests.test_helper import (
     ECDSA_PUB_KEY,
@@ -103,3 +107,29 @@ def test_encode_ecdsa_signature_negative():
         + b" m\xda\xf5\xb9\x1f\x90\xb6\x1bTE\x99%&\x1fw\xe3\xc2,-4"
         + b"\xdb\x87\xa1\x98\xbd\xb8S\xa3\xd5\x12Ek"
     )
+
+
+def test_ssh_key_is_immutable():
+    key = Key("someid", PUB_KEY, KeyType.ED25519, "test")
+    with pytest.raises(AttributeError):
+        key.name = "other"
+    with pytest.raises(AttributeError):
+        key.extra = "extra"
+    assert key.name == "test"
+
+
+def test_ssh_key_equality():
+    key = Key("someid", PUB_KEY, KeyType.ED25519, "test")
+    same = Key("otherid", bytearray(PUB_KEY), KeyType.ED25519, "other")
+    assert key == same
+    assert hash(key) == hash(same)
+    assert {key: "value"}[same] == "value"
+    assert key != Key("someid", ECDSA_PUB_KEY, KeyType.ECDSA256, "test")
+
+
+def test_ssh_key_pickle():
+    key = Key("someid", ECDSA_PUB_KEY, KeyType.ECDSA256, "test")
+    copy = pickle.loads(pickle.dumps(key))
+    assert copy == key
+    assert copy.ssh_identity() == key.ssh_identity()
+    assert copy.fingerprint() == key.fingerprint()